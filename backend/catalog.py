@@ -0,0 +1,129 @@
+"""In-process copy of the reference catalogs (Turkish foods and workout exercises).
+
+The curated foods (the seed set) and the exercises are small and read on almost
+every food search and manual log, so each worker loads them once during warm-up
+and serves lookups from memory. Foods loaded by ingest_foods.py can run to
+hundreds of thousands of rows; they stay in Mongo and are found by an indexed
+prefix match on `name_key` once the curated set runs out of matches.
+
+Publishes (see catalog_publish.py) bump a version document in `catalog_meta`;
+every `version_check_seconds` a request triggers a background check of those
+versions, and a changed version is reloaded and swapped in without a restart.
+Requests keep reading the old copy until the new one is complete.
+"""
+import re
+import threading
+import time
+import unicodedata
+
+CATALOG_META_COLLECTION = "catalog_meta"
+CATALOG_COLLECTIONS = ("turkish_foods", "workout_exercises")
+# Seed rows (source "seed", or none from before sources were recorded); everything else was ingested
+CURATED_SOURCES = [None, "seed"]
+
+def catalog_versions(db):
+    """Published version of each catalog collection, as recorded by the last publish"""
+    meta = db[CATALOG_META_COLLECTION].find({"_id": {"$in": list(CATALOG_COLLECTIONS)}})
+    return {doc["_id"]: doc.get("version") for doc in meta}
+
+def normalize_barcode(code):
+    """Digits only, leading zeros dropped, so UPC-A and its EAN-13 form are the same product"""
+    digits = re.sub(r"\D", "", str(code))
+    return digits.lstrip("0") or ("0" if digits else "")
+
+def name_key(name):
+    """Case-, accent- and whitespace-insensitive key used to dedupe foods without a barcode"""
+    decomposed = unicodedata.normalize("NFKD", name.replace("ı", "i").replace("İ", "i"))
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+def name_matcher(text):
+    """Case-insensitive substring match; user input is never compiled as a pattern"""
+    return re.compile(re.escape(text), re.IGNORECASE).search
+
+def _stringify_ids(foods):
+    for food in foods:
+        food["_id"] = str(food.get("_id", ""))
+    return foods
+
+def search_curated(db, search, limit):
+    """Curated foods whose name contains `search`, straight from Mongo (before warm-up has loaded them)"""
+    query = {"source": {"$in": CURATED_SOURCES}}
+    if search:
+        query["name"] = {"$regex": re.escape(search), "$options": "i"}
+    return _stringify_ids(list(db.turkish_foods.find(query).limit(limit)))
+
+def search_ingested(db, search, limit):
+    """Ingested foods whose normalised name starts with `search`, read through the name_key index"""
+    key = name_key(search) if search else ""
+    if not key or limit <= 0:
+        return []
+    query = {"name_key": {"$regex": "^" + re.escape(key)}, "source": {"$nin": CURATED_SOURCES}}
+    return _stringify_ids(list(db.turkish_foods.find(query).limit(limit)))
+
+class Catalog:
+    def __init__(self, version_check_seconds=5):
+        self.version_check_seconds = version_check_seconds
+        self.foods = None
+        self.exercises = None
+        self.versions = {}
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.reloading = False
+
+    @property
+    def loaded(self):
+        return self.foods is not None
+
+    def load(self, db):
+        # Read versions first: a publish landing mid-load is then picked up by the next check
+        versions = catalog_versions(db)
+        foods = _stringify_ids(list(db.turkish_foods.find({"source": {"$in": CURATED_SOURCES}})))
+        exercises = _stringify_ids(list(db.workout_exercises.find()))
+        # Swap both lists at once so readers never see a half-loaded catalog
+        self.foods, self.exercises = foods, exercises
+        self.versions = versions
+        self.loaded_at = self.checked_at = time.monotonic()
+        return len(foods), len(exercises)
+
+    def refresh_if_stale(self, db):
+        if not self.loaded:
+            return
+        now = time.monotonic()
+        if now - self.checked_at < self.version_check_seconds:
+            return
+        with self.lock:
+            if self.reloading:
+                return
+            self.reloading = True
+        threading.Thread(target=self._reload, args=(db,), daemon=True).start()
+
+    def _reload(self, db):
+        try:
+            self.checked_at = time.monotonic()
+            if catalog_versions(db) != self.versions:
+                self.load(db)
+        finally:
+            self.reloading = False
+
+    def search_foods(self, db, search=None, limit=50):
+        """Curated foods containing `search`, topped up with ingested foods starting with it"""
+        if not search:
+            return self.foods[:limit]
+        match = name_matcher(search)
+        results = []
+        for food in self.foods:
+            if match(food["name"]):
+                results.append(food)
+                if len(results) >= limit:
+                    return results
+        return results + search_ingested(db, search, limit - len(results))
+
+    def find_food(self, db, name):
+        """First curated food whose name contains `name`, else the first ingested one starting with it"""
+        match = name_matcher(name)
+        food = next((food for food in self.foods if match(food["name"])), None)
+        if food is None:
+            food = next(iter(search_ingested(db, name, 1)), None)
+        return food
@@ -0,0 +1,63 @@
+"""Gap-free publishing of the reference catalogs.
+
+A publish builds the new catalog in a staging collection, validates it, builds
+its indexes and then renames it over the live collection in one atomic
+renameCollection, so readers see either the old catalog or the new one and
+never an empty or half-written one. The version recorded in `catalog_meta`
+afterwards tells running workers to reload their in-memory copy.
+
+Writes to the live collection made while a publish is building (for example
+an ingest_foods.py run) are replaced by the publish; run them one at a time.
+"""
+from catalog import CATALOG_META_COLLECTION
+from datetime import datetime, timezone
+import uuid
+
+FOOD_FIELDS = {"name": "string", "calories_per_100g": "number", "protein_per_100g": "number",
+               "carbs_per_100g": "number", "fat_per_100g": "number"}
+EXERCISE_FIELDS = {"name": "string", "calories_per_minute": "number"}
+
+def new_version():
+    return f"{datetime.now(timezone.utc):%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+def validate(collection, fields, min_documents=1):
+    """Document count, or ValueError when the staged catalog is too small or has malformed rows"""
+    count = collection.count_documents({})
+    if count < min_documents:
+        raise ValueError(f"{collection.name}: {count} documents, expected at least {min_documents}")
+    malformed = collection.count_documents({"$or": [{field: {"$not": {"$type": kind}}} for field, kind in fields.items()]})
+    if malformed:
+        raise ValueError(f"{collection.name}: {malformed} documents missing one of {', '.join(fields)}")
+    return count
+
+def mark_changed(db, name, version=None, count=None):
+    """Record a new catalog version so workers reload it"""
+    version = version or new_version()
+    update = {"version": version, "published_at": datetime.now(timezone.utc)}
+    if count is not None:
+        update["count"] = count
+    db[CATALOG_META_COLLECTION].update_one({"_id": name}, {"$set": update}, upsert=True)
+    return version
+
+def publish(db, name, documents, fields, carry_over=None, prepare=None, min_documents=1, batch_size=1000):
+    """Replace collection `name` with `documents` atomically; returns the published version.
+
+    `carry_over` is a filter for live documents to keep in the new version (for
+    example rows loaded by other tools); `prepare(collection)` builds indexes on
+    the staging collection before the swap.
+    """
+    version = new_version()
+    staging = db[f"{name}__staging_{version}"]
+    try:
+        if carry_over is not None:
+            db[name].aggregate([{"$match": carry_over}, {"$out": staging.name}])
+        for start in range(0, len(documents), batch_size):
+            staging.insert_many([dict(document) for document in documents[start:start + batch_size]], ordered=False)
+        count = validate(staging, fields, min_documents)
+        if prepare is not None:
+            prepare(staging)
+        staging.rename(name, dropTarget=True)
+    except Exception:
+        staging.drop()
+        raise
+    return mark_changed(db, name, version, count)
@@ -0,0 +1,332 @@
+"""Cold tier for old food and workout logs.
+
+tier_cold_logs.py moves live logs older than COLD_STORAGE_AFTER_DAYS out of
+the hot store (documents or buckets) into gzip-compressed NDJSON files on
+local disk, one file per user and month:
+
+    <COLD_STORAGE_DIR>/food/<user id>/2025-03.ndjson.gz
+
+`TieredLogs` wraps the hot store with the same methods as log_store, so
+history, stats and export read through to the files transparently. Reads whose
+range starts after the tiering horizon never touch the disk, which is the
+common case for the app's dashboards. Only live logs are tiered; tombstones
+stay hot until compact_deleted_logs removes them, and deleting a cold log
+writes a fresh tombstone into the hot store so /api/sync still sees it. A log
+deleted while a tiering run copies it keeps its hot tombstone; the run then
+takes the copy back out, and reads skip cold copies of anything the hot store
+still holds in case it stopped before that. Reads open only the months their
+range (or snapshot page) needs.
+
+Partition rewrites take an exclusive flock and replace the file atomically,
+so concurrent readers never see a partial file and a tiering run can overlap
+with deletes from the API.
+"""
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne
+from urllib.parse import quote, unquote
+import fcntl
+import gzip
+import json
+import os
+
+DATETIME_FIELDS = ("logged_at", "changed_at", "deleted_at")
+SUFFIX = ".ndjson.gz"
+# log id -> month of its cold partition
+COLD_INDEX_COLLECTION = "cold_log_months"
+
+def _utc(moment):
+    # Documents read back without tz_aware carry naive UTC datetimes
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def month_of(moment):
+    return _utc(moment).strftime("%Y-%m")
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return _utc(value).isoformat()
+    return str(value)
+
+def _decode(line):
+    log = json.loads(line)
+    for field in DATETIME_FIELDS:
+        if log.get(field):
+            # Naive UTC, like logs read from Mongo
+            log[field] = datetime.fromisoformat(log[field]).astimezone(timezone.utc).replace(tzinfo=None)
+    return log
+
+class ColdLogs:
+    def __init__(self, root, kind):
+        self.root = root
+        self.kind = kind
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.root, self.kind, quote(user_id, safe=""))
+
+    def _path(self, user_id, month):
+        return os.path.join(self._user_dir(user_id), month + SUFFIX)
+
+    def months(self, user_id):
+        """Months with a partition for the user, oldest first"""
+        try:
+            names = os.listdir(self._user_dir(user_id))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(SUFFIX)] for name in names if name.endswith(SUFFIX))
+
+    def read(self, user_id, month):
+        try:
+            with gzip.open(self._path(user_id, month), "rt", encoding="utf-8") as f:
+                return [_decode(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _write(self, path, logs):
+        temporary = f"{path}.tmp-{os.getpid()}"
+        with open(temporary, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for log in logs:
+                    f.write(json.dumps(log, default=_json_default, ensure_ascii=False).encode("utf-8"))
+                    f.write(b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temporary, path)
+        return os.path.getsize(path)
+
+    def _locked(self, user_id, month):
+        os.makedirs(self._user_dir(user_id), exist_ok=True)
+        lock = open(self._path(user_id, month) + ".lock", "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def append(self, user_id, logs):
+        """Merge logs into their month partitions; returns the partitions' new total size in bytes"""
+        months = {}
+        for log in logs:
+            months.setdefault(month_of(log["logged_at"]), []).append(
+                {key: value for key, value in log.items() if key != "_id"}
+            )
+        written = 0
+        for month, new_logs in months.items():
+            with self._locked(user_id, month):
+                # A run interrupted before evicting from the hot store may re-append the same logs
+                merged = {log["id"]: log for log in self.read(user_id, month)}
+                merged.update((log["id"], log) for log in new_logs)
+                ordered = sorted(merged.values(), key=lambda log: _utc(log["logged_at"]))
+                written += self._write(self._path(user_id, month), ordered)
+        return written
+
+    def size(self, user_id, months):
+        """Bytes on disk of the user's partitions for `months`"""
+        total = 0
+        for month in months:
+            try:
+                total += os.path.getsize(self._path(user_id, month))
+            except FileNotFoundError:
+                pass
+        return total
+
+    def remove(self, user_id, log_id, month):
+        """Take a log out of its month partition; returns it, or None when it is not there"""
+        with self._locked(user_id, month):
+            logs = self.read(user_id, month)
+            kept = [log for log in logs if log["id"] != log_id]
+            if len(kept) == len(logs):
+                return None
+            path = self._path(user_id, month)
+            if kept:
+                self._write(path, kept)
+            else:
+                os.remove(path)
+            return next(log for log in logs if log["id"] == log_id)
+
+    def users(self):
+        """User ids with a directory under this kind"""
+        try:
+            return sorted(unquote(name) for name in os.listdir(os.path.join(self.root, self.kind)))
+        except FileNotFoundError:
+            return []
+
+    def find_months(self, user_id, start=None, end=None, include_images=True, newest_first=False):
+        """(month, cold logs within [start, end)) one partition at a time, in logged_at order"""
+        first = month_of(start) if start is not None else None
+        last = month_of(end - timedelta(microseconds=1)) if end is not None else None
+        start = _utc(start) if start is not None else None
+        end = _utc(end) if end is not None else None
+        months = self.months(user_id)
+        for month in reversed(months) if newest_first else months:
+            if (first and month < first) or (last and month > last):
+                continue
+            logs = []
+            for log in self.read(user_id, month):
+                logged_at = _utc(log["logged_at"])
+                if (start and logged_at < start) or (end and logged_at >= end):
+                    continue
+                if not include_images:
+                    log.pop("image_base64", None)
+                logs.append(log)
+            if newest_first:
+                logs.reverse()
+            yield month, logs
+
+    def find(self, user_id, start=None, end=None, include_images=True):
+        """Cold logs within [start, end), oldest first"""
+        for _, logs in self.find_months(user_id, start, end, include_images):
+            yield from logs
+
+def _month_start(month):
+    return datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+
+def _index_id(user_id, log_id):
+    return f"{user_id}:{log_id}"
+
+class TieredLogs:
+    """A log store whose logs older than `after_days` may live in cold partition files.
+
+    A log is in one tier at a time, except after a tiering run stopped between
+    copying and evicting; the hot copy (live or tombstone) wins then. The
+    cold_log_months collection maps each cold log id to its month, so deletes
+    and existence checks open one partition instead of scanning them all.
+    """
+
+    def __init__(self, hot, cold, after_days):
+        self.hot = hot
+        self.cold = cold
+        self.after_days = after_days
+        self.collection_name = hot.collection_name
+
+    def horizon(self):
+        # Everything logged at or after this is still in the hot store
+        return datetime.now(timezone.utc) - timedelta(days=self.after_days)
+
+    def ensure_indexes(self, db):
+        self.hot.ensure_indexes(db)
+
+    def insert(self, db, logs):
+        self.hot.insert(db, logs)
+
+    def evict(self, db, user_id, log_ids):
+        self.hot.evict(db, user_id, log_ids)
+
+    # ---------- tiering ----------
+
+    def index(self, db, user_id, logs):
+        """Record the cold month of each log"""
+        if logs:
+            db[COLD_INDEX_COLLECTION].bulk_write([
+                UpdateOne({"_id": _index_id(user_id, log["id"])},
+                          {"$set": {"i": log["id"], "m": month_of(log["logged_at"])}}, upsert=True)
+                for log in logs
+            ], ordered=False)
+
+    def archive(self, db, user_id, logs):
+        """Move live hot logs into their cold partitions"""
+        self.cold.append(user_id, logs)
+        # Indexed before the eviction, so every log that left the hot store can be found by id
+        self.index(db, user_id, logs)
+        log_ids = [log["id"] for log in logs]
+        self.hot.evict(db, user_id, log_ids)
+        # Logs deleted since they were read kept their hot tombstone instead of being evicted: drop the cold copy
+        for log_id in self.hot.deleted_ids(db, user_id, log_ids):
+            self._remove_cold(db, user_id, log_id)
+
+    def _months_of(self, db, user_id, log_ids):
+        """log id -> cold month, for the ids in the cold tier"""
+        if not log_ids:
+            return {}
+        ids = [_index_id(user_id, log_id) for log_id in log_ids]
+        return {doc["i"]: doc["m"] for doc in db[COLD_INDEX_COLLECTION].find({"_id": {"$in": ids}})}
+
+    def _remove_cold(self, db, user_id, log_id):
+        month = self._months_of(db, user_id, [log_id]).get(log_id)
+        if month is None:
+            return None
+        log = self.cold.remove(user_id, log_id, month)
+        db[COLD_INDEX_COLLECTION].delete_one({"_id": _index_id(user_id, log_id)})
+        return log
+
+    def _cold_only(self, db, user_id, logs):
+        # Drop cold copies of logs the hot store still holds, live or deleted
+        ids = [log["id"] for log in logs]
+        if not ids:
+            return logs
+        hot = self.hot.live_ids(db, user_id, ids) | self.hot.deleted_ids(db, user_id, ids)
+        return [log for log in logs if log["id"] not in hot] if hot else logs
+
+    # ---------- writes ----------
+
+    def live_ids(self, db, user_id, log_ids):
+        live = self.hot.live_ids(db, user_id, log_ids)
+        return live | set(self._months_of(db, user_id, [log_id for log_id in log_ids if log_id not in live]))
+
+    def deleted_ids(self, db, user_id, log_ids):
+        return self.hot.deleted_ids(db, user_id, log_ids)
+
+    def delete(self, db, user_id, log_id, change):
+        deleted = self.hot.delete(db, user_id, log_id, change)
+        if deleted is not None:
+            return deleted
+        log = self._remove_cold(db, user_id, log_id)
+        if log is None:
+            return None
+        log.pop("image_base64", None)
+        tombstone = {**log, "is_deleted": True, "deleted_at": change["changed_at"], **change}
+        self.hot.insert(db, [tombstone])
+        return tombstone
+
+    # ---------- reads ----------
+
+    def find(self, db, user_id, start=None, end=None, include_images=True, limit=None):
+        logs = self.hot.find(db, user_id, start, end, include_images, limit)
+        horizon = self.horizon()
+        if (start is not None and _utc(start) >= horizon) or (limit and len(logs) >= limit):
+            return logs
+        # Cold logs are all older than the horizon: read their months newest first, only as far as needed
+        cold_end = horizon if end is None else min(_utc(end), horizon)
+        for month, cold in self.cold.find_months(user_id, start, cold_end, include_images, newest_first=True):
+            for log in self._cold_only(db, user_id, cold):
+                log["_id"] = log["id"]
+                logs.append(log)
+            logs.sort(key=lambda log: _utc(log["logged_at"]), reverse=True)
+            # Older months can only add logs older than this one's
+            if limit and len(logs) >= limit and _utc(logs[limit - 1]["logged_at"]) >= _month_start(month):
+                break
+        return logs[:limit] if limit else logs
+
+    def iterate(self, db, user_id, include_images=False, batch_size=500):
+        # Hot, then cold a month at a time: memory follows the largest month, not the history
+        yield from self.hot.iterate(db, user_id, include_images, batch_size)
+        for _, logs in self.cold.find_months(user_id, include_images=include_images):
+            for offset in range(0, len(logs), batch_size):
+                yield from self._cold_only(db, user_id, logs[offset:offset + batch_size])
+
+    def changes(self, db, user_id, since, limit, include_images=False):
+        # Tiering raises compacted_seq past the logs it moves, so older cursors get a full snapshot instead
+        return self.hot.changes(db, user_id, since, limit, include_images)
+
+    def snapshot(self, db, user_id, after, limit, include_images=False):
+        """Hot logs first, then cold ones month by month; positions are ["hot", seq, id] or ["cold", month, seq, id]"""
+        page = []
+        if after is None or after[0] == "hot":
+            page = [(["hot", *position], log) for position, log in
+                    self.hot.snapshot(db, user_id, after[1:] if after else None, limit, include_images)]
+            if len(page) >= limit:
+                return page
+            after = None
+        for month in self.cold.months(user_id):
+            # A page opens the month its position points into, and later ones only to fill up
+            if after is not None and month < after[1]:
+                continue
+            logs = self.cold.read(user_id, month)
+            if after is not None and month == after[1]:
+                logs = [log for log in logs if _cold_position(log) > tuple(after[2:])]
+            logs.sort(key=_cold_position)
+            for log in self._cold_only(db, user_id, logs):
+                if not include_images:
+                    log.pop("image_base64", None)
+                page.append((["cold", month, *_cold_position(log)], log))
+            if len(page) >= limit:
+                return page[:limit]
+        return page
+
+def _cold_position(log):
+    return log.get("change_seq") or 0, log["id"]
@@ -0,0 +1,180 @@
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timezone, timedelta
+import argparse
+import gzip
+import json
+import os
+import time
+import bson
+from dotenv import load_dotenv
+from live_updates import SEQUENCES_COLLECTION
+import log_store
+
+load_dotenv()
+
+mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+database_name = os.getenv("DATABASE_NAME", "apak_fitness")
+client = MongoClient(mongo_url)
+db = client[database_name]
+
+# Soft-deleted logs are kept this long before they are archived and hard-deleted
+COMPACTION_GRACE_DAYS = int(os.getenv("COMPACTION_GRACE_DAYS", "30"))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "500"))
+COMPACTION_PAUSE_SECONDS = float(os.getenv("COMPACTION_PAUSE_SECONDS", "0.5"))
+
+COLLECTIONS = ["food_logs", "workout_logs"]
+# Bucketed logs are compacted too once they are written (LOG_STORAGE=dual or buckets)
+LOG_STORAGE = os.getenv("LOG_STORAGE", "documents")
+
+def deleted_before(cutoff):
+    """Queries for soft-deleted logs past the grace period.
+
+    Logs deleted before `deleted_at` was recorded fall back to `logged_at`.
+    Two queries rather than one $or, so each one can use the partial
+    `deleted_at` index instead of scanning the collection.
+    """
+    return [
+        {"is_deleted": True, "deleted_at": {"$lt": cutoff}},
+        {"is_deleted": True, "deleted_at": {"$exists": False}, "logged_at": {"$lt": cutoff}},
+    ]
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def archive_to_collection(collection_name, docs):
+    # Archive documents keep their _id, so re-running after a crash between
+    # archive and delete only hits duplicate keys for rows already archived
+    try:
+        db[f"{collection_name}_archive"].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+def archive_to_file(archive_dir, collection_name, docs):
+    path = os.path.join(archive_dir, f"{collection_name}_archive.ndjson.gz")
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(doc, default=_json_default, ensure_ascii=False))
+            f.write("\n")
+
+def record_compacted(docs):
+    """Raise each user's compacted_seq past the tombstones just removed.
+
+    /api/sync answers cursors below it with a reset, since the deletes after
+    such a cursor can no longer be replayed.
+    """
+    compacted = {}
+    for doc in docs:
+        if doc.get("change_seq"):
+            compacted[doc["user_id"]] = max(compacted.get(doc["user_id"], 0), doc["change_seq"])
+    for user_id, seq in compacted.items():
+        db[SEQUENCES_COLLECTION].update_one({"_id": user_id}, {"$max": {"compacted_seq": seq}}, upsert=True)
+
+def compact_collection(collection_name, cutoff, batch_size, pause_seconds, archive_dir=None, dry_run=False):
+    """Move soft-deleted logs older than cutoff into the archive in batches, then hard-delete them"""
+    collection = db[collection_name]
+    log_store.DocumentLogs(collection_name).ensure_indexes(db)
+    queries = deleted_before(cutoff)
+    total = sum(collection.count_documents(query) for query in queries)
+    moved = 0
+    reclaimed_bytes = 0
+
+    print(f"🧹 {collection_name}: {total} soft-deleted logs older than {cutoff.isoformat()}")
+    if dry_run or not total:
+        return {"collection": collection_name, "candidates": total, "moved": 0, "reclaimed_bytes": 0}
+
+    for query in queries:
+        while True:
+            docs = list(collection.find(query).limit(batch_size))
+            if not docs:
+                break
+
+            if archive_dir:
+                archive_to_file(archive_dir, collection_name, docs)
+            else:
+                archive_to_collection(collection_name, docs)
+
+            ids = [doc["_id"] for doc in docs]
+            result = collection.delete_many({"_id": {"$in": ids}, "is_deleted": True})
+            record_compacted(docs)
+
+            moved += result.deleted_count
+            reclaimed_bytes += sum(len(bson.encode(doc)) for doc in docs)
+            print(f"   {moved}/{total} moved, {reclaimed_bytes / (1024 * 1024):.2f} MB reclaimed")
+
+            if len(docs) < batch_size:
+                break
+            time.sleep(pause_seconds)
+
+    return {"collection": collection_name, "candidates": total, "moved": moved, "reclaimed_bytes": reclaimed_bytes}
+
+def compact_buckets(kind, cutoff, batch_size, pause_seconds, archive_dir=None, dry_run=False, archive=True):
+    """Archive and pull tombstones deleted before cutoff out of a kind's day buckets"""
+    collection_name, bucket_collection, fields, images_collection = log_store.KINDS[kind]
+    store = log_store.BucketedLogs(bucket_collection, fields, images_collection)
+    moved = 0
+    reclaimed_bytes = 0
+    print(f"🧹 {bucket_collection}: pulling entries deleted before {cutoff.isoformat()}")
+    if dry_run:
+        found = store.count_tombstones_before(db, cutoff)
+        return {"collection": bucket_collection, "candidates": found, "moved": 0, "reclaimed_bytes": 0}
+
+    while True:
+        buckets = store.tombstones_before(db, cutoff, batch_size)
+        if not buckets:
+            break
+        docs = [log for _, _, logs in buckets for log in logs]
+        # In dual mode the document layout archives the same logs
+        if archive and archive_dir:
+            archive_to_file(archive_dir, collection_name, docs)
+        elif archive:
+            archive_to_collection(collection_name, docs)
+        for bucket_id, _, logs in buckets:
+            store.purge(db, bucket_id, [log["id"] for log in logs])
+        record_compacted(docs)
+        moved += len(docs)
+        reclaimed_bytes += sum(store.stored_size(log) for log in docs)
+        print(f"   {moved} entries moved, {reclaimed_bytes / (1024 * 1024):.2f} MB reclaimed")
+        if len(buckets) < batch_size:
+            break
+        time.sleep(pause_seconds)
+
+    return {"collection": bucket_collection, "candidates": moved, "moved": moved, "reclaimed_bytes": reclaimed_bytes}
+
+def run_compaction(grace_days=COMPACTION_GRACE_DAYS, batch_size=COMPACTION_BATCH_SIZE,
+                   pause_seconds=COMPACTION_PAUSE_SECONDS, archive_dir=None, dry_run=False):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=grace_days)
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+    reports = [
+        compact_collection(name, cutoff, batch_size, pause_seconds, archive_dir, dry_run)
+        for name in COLLECTIONS
+    ]
+    if LOG_STORAGE != "documents":
+        reports.extend(
+            compact_buckets(kind, cutoff, batch_size, pause_seconds, archive_dir, dry_run, archive=LOG_STORAGE == "buckets")
+            for kind in log_store.KINDS
+        )
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and hard-delete soft-deleted food and workout logs")
+    parser.add_argument("--grace-days", type=int, default=COMPACTION_GRACE_DAYS)
+    parser.add_argument("--batch-size", type=int, default=COMPACTION_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=COMPACTION_PAUSE_SECONDS, help="seconds to sleep between batches")
+    parser.add_argument("--archive-dir", default=None, help="write gzipped NDJSON here instead of *_archive collections")
+    parser.add_argument("--interval", type=float, default=0, help="repeat every N seconds (0 = run once)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    while True:
+        reports = run_compaction(args.grace_days, args.batch_size, args.pause, args.archive_dir, args.dry_run)
+        moved = sum(report["moved"] for report in reports)
+        reclaimed = sum(report["reclaimed_bytes"] for report in reports)
+        print(f"✅ {moved} logs compacted, {reclaimed / (1024 * 1024):.2f} MB reclaimed")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,105 @@
+"""Group commit for high-rate log inserts.
+
+Concurrent requests hand their documents to a GroupCommitWriter instead of
+each doing its own insert_one round trip. Documents for the same collection
+are buffered until `max_batch` of them are waiting or the oldest has waited
+`max_delay_ms`, then written with one unordered insert_many on a worker
+thread. Every caller awaits its own future, which resolves when its batch is
+acknowledged or raises the error for its own document (a duplicate key fails
+only that document, not the batch).
+
+The write concern of the batch is configurable: w=0 acknowledges nothing, so
+callers return as soon as the batch is sent and never see write errors.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+import asyncio
+import time
+import metrics
+
+def parse_write_concern(w=None, journal=None, wtimeout_ms=None):
+    """WriteConcern from env-style strings ("majority", "1", "true"), or None for the client default"""
+    options = {}
+    if w:
+        options["w"] = int(w) if str(w).isdigit() else w
+    if journal not in (None, ""):
+        options["j"] = str(journal).lower() in ("1", "true", "yes")
+    if wtimeout_ms:
+        options["wtimeout"] = int(wtimeout_ms)
+    return WriteConcern(**options) if options else None
+
+class _Pending:
+    def __init__(self):
+        self.items = []
+        self.timer = None
+
+class GroupCommitWriter:
+    def __init__(self, max_batch=100, max_delay_ms=5, write_concern=None, flush_workers=4):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.write_concern = write_concern
+        # collection name -> _Pending
+        self.pending = {}
+        self.flushing = set()
+        self.executor = ThreadPoolExecutor(max_workers=flush_workers, thread_name_prefix="group-commit")
+
+    async def insert(self, db, collection_name, doc):
+        """Queue doc for the next batch of collection_name and wait until it is written"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.pending.setdefault(collection_name, _Pending())
+        pending.items.append((doc, future, time.perf_counter()))
+        if len(pending.items) >= self.max_batch:
+            self._flush(db, collection_name, "size")
+        elif pending.timer is None:
+            pending.timer = loop.call_later(self.max_delay, self._flush, db, collection_name, "delay")
+        await future
+
+    async def close(self, db):
+        """Write everything still buffered; called on shutdown before the Mongo client closes"""
+        for collection_name in list(self.pending):
+            self._flush(db, collection_name, "close")
+        if self.flushing:
+            await asyncio.gather(*self.flushing, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    def _flush(self, db, collection_name, reason):
+        pending = self.pending.pop(collection_name, None)
+        if pending is None or not pending.items:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        metrics.group_commit_flushes.inc(collection=collection_name, reason=reason)
+        metrics.group_commit_batch_size.observe(len(pending.items), collection=collection_name)
+        task = asyncio.get_running_loop().create_task(self._write(db, collection_name, pending.items))
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    async def _write(self, db, collection_name, items):
+        collection = db[collection_name]
+        if self.write_concern is not None:
+            collection = collection.with_options(write_concern=self.write_concern)
+        docs = [doc for doc, _, _ in items]
+        errors = {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: collection.insert_many(docs, ordered=False)
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                error_class = DuplicateKeyError if error["code"] == 11000 else WriteError
+                errors[error["index"]] = error_class(error["errmsg"], error["code"], error)
+        except Exception as e:
+            # Network or write-concern failure: nobody can tell which documents landed
+            errors = {index: e for index in range(len(items))}
+
+        finished = time.perf_counter()
+        for index, (_, future, queued) in enumerate(items):
+            metrics.group_commit_wait.observe(finished - queued, collection=collection_name)
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
@@ -0,0 +1,113 @@
+"""Idempotency-Key support for log-creating POST endpoints.
+
+The first request with a given key claims it by inserting an "in_progress"
+record (the unique _id makes the claim atomic across workers), runs, and stores
+its response. Retries with the same key replay the stored response; a retry
+that arrives while the original is still running waits for it instead of
+executing again. Failed requests (an exception or an error status) release
+the key so the client can retry. A key is bound to the user and route that
+claimed it; reusing it for another request is a 422. Rate-limited routes do not
+charge retries of a key they already hold (see `is_retry`).
+Records expire through a TTL index on created_at.
+"""
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import json
+import time
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+MAX_KEY_LENGTH = 255
+
+class IdempotencyStore:
+    def __init__(self, wait_seconds=60, lock_seconds=120):
+        self.wait_seconds = wait_seconds
+        # An in_progress record older than this belongs to a crashed worker and may be taken over
+        self.lock_seconds = lock_seconds
+
+    async def run(self, db, key, user_id, route, handler, status_code=200):
+        """Run handler() at most once per (user, key); replay its stored response otherwise.
+
+        `status_code` is the route's success status, stored with the body unless
+        the handler returns its own Response.
+        """
+        if not key:
+            return await handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key çok uzun")
+
+        collection = db[IDEMPOTENCY_COLLECTION]
+        record_id = f"{user_id}:{key}"
+        if self._claim(collection, record_id, user_id, route):
+            return await self._execute(collection, record_id, handler, status_code)
+        return await self._replay(collection, record_id, user_id, route, handler, status_code)
+
+    def is_retry(self, db, key, user_id, route):
+        """True when `key` already belongs to a request of this user and route, finished or still running"""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return False
+        query = {"_id": f"{user_id}:{key}", "user_id": user_id, "route": route}
+        return db[IDEMPOTENCY_COLLECTION].find_one(query, {"_id": 1}) is not None
+
+    def _claim(self, collection, record_id, user_id, route):
+        now = datetime.now(timezone.utc)
+        try:
+            collection.insert_one({"_id": record_id, "user_id": user_id, "route": route,
+                                   "state": "in_progress", "created_at": now})
+            return True
+        except DuplicateKeyError:
+            pass
+        # Take over a claim left behind by a worker that died mid-request, only for the same request
+        stale = collection.find_one_and_update(
+            {"_id": record_id, "user_id": user_id, "route": route, "state": "in_progress",
+             "created_at": {"$lt": now - timedelta(seconds=self.lock_seconds)}},
+            {"$set": {"created_at": now}}
+        )
+        return stale is not None
+
+    async def _replay(self, collection, record_id, user_id, route, handler, status_code):
+        deadline = time.monotonic() + self.wait_seconds
+        delay = 0.05
+        while True:
+            record = collection.find_one({"_id": record_id})
+            if record is not None and (record.get("user_id", user_id) != user_id or record["route"] != route):
+                raise HTTPException(status_code=422, detail="Idempotency-Key başka bir istek için kullanılmış")
+            if record is None or record["state"] == "in_progress":
+                # The original failed and released the key, or its worker died: this request takes over
+                if self._claim(collection, record_id, user_id, route):
+                    return await self._execute(collection, record_id, handler, status_code)
+            elif record["state"] == "done":
+                return JSONResponse(
+                    content=record["body"],
+                    status_code=record["status_code"],
+                    headers={"Idempotent-Replayed": "true"}
+                )
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="Aynı Idempotency-Key ile istek hâlâ işleniyor")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def _execute(self, collection, record_id, handler, status_code):
+        try:
+            result = await handler()
+        except BaseException:
+            collection.delete_one({"_id": record_id, "state": "in_progress"})
+            raise
+        if isinstance(result, Response):
+            status_code = result.status_code
+            body = json.loads(result.body) if result.body else None
+        else:
+            body = jsonable_encoder(result)
+        if status_code >= 400:
+            # Not a result worth replaying: release the key so the client can retry
+            collection.delete_one({"_id": record_id, "state": "in_progress"})
+            return result
+        collection.update_one(
+            {"_id": record_id},
+            {"$set": {"state": "done", "status_code": status_code, "body": body,
+                      "completed_at": datetime.now(timezone.utc)}}
+        )
+        return result
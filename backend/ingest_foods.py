@@ -0,0 +1,307 @@
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from concurrent.futures import ThreadPoolExecutor
+from catalog import normalize_barcode, name_key, CATALOG_COLLECTIONS, CURATED_SOURCES
+from catalog_publish import mark_changed
+from datetime import datetime, timezone
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+database_name = os.getenv("DATABASE_NAME", "apak_fitness")
+client = MongoClient(mongo_url)
+db = client[database_name]
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+INGEST_WRITERS = int(os.getenv("INGEST_WRITERS", "4"))
+# A JSON array item larger than this is treated as malformed input rather than buffered to EOF
+INGEST_MAX_ITEM_MIB = int(os.getenv("INGEST_MAX_ITEM_MIB", "16"))
+
+# Column names used by the dumps we load (our own seed format, Open Food Facts, generic exports)
+FIELD_ALIASES = {
+    "name": ["name", "food_name", "product_name_tr", "product_name", "product_name_en", "generic_name"],
+    "barcode": ["barcode", "code", "ean", "gtin"],
+    "category": ["category", "main_category_tr", "main_category", "categories_tr", "categories"],
+    "calories": ["calories_per_100g", "energy-kcal_100g", "energy_kcal_100g", "kcal_100g", "calories", "kcal"],
+    "energy_kj": ["energy-kj_100g", "energy_kj_100g", "energy_100g", "energy_kj", "kj"],
+    "protein": ["protein_per_100g", "proteins_100g", "protein_100g", "protein", "proteins"],
+    "carbs": ["carbs_per_100g", "carbohydrates_100g", "carbs_100g", "carbs", "carbohydrates"],
+    "fat": ["fat_per_100g", "fat_100g", "fat"],
+    "basis": ["nutrition_basis", "basis", "serving_size", "serving_quantity", "serving_grams"],
+}
+# Aliases that are already per 100 g; every other nutrient column is per `basis`
+PER_100G_FIELDS = {alias for key in ("calories", "energy_kj", "protein", "carbs", "fat")
+                   for alias in FIELD_ALIASES[key] if "100g" in alias}
+UNIT_GRAMS = {"g": 1, "gr": 1, "gram": 1, "kg": 1000, "mg": 0.001, "ml": 1, "cl": 10, "l": 1000, "lt": 1000, "oz": 28.35}
+QUANTITY = re.compile(r"(\d+(?:[.,]\d+)?)\s*(kg|mg|gram|gr|g|ml|cl|lt|l|oz)\b", re.IGNORECASE)
+
+def _number(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().replace(",", "."))
+    except ValueError:
+        return None
+
+def _basis_grams(value):
+    """Grams the non-_100g nutrient columns refer to: a number, or text like '30 g' or '1 kutu (330 ml)'"""
+    number = _number(value)
+    if number is not None:
+        return number
+    match = QUANTITY.search(str(value or ""))
+    if not match:
+        return None
+    return float(match.group(1).replace(",", ".")) * UNIT_GRAMS[match.group(2).lower()]
+
+def _pick(row, key):
+    for alias in FIELD_ALIASES[key]:
+        value = row.get(alias)
+        if value not in (None, ""):
+            return alias, value
+    return None, None
+
+def normalize(row, source):
+    """Map one raw row to a turkish_foods document with per-100g values; None if it is unusable"""
+    _, name = _pick(row, "name")
+    if not name or not str(name).strip():
+        return None
+    _, basis = _pick(row, "basis")
+    basis_grams = _basis_grams(basis) if basis is not None else 100.0
+
+    values = {}
+    for key in ("calories", "energy_kj", "protein", "carbs", "fat"):
+        alias, raw = _pick(row, key)
+        value = _number(raw)
+        if value is None:
+            continue
+        if alias not in PER_100G_FIELDS:
+            if not basis_grams:
+                return None
+            value = value * 100 / basis_grams
+        values[key] = value
+    if "calories" not in values and "energy_kj" in values:
+        values["calories"] = values["energy_kj"] / 4.184
+    if "calories" not in values:
+        return None
+
+    food = {
+        "name": " ".join(str(name).split()),
+        "calories_per_100g": round(values["calories"], 2),
+        "protein_per_100g": round(values.get("protein", 0), 2),
+        "carbs_per_100g": round(values.get("carbs", 0), 2),
+        "fat_per_100g": round(values.get("fat", 0), 2),
+    }
+    # Implausible per-100g values are almost always unit mix-ups in the source
+    if not 0 <= food["calories_per_100g"] <= 950:
+        return None
+    if min(food["protein_per_100g"], food["carbs_per_100g"], food["fat_per_100g"]) < 0 or \
+            food["protein_per_100g"] + food["carbs_per_100g"] + food["fat_per_100g"] > 105:
+        return None
+
+    _, category = _pick(row, "category")
+    food["category"] = str(category).split(",")[0].strip() if category else "Paketli Gıda"
+    _, barcode = _pick(row, "barcode")
+    barcode = normalize_barcode(barcode) if barcode is not None else None
+    if barcode:
+        food["barcode"] = barcode
+    food["name_key"] = name_key(food["name"])
+    food["source"] = source
+    return food
+
+# ==================== READERS ====================
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def read_csv(path):
+    # Open Food Facts rows carry very long ingredient and category fields
+    csv.field_size_limit(1 << 24)
+    with _open_text(path) as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.DictReader(f, dialect=dialect)
+
+def read_ndjson(path):
+    with _open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def read_json_array(path, chunk_size=1024 * 1024, max_item_chars=INGEST_MAX_ITEM_MIB * 1024 * 1024):
+    """Stream the objects of a top-level JSON array without loading the whole file.
+
+    Raises ValueError when no complete value fits in `max_item_chars`, so a
+    malformed file fails there instead of being buffered whole.
+    """
+    decoder = json.JSONDecoder()
+    with _open_text(path) as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path}: expected a JSON array")
+        position = 1
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                if position >= len(buffer):
+                    raise json.JSONDecodeError("buffer exhausted", buffer, position)
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The next item straddles the chunk boundary: keep the unread tail and read on
+                if eof:
+                    raise
+                if len(buffer) - position > max_item_chars:
+                    raise ValueError(f"{path}: no complete JSON value within {max_item_chars} characters; the file is malformed")
+                more = f.read(chunk_size)
+                eof = not more
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            yield item
+
+def read_rows(path):
+    base = path[:-3] if path.endswith(".gz") else path
+    if base.endswith((".ndjson", ".jsonl")):
+        return read_ndjson(path)
+    if base.endswith(".json"):
+        return read_json_array(path)
+    return read_csv(path)
+
+# ==================== WRITER ====================
+
+def _operation(food, run_id):
+    # Barcoded products are identified by barcode, everything else by normalised name. Curated
+    # seed rows never match: they belong to seed_turkish_foods.py and must not take a source
+    if "barcode" in food:
+        key = {"barcode": food["barcode"]}
+    else:
+        key = {"name_key": food["name_key"], "barcode": {"$exists": False}, "source": {"$nin": CURATED_SOURCES}}
+    identity = food.get("barcode") or food["name_key"]
+    return UpdateOne(
+        key,
+        {"$set": dict(food, ingest_run=run_id, updated_at=datetime.now(timezone.utc)),
+         "$setOnInsert": {"id": f"{food['source']}:{identity}"}},
+        upsert=True
+    )
+
+def write_batch(collection, batch, run_id):
+    try:
+        result = collection.bulk_write([_operation(food, run_id) for food in batch], ordered=False)
+        return {"upserted": result.upserted_count, "modified": result.modified_count, "errors": 0}
+    except BulkWriteError as e:
+        # Two unordered upserts racing on a new key: one inserts, the other hits the unique index
+        details = e.details
+        return {"upserted": details.get("nUpserted", 0), "modified": details.get("nModified", 0),
+                "errors": len(details.get("writeErrors", []))}
+
+def ensure_catalog_indexes(collection):
+    """Search and barcode indexes the catalog queries and the upserts above rely on"""
+    started = time.perf_counter()
+    collection.create_index("name")
+    collection.create_index("name_key")
+    collection.create_index("barcode", unique=True, partialFilterExpression={"barcode": {"$type": "string"}})
+    collection.create_index([("source", 1), ("ingest_run", 1)])
+    return time.perf_counter() - started
+
+def ingest(paths, source, collection_name="turkish_foods", batch_size=INGEST_BATCH_SIZE,
+           writers=INGEST_WRITERS, prune=False, dry_run=False):
+    """Stream `paths` into the catalog with batched unordered upserts; returns a report"""
+    if source in CURATED_SOURCES:
+        raise ValueError(f"source {source!r} is reserved for the curated seed catalog")
+    collection = db[collection_name]
+    run_id = str(uuid.uuid4())
+    report = {"source": source, "run_id": run_id, "rows": 0, "rejected": 0, "duplicates": 0,
+              "upserted": 0, "modified": 0, "write_errors": 0, "pruned": 0}
+    started = time.perf_counter()
+    if not dry_run:
+        report["index_seconds"] = round(ensure_catalog_indexes(collection), 2)
+
+    seen = set()
+    batch = []
+    pending = []
+
+    def collect(done):
+        for key in ("upserted", "modified"):
+            report[key] += done[key]
+        report["write_errors"] += done["errors"]
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        def flush():
+            nonlocal batch
+            if batch and not dry_run:
+                pending.append(executor.submit(write_batch, collection, batch, run_id))
+                # Bound memory: never more than two batches queued per writer
+                while len(pending) > writers * 2:
+                    collect(pending.pop(0).result())
+            batch = []
+
+        for path in paths:
+            for row in read_rows(path):
+                report["rows"] += 1
+                food = normalize(row, source)
+                if food is None:
+                    report["rejected"] += 1
+                    continue
+                identity = food.get("barcode") or food["name_key"]
+                if identity in seen:
+                    report["duplicates"] += 1
+                    continue
+                seen.add(identity)
+                batch.append(food)
+                if len(batch) >= batch_size:
+                    flush()
+                if report["rows"] % 50000 == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"   {report['rows']} rows read, {report['rows'] / elapsed:.0f} rows/s")
+        flush()
+        for future in pending:
+            collect(future.result())
+
+    if prune and not dry_run:
+        # Rows of this source that were not in this dump are gone upstream
+        report["pruned"] = collection.delete_many({"source": source, "ingest_run": {"$ne": run_id}}).deleted_count
+    if collection_name in CATALOG_COLLECTIONS and not dry_run:
+        # Upserts land in the live collection; a new version makes workers reload it
+        report["catalog_version"] = mark_changed(db, collection_name)
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 2)
+    report["rows_per_second"] = round(report["rows"] / elapsed) if elapsed else None
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load CSV/JSON/NDJSON food dumps (optionally .gz) into the food catalog")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--source", required=True, help="dataset name stored on every row, e.g. openfoodfacts")
+    parser.add_argument("--collection", default="turkish_foods")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--writers", type=int, default=INGEST_WRITERS, help="concurrent bulk_write batches")
+    parser.add_argument("--prune", action="store_true", help="delete rows of this source missing from the dump")
+    parser.add_argument("--dry-run", action="store_true", help="parse and normalise only, write nothing")
+    args = parser.parse_args()
+
+    report = ingest(args.paths, args.source, args.collection, args.batch_size, args.writers, args.prune, args.dry_run)
+    print(json.dumps(report, indent=2))
+    print(f"✅ {report['rows']} rows in {report['seconds']}s ({report['rows_per_second']} rows/s): "
+          f"{report['upserted']} new, {report['modified']} updated, {report['rejected']} rejected, "
+          f"{report['duplicates']} duplicates")
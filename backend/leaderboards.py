@@ -0,0 +1,220 @@
+"""Friend graph and weekly friend leaderboards.
+
+Friendships are stored as one document per user listing their friend ids, so a
+user's friends are a single _id lookup. Each user also has one
+`leaderboard_stats` document with their totals for the current ISO week
+(calories burned, minutes, workouts) and their daily workout streak. It is
+updated on every workout insert and delete with compare-and-set on a version
+field; the weekly totals start from zero the first time a new week is written,
+and stale totals from an earlier week read as zero. A leaderboard is then one
+$in read over the caller's and friends' stats documents, ranked in memory,
+instead of an aggregation over every friend's workout_logs.
+
+When the compare-and-set keeps losing (max_retries times in a row), the write
+falls back to an unconditional $inc of the weekly totals and then recounts the
+streak from the logs, so a busy stats document is never left uncounted.
+"""
+from datetime import datetime, timezone, timedelta
+from pymongo.errors import DuplicateKeyError
+from log_store import DocumentLogs
+import logging
+import metrics
+
+FRIENDSHIPS_COLLECTION = "friendships"
+FRIEND_REQUESTS_COLLECTION = "friend_requests"
+STATS_COLLECTION = "leaderboard_stats"
+METRICS = {"calories": "calories_burned", "minutes": "minutes", "workouts": "workouts", "streak": "current_streak"}
+# The contention fallback recounts the streak over at most this much history
+STREAK_LOOKBACK_DAYS = 400
+
+logger = logging.getLogger(__name__)
+
+def iso_week(moment):
+    year, week, _ = moment.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def _utc(moment):
+    # Logs read back without tz_aware carry naive UTC datetimes
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def _day(moment):
+    return _utc(moment).date().isoformat()
+
+def _days_between(older, newer):
+    return (datetime.fromisoformat(newer) - datetime.fromisoformat(older)).days
+
+# ==================== FRIENDS ====================
+
+def friend_ids(db, user_id):
+    doc = db[FRIENDSHIPS_COLLECTION].find_one({"_id": user_id}, {"friend_ids": 1})
+    return doc["friend_ids"] if doc else []
+
+def add_friendship(db, user_id, friend_id):
+    now = datetime.now(timezone.utc)
+    for owner, other in ((user_id, friend_id), (friend_id, user_id)):
+        db[FRIENDSHIPS_COLLECTION].update_one(
+            {"_id": owner},
+            {"$addToSet": {"friend_ids": other}, "$set": {"updated_at": now}},
+            upsert=True
+        )
+
+def remove_friendship(db, user_id, friend_id):
+    now = datetime.now(timezone.utc)
+    for owner, other in ((user_id, friend_id), (friend_id, user_id)):
+        db[FRIENDSHIPS_COLLECTION].update_one({"_id": owner}, {"$pull": {"friend_ids": other}, "$set": {"updated_at": now}})
+
+# ==================== LEADERBOARDS ====================
+
+class Leaderboards:
+    def __init__(self, max_friends=1000, max_retries=5, workout_logs=None):
+        self.max_friends = max_friends
+        self.max_retries = max_retries
+        self.workout_logs = workout_logs or DocumentLogs("workout_logs")
+
+    def record(self, db, user, log):
+        """Count a new workout log for `user` (needs id and name)"""
+        logged_at = _utc(log["logged_at"])
+        week, day = iso_week(logged_at), _day(logged_at)
+
+        def apply(stats):
+            if stats.get("week") != week:
+                stats.update(week=week, calories_burned=0, minutes=0, workouts=0)
+            stats["calories_burned"] += log["calories_burned"]
+            stats["minutes"] += log["duration_minutes"]
+            stats["workouts"] += 1
+            last_day = stats.get("last_workout_day")
+            if last_day != day:
+                yesterday = (logged_at - timedelta(days=1)).date().isoformat()
+                stats["current_streak"] = stats.get("current_streak", 0) + 1 if last_day == yesterday else 1
+                stats["last_workout_day"] = day
+            stats["longest_streak"] = max(stats.get("longest_streak", 0), stats["current_streak"])
+            stats["name"] = user.name
+            stats["picture"] = user.picture
+        totals = {"calories_burned": log["calories_burned"], "minutes": log["duration_minutes"], "workouts": 1}
+        self._update(db, user.id, apply, "record", week, totals, {"name": user.name, "picture": user.picture})
+
+    def remove(self, db, user_id, log):
+        """Uncount a deleted workout log; the streak changes only if that emptied its day"""
+        logged_at = _utc(log["logged_at"])
+        week, day = iso_week(logged_at), _day(logged_at)
+        start = datetime.fromisoformat(day).replace(tzinfo=timezone.utc)
+        emptied = not self.workout_logs.find(db, user_id, start, start + timedelta(days=1), include_images=False, limit=1)
+
+        def apply(stats):
+            if stats.get("week") == week:
+                stats["calories_burned"] = max(0, stats["calories_burned"] - log["calories_burned"])
+                stats["minutes"] = max(0, stats["minutes"] - log["duration_minutes"])
+                stats["workouts"] = max(0, stats["workouts"] - 1)
+            if emptied:
+                stats["current_streak"], stats["last_workout_day"] = self._streak_without(stats, day)
+        totals = {"calories_burned": -log["calories_burned"], "minutes": -log["duration_minutes"], "workouts": -1}
+        self._update(db, user_id, apply, "remove", week, totals)
+
+    def board(self, db, user_id, metric="calories", limit=10):
+        """Top `limit` of the user and their friends this week, plus the user's own rank"""
+        field = METRICS[metric]
+        now = datetime.now(timezone.utc)
+        week = iso_week(now)
+        yesterday = (now - timedelta(days=1)).date().isoformat()
+        members = [user_id] + friend_ids(db, user_id)[:self.max_friends]
+
+        entries = []
+        for stats in db[STATS_COLLECTION].find({"_id": {"$in": members}}):
+            if field == "current_streak":
+                # A streak whose last workout is older than yesterday is already broken
+                value = stats.get("current_streak", 0) if stats.get("last_workout_day", "") >= yesterday else 0
+            else:
+                value = stats.get(field, 0) if stats.get("week") == week else 0
+            entries.append({"user_id": stats["_id"], "name": stats.get("name"), "picture": stats.get("picture"), "value": value})
+        seen = {entry["user_id"] for entry in entries}
+        entries.extend({"user_id": member, "name": None, "picture": None, "value": 0} for member in members if member not in seen)
+
+        entries.sort(key=lambda entry: entry["value"], reverse=True)
+        me = None
+        rank = 0
+        previous = None
+        for position, entry in enumerate(entries, start=1):
+            # Equal values share a rank (1, 2, 2, 4)
+            if entry["value"] != previous:
+                rank, previous = position, entry["value"]
+            entry["rank"] = rank
+            if entry["user_id"] == user_id:
+                me = entry
+        return {"week": week, "metric": metric, "participants": len(entries), "top": entries[:limit], "me": me}
+
+    @staticmethod
+    def _streak_without(stats, day):
+        """(current streak, last workout day) once `day` has no workouts left; only the streak's own days matter"""
+        streak, last_day = stats.get("current_streak", 0), stats.get("last_workout_day")
+        if last_day is None or not 0 <= _days_between(day, last_day) < streak:
+            return streak, last_day
+        if day != last_day:
+            # The streak now starts the day after
+            return _days_between(day, last_day), last_day
+        if streak > 1:
+            return streak - 1, (datetime.fromisoformat(day) - timedelta(days=1)).date().isoformat()
+        # A one-day streak is gone; the run before it ended two or more days earlier and is already broken
+        return 0, None
+
+    def _count_streak(self, db, user_id):
+        """(current streak, last workout day) recounted from the user's workout logs"""
+        since = datetime.now(timezone.utc) - timedelta(days=STREAK_LOOKBACK_DAYS)
+        days = sorted({_day(log["logged_at"]) for log in self.workout_logs.find(db, user_id, start=since)}, reverse=True)
+        if not days:
+            return 0, None
+        streak = 1
+        for newer, older in zip(days, days[1:]):
+            if _days_between(older, newer) != 1:
+                break
+            streak += 1
+        return streak, days[0]
+
+    def _update(self, db, user_id, apply, operation, week, totals, fields=None):
+        """Compare-and-set `apply` on the user's stats, falling back to `totals` as an $inc after max_retries"""
+        collection = db[STATS_COLLECTION]
+        for _ in range(self.max_retries):
+            stats = collection.find_one({"_id": user_id})
+            if stats is None:
+                stats = {"_id": user_id, "version": 0}
+                apply(stats)
+                stats["updated_at"] = datetime.now(timezone.utc)
+                try:
+                    collection.insert_one(stats)
+                    return
+                except DuplicateKeyError:
+                    continue
+            version = stats.pop("version")
+            apply(stats)
+            stats["updated_at"] = datetime.now(timezone.utc)
+            result = collection.update_one(
+                {"_id": user_id, "version": version},
+                {"$set": {key: value for key, value in stats.items() if key != "_id"}, "$inc": {"version": 1}}
+            )
+            if result.matched_count:
+                return
+        self._fallback(db, user_id, operation, week, totals, fields or {})
+
+    def _fallback(self, db, user_id, operation, week, totals, fields):
+        logger.warning("Leaderboard %s for %s lost %d compare-and-set rounds; applying it unconditionally",
+                       operation, user_id, self.max_retries)
+        metrics.leaderboard_fallbacks.inc(operation=operation)
+        collection = db[STATS_COLLECTION]
+        now = datetime.now(timezone.utc)
+        result = collection.update_one(
+            {"_id": user_id, "week": week},
+            {"$inc": {**totals, "version": 1}, "$set": {**fields, "updated_at": now}}
+        )
+        if not result.matched_count and totals["workouts"] > 0:
+            # The stats still hold an earlier week: this write starts the log's week
+            collection.update_one(
+                {"_id": user_id},
+                {"$set": {**totals, **fields, "week": week, "updated_at": now}, "$inc": {"version": 1}},
+                upsert=True
+            )
+        # The streak depends on which days have workouts, not on a sum, so it is recounted
+        streak, last_day = self._count_streak(db, user_id)
+        collection.update_one(
+            {"_id": user_id},
+            {"$set": {"current_streak": streak, "last_workout_day": last_day}, "$max": {"longest_streak": streak},
+             "$inc": {"version": 1}}
+        )
@@ -0,0 +1,268 @@
+"""Per-user push channel for dashboard updates (Server-Sent Events).
+
+Writes publish small delta events (a log that was added or deleted plus the
+change it makes to that day's totals) into a capped `user_events` collection,
+numbered by a per-user sequence. Every worker tails that collection with one
+background thread and hands each event to the asyncio queues of the matching
+user's open streams, so an event published by any worker reaches streams held
+by all of them. A reconnecting client sends Last-Event-ID and is replayed the
+events it missed from the same collection; if they have already rolled out of
+the capped collection it gets a `reset` event and refetches.
+
+An idle stream is one queue and one suspended generator, so a worker can hold
+thousands of them.
+
+ObjectIds from different workers are not ordered, so the tailing thread never
+resumes from an _id. It remembers the last seq it handed each subscribed user;
+after reopening its cursor (from a little before the last event it saw, by
+created_at) it replays each of those users from that seq through the
+(user_id, seq) index. Events seen twice are dropped by the streams, which skip
+seqs they have already sent.
+"""
+from fastapi.encoders import jsonable_encoder
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, PyMongoError
+from datetime import datetime, timezone, timedelta
+import asyncio
+import json
+import logging
+import threading
+import time
+
+EVENTS_COLLECTION = "user_events"
+SEQUENCES_COLLECTION = "user_sequences"
+
+# A reopened tailing cursor starts this far before the last event seen, for clock skew between workers
+TAIL_OVERLAP = timedelta(seconds=5)
+
+logger = logging.getLogger(__name__)
+
+def _utc(moment):
+    # Documents read back without tz_aware carry naive UTC datetimes
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def next_seq(db, user_id, count=1):
+    """Reserve `count` consecutive numbers of the user's change sequence and return the last one.
+
+    One sequence numbers both live events and the `change_seq` of changed
+    documents, so an SSE event id is also a valid /api/sync cursor.
+    """
+    sequence = db[SEQUENCES_COLLECTION].find_one_and_update(
+        {"_id": user_id},
+        {"$inc": {"seq": count}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return sequence["seq"]
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Set when the stream fell too far behind and was dropped from dispatch
+        self.dropped = False
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+class LiveUpdates:
+    def __init__(self, capped_size_bytes=64 * 1024 * 1024, queue_size=256, max_replay=500):
+        self.capped_size_bytes = capped_size_bytes
+        self.queue_size = queue_size
+        self.max_replay = max_replay
+        # user_id -> set of Subscription, one per open stream in this worker
+        self.subscribers = {}
+        # user_id -> highest seq handed to that user's streams, where the tailing thread resumes them from
+        self.delivered = {}
+        self.loop = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    # ---------- lifecycle ----------
+
+    def start(self, db, loop):
+        """Create the capped collection and start this worker's tailing thread"""
+        try:
+            db.create_collection(EVENTS_COLLECTION, capped=True, size=self.capped_size_bytes)
+        except CollectionInvalid:
+            pass
+        db[EVENTS_COLLECTION].create_index([("user_id", 1), ("seq", 1)])
+        self.loop = loop
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._tail, args=(db,), name="live-updates", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.thread = None
+        for subscriptions in list(self.subscribers.values()):
+            for subscription in list(subscriptions):
+                subscription.dropped = True
+                try:
+                    subscription.queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    pass
+
+    # ---------- publishing ----------
+
+    def publish(self, db, user_id, event_type, data, seq=None):
+        """Store an event for user_id under `seq` (allocated here when not given) and return the sequence number"""
+        if seq is None:
+            seq = next_seq(db, user_id)
+        db[EVENTS_COLLECTION].insert_one({
+            "user_id": user_id,
+            "seq": seq,
+            "type": event_type,
+            "data": jsonable_encoder(data),
+            "created_at": datetime.now(timezone.utc),
+        })
+        return seq
+
+    def current_seq(self, db, user_id):
+        doc = db[SEQUENCES_COLLECTION].find_one({"_id": user_id})
+        return doc["seq"] if doc else 0
+
+    # ---------- subscribing ----------
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def caught_up(self, user_id, seq):
+        """Record that a stream of user_id has sent everything up to seq"""
+        if user_id in self.subscribers:
+            self.delivered[user_id] = max(self.delivered.get(user_id, 0), seq)
+
+    def unsubscribe(self, user_id, subscription):
+        subscriptions = self.subscribers.get(user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscribers[user_id]
+                self.delivered.pop(user_id, None)
+
+    @property
+    def connections(self):
+        return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+    def replay(self, db, user_id, after_seq):
+        """Events after `after_seq`, or None when some of them are no longer stored"""
+        current = self.current_seq(db, user_id)
+        if after_seq >= current:
+            return []
+        events = list(
+            db[EVENTS_COLLECTION].find({"user_id": user_id, "seq": {"$gt": after_seq}}, {"_id": 0})
+            .sort("seq", 1).limit(self.max_replay)
+        )
+        if not events or events[0]["seq"] != after_seq + 1:
+            # Numbers can be skipped (a write that failed after reserving one). The capped collection drops
+            # the oldest events first, so while one of the user's events up to after_seq is still stored,
+            # none after it rolled out and the gap is only unused numbers
+            if db[EVENTS_COLLECTION].find_one({"user_id": user_id, "seq": {"$lte": after_seq}}, {"_id": 1}) is None:
+                return None
+        if len(events) == self.max_replay and events[-1]["seq"] < current:
+            return None
+        return events
+
+    def _dispatch(self, event):
+        for subscription in list(self.subscribers.get(event["user_id"], ())):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A stream this far behind reconnects and catches up through Last-Event-ID
+                subscription.dropped = True
+                self.unsubscribe(event["user_id"], subscription)
+
+    def _drop(self, user_id):
+        # Too many missed events to push: the streams reconnect and replay or reset
+        for subscription in list(self.subscribers.get(user_id, ())):
+            subscription.dropped = True
+            self.unsubscribe(user_id, subscription)
+            try:
+                subscription.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    def _hand_over(self, event):
+        if self.subscribers.get(event["user_id"]):
+            self.delivered[event["user_id"]] = max(self.delivered.get(event["user_id"], 0), event["seq"])
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _catch_up(self, db):
+        """Push what subscribed users missed while no cursor was open, by their own sequence"""
+        for user_id, seq in list(self.delivered.items()):
+            events = list(
+                db[EVENTS_COLLECTION].find({"user_id": user_id, "seq": {"$gt": seq}}, {"_id": 0})
+                .sort("seq", 1).limit(self.max_replay)
+            )
+            if len(events) == self.max_replay:
+                self.loop.call_soon_threadsafe(self._drop, user_id)
+                continue
+            for event in events:
+                self._hand_over(event)
+
+    def _tail(self, db):
+        collection = db[EVENTS_COLLECTION]
+        last = next(collection.find({}, {"created_at": 1}).sort("$natural", -1).limit(1), None)
+        resume_at = _utc(last["created_at"]) if last else datetime.now(timezone.utc)
+        while not self.stopping.is_set():
+            try:
+                cursor = collection.find(
+                    {"created_at": {"$gte": resume_at - TAIL_OVERLAP}},
+                    {"_id": 0},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                ).max_await_time_ms(1000)
+                # Events stored while no cursor was open
+                self._catch_up(db)
+                while cursor.alive and not self.stopping.is_set():
+                    for event in cursor:
+                        resume_at = max(resume_at, _utc(event["created_at"]))
+                        self._hand_over(event)
+                        if self.stopping.is_set():
+                            break
+                cursor.close()
+            except PyMongoError as e:
+                logger.warning("Live update tailing failed, retrying: %s", e)
+            # A tailable cursor on an empty capped collection dies immediately
+            self.stopping.wait(0.5)
+
+async def stream(live, db, user_id, last_event_id, heartbeat_seconds, max_seconds, is_disconnected):
+    """SSE body: replay missed events, then push new ones with heartbeats until max_seconds"""
+    subscription = live.subscribe(user_id)
+    try:
+        yield "retry: 3000\n\n"
+        sent = last_event_id
+        if last_event_id is None:
+            sent = live.current_seq(db, user_id)
+            yield format_event(sent, "ready", {"seq": sent})
+        else:
+            events = live.replay(db, user_id, last_event_id)
+            if events is None:
+                sent = live.current_seq(db, user_id)
+                yield format_event(sent, "reset", {"seq": sent})
+            else:
+                for event in events:
+                    sent = event["seq"]
+                    yield format_event(event["seq"], event["type"], event["data"])
+        live.caught_up(user_id, sent)
+
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat_seconds)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": ping\n\n"
+                continue
+            if event is None or subscription.dropped:
+                # Shutting down, or this stream fell behind: the client reconnects from `sent`
+                return
+            if event["seq"] <= sent:
+                continue
+            sent = event["seq"]
+            yield format_event(event["seq"], event["type"], event["data"])
+    finally:
+        live.unsubscribe(user_id, subscription)
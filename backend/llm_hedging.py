@@ -0,0 +1,241 @@
+"""Hedged LLM requests over a configurable model chain.
+
+A request starts on the first model in the chain. If it has not produced a
+parsed answer within that model's hedge delay (its running p95 latency, or a
+fixed value), the next model is started alongside it; a model that fails or
+returns an unparsable answer hands over to the next one immediately. The first
+valid parsed answer wins and the other attempts are cancelled. Latency, win
+and failure counts are kept per (provider, model) for the admin endpoint and
+/metrics.
+
+FakeBackend stands in for the SDK with injected latencies, so the chain can be
+exercised without network access or an API key.
+"""
+from collections import deque
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import metrics
+
+def parse_models(spec):
+    """Parse "gemini:gemini-2.0-flash,openai:gpt-4o-mini" into [("gemini", "gemini-2.0-flash"), ...]
+
+    Raises ValueError for an empty chain, so a blank LLM_MODELS fails at startup
+    instead of on every analysis.
+    """
+    models = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        provider, _, model = item.strip().partition(":")
+        models.append((provider, model) if model else ("gemini", provider))
+    if not models:
+        raise ValueError(f"LLM model chain is empty: {spec!r}")
+    return models
+
+# Environment variable holding each provider's API key; other providers use <PROVIDER>_API_KEY
+PROVIDER_KEY_VARIABLES = {"gemini": "GEMINI_API_KEY", "openai": "OPENAI_API_KEY", "anthropic": "ANTHROPIC_API_KEY"}
+
+def api_keys(models, environ=os.environ):
+    """{provider: API key} for the providers of a chain that have one set"""
+    keys = {}
+    for provider, _ in models:
+        key = environ.get(PROVIDER_KEY_VARIABLES.get(provider, f"{provider.upper()}_API_KEY"), "")
+        if key:
+            keys[provider] = key
+    return keys
+
+class ModelStats:
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.wins = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.hedges = 0
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class HedgedModelChain:
+    def __init__(self, models, hedge_after_ms=None, hedge_percentile=95, default_hedge_ms=4000, min_samples=20, window=200):
+        if not models:
+            raise ValueError("HedgedModelChain needs at least one model")
+        self.models = models
+        # A fixed delay overrides the running percentile
+        self.hedge_after_ms = hedge_after_ms
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_ms = default_hedge_ms
+        self.min_samples = min_samples
+        # Keyed by (provider, model): the same model name served by two providers is two backends
+        self.stats = {(provider, model): ModelStats(window) for provider, model in models}
+        self.lock = threading.Lock()
+
+    def hedge_delay(self, key):
+        """Seconds to wait on the (provider, model) `key` before starting the next one in the chain"""
+        if self.hedge_after_ms is not None:
+            return self.hedge_after_ms / 1000
+        stats = self.stats[key]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_hedge_ms / 1000
+        return stats.percentile(self.hedge_percentile)
+
+    async def run(self, send, parse):
+        """Return parse(await send(provider, model)) from the first model to answer validly.
+
+        Raises the last error when every model in the chain failed.
+        """
+        pending = {}
+        remaining = list(self.models)
+        last_error = None
+
+        def launch():
+            key = remaining.pop(0)
+            with self.lock:
+                self.stats[key].calls += 1
+            pending[asyncio.ensure_future(self._attempt(*key, send, parse))] = key
+            return key
+
+        current = launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(current) if remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The latest model is slower than usual: race the next one against it
+                    with self.lock:
+                        self.stats[current].hedges += 1
+                    metrics.llm_hedges.inc(provider=current[0], model=current[1])
+                    current = launch()
+                    continue
+                for task in done:
+                    key = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    with self.lock:
+                        self.stats[key].wins += 1
+                    metrics.llm_wins.inc(provider=key[0], model=key[1])
+                    return result
+                if not pending and remaining:
+                    current = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    async def _attempt(self, provider, model, send, parse):
+        key = (provider, model)
+        started = time.perf_counter()
+        try:
+            result = parse(await send(provider, model))
+        except asyncio.CancelledError:
+            metrics.llm_request_duration.observe(time.perf_counter() - started, provider=provider, model=model, outcome="cancelled")
+            with self.lock:
+                self.stats[key].cancelled += 1
+            raise
+        except Exception:
+            metrics.llm_request_duration.observe(time.perf_counter() - started, provider=provider, model=model, outcome="error")
+            metrics.llm_failures.inc(provider=provider, model=model)
+            with self.lock:
+                self.stats[key].failures += 1
+            raise
+        elapsed = time.perf_counter() - started
+        metrics.llm_request_duration.observe(elapsed, provider=provider, model=model, outcome="success")
+        with self.lock:
+            self.stats[key].latencies.append(elapsed)
+        return result
+
+    def summary(self):
+        with self.lock:
+            rows = []
+            for provider, model in self.models:
+                stats = self.stats[(provider, model)]
+                p50, p95 = stats.percentile(50), stats.percentile(95)
+                rows.append({
+                    "provider": provider,
+                    "model": model,
+                    "calls": stats.calls,
+                    "wins": stats.wins,
+                    "failures": stats.failures,
+                    "cancelled": stats.cancelled,
+                    "hedged": stats.hedges,
+                    "win_rate": round(stats.wins / stats.calls, 3) if stats.calls else None,
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                })
+        for row in rows:
+            row["hedge_after_ms"] = round(self.hedge_delay((row["provider"], row["model"])) * 1000, 1)
+        return rows
+
+# ==================== FAKE BACKENDS ====================
+
+FAKE_DISHES = [
+    {"food_name": "Mercimek Çorbası", "portion_size": "1 kase", "calories": 180, "protein": 9, "carbs": 25, "fat": 5},
+    {"food_name": "Pirinç Pilavı", "portion_size": "1 porsiyon", "calories": 250, "protein": 4, "carbs": 52, "fat": 3},
+]
+
+def fake_response(prompt=None, images_base64=None):
+    """Canned answer in the shape the prompt asks for: every image with several dishes for a
+    meal analysis (its prompt asks for "images"), a single dish otherwise"""
+    if prompt and '"images"' in prompt:
+        return json.dumps({
+            "images": [{"image_index": index, "dishes": FAKE_DISHES} for index in range(len(images_base64 or [None]))]
+        }, ensure_ascii=False)
+    return json.dumps(FAKE_DISHES[0], ensure_ascii=False)
+
+class FakeModel:
+    def __init__(self, latency_ms, jitter_ms=0, failure_rate=0.0, response=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        # A fixed reply; by default one shaped after the prompt
+        self.response = response
+
+    async def send(self, prompt=None, images_base64=None):
+        await asyncio.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("fake model failure")
+        return self.response if self.response is not None else fake_response(prompt, images_base64)
+
+class FakeBackend:
+    """Offline stand-in for the LLM SDK: each model answers after its injected latency"""
+
+    def __init__(self, models):
+        self.models = models
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Parse "gemini-2.0-flash=1500~500,openai:gpt-4o-mini=300" (latency~jitter ms, optional !failure_rate).
+
+        A name without a provider applies to that model under every provider.
+        """
+        models = {}
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            name, _, timing = item.strip().partition("=")
+            timing, _, failure_rate = timing.partition("!")
+            latency, _, jitter = timing.partition("~")
+            models[name] = FakeModel(float(latency or 0), float(jitter or 0), float(failure_rate or 0))
+        return cls(models)
+
+    def check(self, models):
+        """Raise ValueError unless every (provider, model) of a chain has a fake"""
+        missing = [f"{provider}:{model}" for provider, model in models
+                   if f"{provider}:{model}" not in self.models and model not in self.models]
+        if missing:
+            raise ValueError(f"No fake backend for {', '.join(missing)}")
+
+    async def send(self, provider, model, prompt=None, images_base64=None):
+        fake = self.models.get(f"{provider}:{model}") or self.models[model]
+        return await fake.send(prompt, images_base64)
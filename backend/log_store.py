@@ -0,0 +1,472 @@
+"""Storage layouts for food and workout logs.
+
+`DocumentLogs` is the original layout: one document per log with long field
+names, string UUIDs and an is_deleted flag. `BucketedLogs` keeps one document
+per user per UTC day (`food_log_days`, `workout_log_days`) holding an array of
+compact entries:
+
+    {"u": <user uuid>, "d": <day>, "n": <live entries>, "v": <version>,
+     "e": [{"i": <log uuid>, "t": <logged_at>, "n": "Simit", "c": 420.0, ...}]}
+
+Ids are stored as binary UUIDs (16 bytes instead of a 36-character string),
+field names are one or two letters, and a deleted entry carries its deletion
+time under `x` instead of every entry carrying a flag. A day view is then one
+index entry and one document per user instead of one per log. Food photos live
+in `food_log_images` keyed by log id, so buckets stay small and scans never
+read image bytes.
+
+Both layouts expose the same methods and return logs in the API shape, so
+callers do not know which one they read. `DualLogs` writes to both while a
+migration runs (see migrate_log_buckets.py); LOG_STORAGE picks the layout.
+"""
+from bson.binary import Binary, UuidRepresentation
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import uuid
+import bson
+
+STORAGE_MODES = ("documents", "dual", "buckets")
+
+FOOD_FIELDS = {
+    "logged_at": "t", "food_name": "n", "portion_size": "p",
+    "calories": "c", "protein": "pr", "carbs": "cb", "fat": "f",
+    "recipe_id": "r", "meal_id": "m", "image_sha256": "h",
+    "change_seq": "s", "changed_at": "ct", "deleted_at": "x",
+}
+WORKOUT_FIELDS = {
+    "logged_at": "t", "exercise_name": "n", "duration_minutes": "dm", "calories_burned": "c",
+    "change_seq": "s", "changed_at": "ct", "deleted_at": "x",
+}
+# kind -> (document collection, bucket collection, field map, image collection)
+KINDS = {
+    "food": ("food_logs", "food_log_days", FOOD_FIELDS, "food_log_images"),
+    "workout": ("workout_logs", "workout_log_days", WORKOUT_FIELDS, None),
+}
+
+def _utc(moment):
+    # Documents read back without tz_aware carry naive UTC datetimes
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def day_of(moment):
+    moment = _utc(moment)
+    return datetime(moment.year, moment.month, moment.day, tzinfo=timezone.utc)
+
+def to_binary(value):
+    """Binary UUID for a UUID string; other ids (seeded or legacy) are kept as strings"""
+    try:
+        return Binary.from_uuid(uuid.UUID(value), UuidRepresentation.STANDARD)
+    except (ValueError, TypeError, AttributeError):
+        return value
+
+def from_binary(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Binary) and value.subtype == 4:
+        return str(value.as_uuid(UuidRepresentation.STANDARD))
+    return value
+
+# ==================== DOCUMENTS ====================
+
+class DocumentLogs:
+    def __init__(self, collection_name, soft_delete=True):
+        self.collection_name = collection_name
+        self.soft_delete = soft_delete
+
+    def ensure_indexes(self, db):
+        # The per-user indexes are created with the other food/workout log indexes in server.ensure_indexes.
+        # Tombstones only, for compaction, which looks them up across users by deletion time
+        db[self.collection_name].create_index("deleted_at", partialFilterExpression={"is_deleted": True})
+
+    def _live(self, user_id):
+        return {"user_id": user_id, "is_deleted": False} if self.soft_delete else {"user_id": user_id}
+
+    def insert(self, db, logs):
+        if len(logs) == 1:
+            db[self.collection_name].insert_one(logs[0])
+        elif logs:
+            db[self.collection_name].insert_many(logs, ordered=False)
+
+    def delete(self, db, user_id, log_id, change):
+        """Soft-delete a live log with the given change_seq/changed_at; returns the tombstone or None"""
+        return db[self.collection_name].find_one_and_update(
+            {"id": log_id, "user_id": user_id, "is_deleted": False},
+            {"$set": {"is_deleted": True, "deleted_at": change["changed_at"], **change}},
+            projection={"image_base64": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def evict(self, db, user_id, log_ids):
+        """Hard-delete live logs that were copied elsewhere (cold storage)"""
+        db[self.collection_name].delete_many({"user_id": user_id, "id": {"$in": log_ids}, "is_deleted": False})
+
+    def live_ids(self, db, user_id, log_ids):
+        """The ids among log_ids that are live logs here"""
+        query = self._live(user_id)
+        query["id"] = {"$in": list(log_ids)}
+        return {doc["id"] for doc in db[self.collection_name].find(query, {"id": 1})}
+
+    def deleted_ids(self, db, user_id, log_ids):
+        """The ids among log_ids that are tombstones here"""
+        if not self.soft_delete or not log_ids:
+            return set()
+        query = {"user_id": user_id, "id": {"$in": list(log_ids)}, "is_deleted": True}
+        return {doc["id"] for doc in db[self.collection_name].find(query, {"id": 1})}
+
+    def find(self, db, user_id, start=None, end=None, include_images=True, limit=None):
+        """Live logs of the user, newest first, optionally within [start, end)"""
+        query = self._live(user_id)
+        if start is not None or end is not None:
+            query["logged_at"] = {}
+            if start is not None:
+                query["logged_at"]["$gte"] = start
+            if end is not None:
+                query["logged_at"]["$lt"] = end
+        cursor = db[self.collection_name].find(query, None if include_images else {"image_base64": 0}).sort("logged_at", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def iterate(self, db, user_id, include_images=False, batch_size=500):
+        """All live logs of the user in storage order, without _id, one cursor batch at a time"""
+        projection = {"_id": 0}
+        if not include_images:
+            projection["image_base64"] = 0
+        cursor = db[self.collection_name].find(self._live(user_id), projection).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def changes(self, db, user_id, since, limit, include_images=False):
+        """Up to `limit` logs (tombstones included) with change_seq above `since`, in sequence order"""
+        projection = {"_id": 0}
+        if not include_images:
+            projection["image_base64"] = 0
+        return list(
+            db[self.collection_name].find({"user_id": user_id, "change_seq": {"$gt": since}}, projection)
+            .sort("change_seq", 1).limit(limit)
+        )
+
+    def snapshot(self, db, user_id, after, limit, include_images=False):
+        """Up to `limit` (position, log) pairs of live logs in (change_seq, id) order, after the position `after`"""
+        query = self._live(user_id)
+        if after is not None:
+            seq, log_id = after
+            # Logs from before change sequences have none and sort first, as 0; a missing field matches null
+            query["$or"] = [{"change_seq": {"$gt": seq}}, {"change_seq": seq or None, "id": {"$gt": log_id}}]
+        projection = {"_id": 0}
+        if not include_images:
+            projection["image_base64"] = 0
+        docs = db[self.collection_name].find(query, projection).sort([("change_seq", 1), ("id", 1)]).limit(limit)
+        return [([doc.get("change_seq") or 0, doc["id"]], doc) for doc in docs]
+
+# ==================== BUCKETS ====================
+
+def _position(entry):
+    # Snapshot order of a bucket entry, matching DocumentLogs.snapshot
+    return entry.get("s", 0), from_binary(entry["i"])
+
+class BucketedLogs:
+    def __init__(self, collection_name, fields, images_collection=None, max_retries=5):
+        self.collection_name = collection_name
+        self.fields = fields
+        self.names = {short: name for name, short in fields.items()}
+        self.images_collection = images_collection
+        self.max_retries = max_retries
+
+    def ensure_indexes(self, db):
+        collection = db[self.collection_name]
+        collection.create_index([("u", 1), ("d", -1)], unique=True)
+        collection.create_index([("u", 1), ("e.i", 1)])
+        collection.create_index([("u", 1), ("e.s", 1)])
+        # Tombstones only, for compaction
+        collection.create_index("e.x", sparse=True)
+
+    # ---------- translation ----------
+
+    def encode(self, log):
+        """Compact entry for an API-shaped log"""
+        entry = {"i": to_binary(log["id"])}
+        for name, value in log.items():
+            if name in ("_id", "id", "user_id", "is_deleted", "image_base64") or value is None:
+                continue
+            entry[self.fields.get(name, name)] = value
+        if log.get("is_deleted") and "x" not in entry:
+            # Deleted before deleted_at was recorded
+            entry["x"] = log.get("changed_at") or log["logged_at"]
+        if log.get("image_base64"):
+            entry["im"] = True
+        return entry
+
+    def decode(self, user_id, entry, images=None):
+        """API-shaped log for a compact entry; `images` maps log id to image_base64 when they were asked for"""
+        log_id = from_binary(entry["i"])
+        log = {"_id": log_id, "id": log_id, "user_id": user_id}
+        for short, value in entry.items():
+            if short not in ("i", "im"):
+                log[self.names.get(short, short)] = value
+        if images is not None and "image_sha256" in log:
+            log["image_base64"] = images.get(log_id)
+        log["is_deleted"] = "deleted_at" in log
+        return log
+
+    def _images(self, db, entries):
+        if self.images_collection is None:
+            return {}
+        ids = [entry["i"] for entry in entries if entry.get("im")]
+        if not ids:
+            return {}
+        return {
+            from_binary(doc["_id"]): doc["image_base64"]
+            for doc in db[self.images_collection].find({"_id": {"$in": ids}})
+        }
+
+    # ---------- writes ----------
+
+    def insert(self, db, logs):
+        groups = {}
+        images = []
+        for log in logs:
+            entry = self.encode(log)
+            groups.setdefault((log["user_id"], day_of(log["logged_at"])), []).append(entry)
+            if entry.get("im") and self.images_collection is not None:
+                images.append({"_id": entry["i"], "u": to_binary(log["user_id"]), "image_base64": log["image_base64"]})
+        if images:
+            # Images first, so an entry is never visible before its photo
+            db[self.images_collection].insert_many(images, ordered=False)
+        for (user_id, day), entries in groups.items():
+            self._push(db, to_binary(user_id), day, entries)
+
+    def _push(self, db, user, day, entries):
+        live = sum(1 for entry in entries if "x" not in entry)
+        for attempt in range(self.max_retries):
+            try:
+                db[self.collection_name].update_one(
+                    {"u": user, "d": day},
+                    {"$push": {"e": {"$each": entries}}, "$inc": {"n": live, "v": 1}},
+                    upsert=True
+                )
+                return
+            except DuplicateKeyError:
+                # Two first writes of the same day raced on the upsert; the retry updates the winner's bucket
+                if attempt == self.max_retries - 1:
+                    raise
+
+    def delete(self, db, user_id, log_id, change):
+        user, entry_id = to_binary(user_id), to_binary(log_id)
+        values = {"deleted_at": change["changed_at"], **change}
+        bucket = db[self.collection_name].find_one_and_update(
+            {"u": user, "e": {"$elemMatch": {"i": entry_id, "x": {"$exists": False}}}},
+            {"$set": {f"e.$.{self.fields[name]}": value for name, value in values.items()}, "$inc": {"n": -1, "v": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket is None:
+            return None
+        entry = next(entry for entry in bucket["e"] if entry["i"] == entry_id)
+        return self.decode(user_id, entry)
+
+    def evict(self, db, user_id, log_ids):
+        ids = [to_binary(log_id) for log_id in log_ids]
+        collection = db[self.collection_name]
+        evicted = []
+        for bucket in collection.find({"u": to_binary(user_id), "e.i": {"$in": ids}}, {"e.i": 1, "e.x": 1}):
+            live = [entry["i"] for entry in bucket["e"] if entry["i"] in ids and "x" not in entry]
+            collection.update_one(
+                {"_id": bucket["_id"]},
+                {"$pull": {"e": {"i": {"$in": ids}, "x": {"$exists": False}}}, "$inc": {"n": -len(live), "v": 1}}
+            )
+            collection.delete_one({"_id": bucket["_id"], "e": {"$size": 0}})
+            evicted.extend(live)
+        if self.images_collection is not None and evicted:
+            # A log deleted meanwhile keeps its tombstone, and its photo for compaction to archive
+            db[self.images_collection].delete_many({"_id": {"$in": evicted}})
+
+    def _ids(self, db, user_id, log_ids, deleted):
+        wanted = set(log_ids)
+        if not wanted:
+            return set()
+        query = {"u": to_binary(user_id), "e.i": {"$in": [to_binary(log_id) for log_id in wanted]}}
+        found = set()
+        for bucket in db[self.collection_name].find(query, {"e.i": 1, "e.x": 1}):
+            found.update(from_binary(entry["i"]) for entry in bucket["e"] if ("x" in entry) == deleted)
+        return found & wanted
+
+    def live_ids(self, db, user_id, log_ids):
+        return self._ids(db, user_id, log_ids, deleted=False)
+
+    def deleted_ids(self, db, user_id, log_ids):
+        return self._ids(db, user_id, log_ids, deleted=True)
+
+    # ---------- reads ----------
+
+    def find(self, db, user_id, start=None, end=None, include_images=True, limit=None):
+        query = {"u": to_binary(user_id)}
+        if start is not None or end is not None:
+            query["d"] = {}
+            if start is not None:
+                query["d"]["$gte"] = day_of(start)
+            if end is not None:
+                query["d"]["$lt"] = end
+        start = _utc(start) if start is not None else None
+        end = _utc(end) if end is not None else None
+
+        entries = []
+        for bucket in db[self.collection_name].find(query).sort("d", -1):
+            for entry in bucket["e"]:
+                logged_at = _utc(entry["t"])
+                if "x" in entry or (start and logged_at < start) or (end and logged_at >= end):
+                    continue
+                entries.append(entry)
+            if limit and len(entries) >= limit:
+                # Buckets come newest day first, so older days cannot displace these
+                break
+        entries.sort(key=lambda entry: _utc(entry["t"]), reverse=True)
+        if limit:
+            entries = entries[:limit]
+        images = self._images(db, entries) if include_images else None
+        return [self.decode(user_id, entry, images) for entry in entries]
+
+    def iterate(self, db, user_id, include_images=False, batch_size=500):
+        cursor = db[self.collection_name].find({"u": to_binary(user_id)}).batch_size(batch_size)
+        try:
+            for bucket in cursor:
+                entries = [entry for entry in bucket["e"] if "x" not in entry]
+                images = self._images(db, entries) if include_images else None
+                for entry in entries:
+                    log = self.decode(user_id, entry, images)
+                    del log["_id"]
+                    yield log
+        finally:
+            cursor.close()
+
+    def changes(self, db, user_id, since, limit, include_images=False):
+        entries = []
+        for bucket in db[self.collection_name].find({"u": to_binary(user_id), "e.s": {"$gt": since}}):
+            entries.extend(entry for entry in bucket["e"] if entry.get("s", 0) > since)
+        entries.sort(key=lambda entry: entry["s"])
+        entries = entries[:limit]
+        images = self._images(db, entries) if include_images else None
+        logs = [self.decode(user_id, entry, images) for entry in entries]
+        for log in logs:
+            del log["_id"]
+        return logs
+
+    def snapshot(self, db, user_id, after, limit, include_images=False):
+        # Positions come back from JSON as lists
+        after = tuple(after) if after is not None else None
+        query = {"u": to_binary(user_id)}
+        if after is not None and after[0]:
+            query["e.s"] = {"$gte": after[0]}
+        entries = []
+        for bucket in db[self.collection_name].find(query):
+            entries.extend(entry for entry in bucket["e"]
+                           if "x" not in entry and (after is None or _position(entry) > after))
+        entries.sort(key=_position)
+        entries = entries[:limit]
+        images = self._images(db, entries) if include_images else None
+        logs = [self.decode(user_id, entry, images) for entry in entries]
+        for log in logs:
+            del log["_id"]
+        return [(list(_position(entry)), log) for entry, log in zip(entries, logs)]
+
+    # ---------- compaction ----------
+
+    def tombstones_before(self, db, cutoff, limit, include_images=True):
+        """[(bucket _id, user_id, [deleted logs])] for buckets holding entries deleted before cutoff"""
+        buckets = []
+        for bucket in db[self.collection_name].find({"e.x": {"$lt": cutoff}}).limit(limit):
+            entries = [entry for entry in bucket["e"] if "x" in entry and _utc(entry["x"]) < _utc(cutoff)]
+            buckets.append((bucket["_id"], from_binary(bucket["u"]), entries))
+        # Photos are archived with their logs before purge() drops them
+        images = self._images(db, [entry for _, _, entries in buckets for entry in entries]) if include_images else None
+        return [
+            (bucket_id, user_id, [self.decode(user_id, entry, images) for entry in entries])
+            for bucket_id, user_id, entries in buckets
+        ]
+
+    def count_tombstones_before(self, db, cutoff):
+        """Entries deleted before cutoff, counted on the server without loading the buckets"""
+        result = list(db[self.collection_name].aggregate([
+            {"$match": {"e.x": {"$lt": cutoff}}},
+            {"$unwind": "$e"},
+            {"$match": {"e.x": {"$lt": cutoff}}},
+            {"$count": "entries"},
+        ]))
+        return result[0]["entries"] if result else 0
+
+    def stored_size(self, log):
+        """Bytes a log takes in this layout: its compact entry plus its photo document"""
+        size = len(bson.encode(self.encode(log)))
+        if log.get("image_base64") and self.images_collection is not None:
+            size += len(bson.encode({"_id": to_binary(log["id"]), "u": to_binary(log["user_id"]), "image_base64": log["image_base64"]}))
+        return size
+
+    def purge(self, db, bucket_id, log_ids):
+        """Hard-delete the given tombstones (and their photos) from a bucket; empty buckets are dropped"""
+        ids = [to_binary(log_id) for log_id in log_ids]
+        db[self.collection_name].update_one(
+            {"_id": bucket_id},
+            {"$pull": {"e": {"i": {"$in": ids}, "x": {"$exists": True}}}, "$inc": {"v": 1}}
+        )
+        db[self.collection_name].delete_one({"_id": bucket_id, "e": {"$size": 0}})
+        if self.images_collection is not None:
+            db[self.images_collection].delete_many({"_id": {"$in": ids}})
+
+# ==================== DUAL WRITES ====================
+
+class DualLogs:
+    """Writes to both layouts and reads from `primary`, for the length of a migration"""
+
+    def __init__(self, primary, secondary):
+        self.primary = primary
+        self.secondary = secondary
+        self.collection_name = primary.collection_name
+
+    def ensure_indexes(self, db):
+        self.primary.ensure_indexes(db)
+        self.secondary.ensure_indexes(db)
+
+    def insert(self, db, logs):
+        self.primary.insert(db, logs)
+        # insert_many added _id to the documents; buckets have no use for it
+        self.secondary.insert(db, [{key: value for key, value in log.items() if key != "_id"} for log in logs])
+
+    def delete(self, db, user_id, log_id, change):
+        deleted = self.primary.delete(db, user_id, log_id, change)
+        # Logs not migrated yet have no bucket entry; the migration copies their tombstone later
+        self.secondary.delete(db, user_id, log_id, change)
+        return deleted
+
+    def evict(self, db, user_id, log_ids):
+        self.primary.evict(db, user_id, log_ids)
+        self.secondary.evict(db, user_id, log_ids)
+
+    def live_ids(self, *args, **kwargs):
+        return self.primary.live_ids(*args, **kwargs)
+
+    def deleted_ids(self, *args, **kwargs):
+        return self.primary.deleted_ids(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return self.primary.find(*args, **kwargs)
+
+    def iterate(self, *args, **kwargs):
+        return self.primary.iterate(*args, **kwargs)
+
+    def changes(self, *args, **kwargs):
+        return self.primary.changes(*args, **kwargs)
+
+    def snapshot(self, *args, **kwargs):
+        return self.primary.snapshot(*args, **kwargs)
+
+def open_store(kind, mode="documents"):
+    """Log store for kind ("food" or "workout") in LOG_STORAGE mode"""
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"LOG_STORAGE must be one of {', '.join(STORAGE_MODES)}, not {mode!r}")
+    collection_name, bucket_collection, fields, images_collection = KINDS[kind]
+    documents = DocumentLogs(collection_name)
+    if mode == "documents":
+        return documents
+    buckets = BucketedLogs(bucket_collection, fields, images_collection)
+    return buckets if mode == "buckets" else DualLogs(documents, buckets)
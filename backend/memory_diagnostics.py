@@ -0,0 +1,159 @@
+"""tracemalloc-based memory diagnostics for the API process.
+
+Tracing is off by default and can be switched on at runtime from the admin
+endpoints. While it is on, snapshots can be taken and diffed. With
+MEMORY_ROUTE_PEAKS=1 the peak traced memory of each request is also attributed
+to its route. tracemalloc has a single process-wide peak, and resetting it for
+one request would wipe it for any other in flight, so only requests that ran
+alone are measured; overlapping ones are counted but not attributed.
+"""
+from datetime import datetime, timezone
+import itertools
+import os
+import resource
+import threading
+import tracemalloc
+
+_TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+class MemoryDiagnostics:
+    def __init__(self, max_snapshots=5):
+        self.max_snapshots = max_snapshots
+        self.snapshots = {}
+        self.snapshot_ids = itertools.count(1)
+        self.route_peaks = {}
+        self.in_flight = 0
+        # Bumped whenever a request starts while another is running
+        self.overlaps = 0
+        self.concurrent_requests = 0
+        self.lock = threading.Lock()
+
+    # ---------- tracing ----------
+
+    def start(self, frames=10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.status()
+
+    def stop(self):
+        tracemalloc.stop()
+        with self.lock:
+            self.snapshots.clear()
+        return self.status()
+
+    def status(self):
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traceback_frames": tracemalloc.get_traceback_limit(),
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "rss_bytes": current_rss(),
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "snapshots": sorted(self.snapshots),
+            "unattributed_concurrent_requests": self.concurrent_requests,
+        }
+
+    # ---------- snapshots ----------
+
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+        with self.lock:
+            snapshot_id = next(self.snapshot_ids)
+            self.snapshots[snapshot_id] = (datetime.now(timezone.utc), snapshot)
+            for old_id in sorted(self.snapshots)[:-self.max_snapshots]:
+                del self.snapshots[old_id]
+        return snapshot_id
+
+    def top(self, snapshot_id, group_by="lineno", limit=25):
+        taken_at, snapshot = self.snapshots[snapshot_id]
+        stats = snapshot.statistics(group_by)
+        return {
+            "snapshot_id": snapshot_id,
+            "taken_at": taken_at.isoformat(),
+            "total_bytes": sum(stat.size for stat in stats),
+            "top": [_stat_entry(stat) for stat in stats[:limit]],
+        }
+
+    def diff(self, from_id, to_id, group_by="lineno", limit=25):
+        _, before = self.snapshots[from_id]
+        _, after = self.snapshots[to_id]
+        stats = after.compare_to(before, group_by)
+        return {
+            "from_snapshot": from_id,
+            "to_snapshot": to_id,
+            "size_diff_bytes": sum(stat.size_diff for stat in stats),
+            "top": [
+                dict(_stat_entry(stat), size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+                for stat in stats[:limit]
+            ],
+        }
+
+    # ---------- per-route peaks ----------
+
+    async def track_request(self, request, call_next):
+        """Middleware body: record peak traced memory per route while tracing is on"""
+        if not tracemalloc.is_tracing():
+            return await call_next(request)
+
+        # Runs on the event loop, so these counters need no lock
+        alone = self.in_flight == 0
+        if not alone:
+            self.overlaps += 1
+        overlaps = self.overlaps
+        self.in_flight += 1
+        if alone:
+            baseline, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        try:
+            response = await call_next(request)
+        finally:
+            self.in_flight -= 1
+        if not alone or self.overlaps != overlaps or not tracemalloc.is_tracing():
+            self.concurrent_requests += 1
+            return response
+        _, peak = tracemalloc.get_traced_memory()
+
+        route = request.scope.get("route")
+        key = f"{request.method} {route.path if route else 'unmatched'}"
+        allocated = max(0, peak - baseline)
+        with self.lock:
+            entry = self.route_peaks.setdefault(key, {"requests": 0, "max_peak_bytes": 0, "total_peak_bytes": 0})
+            entry["requests"] += 1
+            entry["total_peak_bytes"] += allocated
+            entry["max_peak_bytes"] = max(entry["max_peak_bytes"], allocated)
+        return response
+
+    def routes(self):
+        with self.lock:
+            items = [dict(entry, route=route) for route, entry in self.route_peaks.items()]
+        for item in items:
+            item["avg_peak_bytes"] = item["total_peak_bytes"] / item["requests"]
+        return sorted(items, key=lambda item: item["max_peak_bytes"], reverse=True)
+
+    def reset_routes(self):
+        with self.lock:
+            self.route_peaks.clear()
+            self.concurrent_requests = 0
+
+def _stat_entry(stat):
+    return {
+        "size_bytes": stat.size,
+        "count": stat.count,
+        "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+    }
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,365 @@
+"""In-process metrics with Prometheus text exposition.
+
+Kept dependency-free and cheap: observations are a dict lookup, a bisect and a
+few integer adds under a lock. Rendering happens only when /metrics is scraped.
+
+With several worker processes a scrape lands on one of them, so on its own it
+would report that worker's counters only, jumping between scrapes. When
+METRICS_MULTIPROC_DIR is set (server.py sets it for WEB_CONCURRENCY > 1) every
+worker writes its values to <dir>/<pid>.json every METRICS_WRITE_SECONDS and on
+shutdown, and /metrics sums the files of all workers. Counters and histograms
+of exited workers stay in the sum so totals never go backwards; gauges only
+count live workers. A scrape folds the files of exited workers into one
+exited.json, so the directory holds one file per live worker plus that one
+however often workers are restarted.
+"""
+from bisect import bisect_left
+from pymongo import monitoring
+import fcntl
+import json
+import os
+import threading
+import time
+
+MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+# Summed counters and histograms of workers that have exited
+EXITED_FILE = "exited.json"
+
+# Latency buckets in seconds, from fast index hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [(name, value) for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = sorted((self.values if values is None else values).items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self.values[key] = value
+
+    def render(self, values=None):
+        lines = super().render(values)
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, seconds, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, seconds)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = sorted((key, list(series)) for key, series in (self.values if values is None else values).items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', repr(bound)))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+# ==================== METRICS ====================
+
+http_request_duration = Histogram(
+    "apak_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+http_requests = Counter(
+    "apak_http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+mongo_command_duration = Histogram(
+    "apak_mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_command_failures = Counter(
+    "apak_mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+mongo_pool_connections = Gauge(
+    "apak_mongo_pool_connections", "Open MongoDB pool connections", ("address",))
+mongo_pool_checked_out = Gauge(
+    "apak_mongo_pool_checked_out_connections", "MongoDB pool connections currently in use", ("address",))
+mongo_pool_wait = Histogram(
+    "apak_mongo_pool_checkout_wait_seconds", "Time spent waiting for a pool connection", ("address",))
+llm_request_duration = Histogram(
+    "apak_llm_request_duration_seconds", "LLM call latency", ("provider", "model", "outcome"))
+llm_failures = Counter(
+    "apak_llm_failures_total", "Failed LLM calls", ("provider", "model"))
+llm_hedges = Counter(
+    "apak_llm_hedges_total", "Requests that started the next model because this one was slow", ("provider", "model"))
+llm_wins = Counter(
+    "apak_llm_wins_total", "Requests answered by this model", ("provider", "model"))
+cache_requests = Counter(
+    "apak_cache_requests_total", "Cache lookups by result", ("cache", "result"))
+group_commit_flushes = Counter(
+    "apak_group_commit_flushes_total", "Group-commit batches written, by what triggered the flush", ("collection", "reason"))
+group_commit_batch_size = Histogram(
+    "apak_group_commit_batch_documents", "Documents per group-commit batch", ("collection",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+group_commit_wait = Histogram(
+    "apak_group_commit_wait_seconds", "Time from queueing a document to its batch being acknowledged", ("collection",))
+leaderboard_fallbacks = Counter(
+    "apak_leaderboard_fallbacks_total", "Leaderboard stats writes that ran out of compare-and-set retries", ("operation",))
+
+REGISTRY = [
+    http_request_duration, http_requests,
+    mongo_command_duration, mongo_command_failures,
+    mongo_pool_connections, mongo_pool_checked_out, mongo_pool_wait,
+    llm_request_duration, llm_failures, llm_hedges, llm_wins,
+    cache_requests,
+    group_commit_flushes, group_commit_batch_size, group_commit_wait,
+    leaderboard_fallbacks,
+]
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+def render():
+    """Prometheus text exposition of all registered metrics, with derived cache hit ratios"""
+    merged = _merged_values(MULTIPROC_DIR) if MULTIPROC_DIR else {}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(merged.get(metric.name)))
+
+    caches = {}
+    with _lock:
+        cache_counts = list(merged.get(cache_requests.name, cache_requests.values).items())
+    for (cache, result), count in cache_counts:
+        caches.setdefault(cache, {"hit": 0, "miss": 0})[result] = count
+    lines.append("# HELP apak_cache_hit_ratio Cache hit ratio since process start")
+    lines.append("# TYPE apak_cache_hit_ratio gauge")
+    for cache, counts in sorted(caches.items()):
+        total = counts["hit"] + counts["miss"]
+        lines.append(f'apak_cache_hit_ratio{{cache="{cache}"}} {counts["hit"] / total if total else 0.0}')
+
+    return "\n".join(lines) + "\n"
+
+# ==================== MULTIPROCESS ====================
+
+_writer_stop = threading.Event()
+
+def write_values(directory):
+    """Write this worker's values to <directory>/<pid>.json, replacing the previous file atomically"""
+    with _lock:
+        values = {metric.name: [[list(key), value] for key, value in metric.values.items()] for metric in REGISTRY}
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"pid": os.getpid(), "values": values}, f)
+    os.replace(f"{path}.tmp", path)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def _add(totals, key, value):
+    if key not in totals:
+        totals[key] = value
+    elif isinstance(value, list):
+        totals[key] = [a + b for a, b in zip(totals[key], value)]
+    else:
+        totals[key] += value
+
+def _read_worker(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _fold_exited(directory):
+    """Add the counters and histograms of exited workers to exited.json and remove their files"""
+    exited = []
+    for name in os.listdir(directory):
+        if name.endswith(".json") and name != EXITED_FILE:
+            worker = _read_worker(os.path.join(directory, name))
+            if worker is not None and not _alive(worker["pid"]):
+                exited.append((name, worker))
+    if not exited:
+        return
+    path = os.path.join(directory, EXITED_FILE)
+    previous = (_read_worker(path) or {}).get("values", {})
+    values = {}
+    for metric in REGISTRY:
+        if isinstance(metric, Gauge):
+            continue
+        totals = {}
+        for values_of in [previous] + [worker["values"] for _, worker in exited]:
+            for key, value in values_of.get(metric.name, []):
+                _add(totals, tuple(key), value)
+        values[metric.name] = [[list(key), value] for key, value in totals.items()]
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"pid": None, "values": values}, f)
+    os.replace(f"{path}.tmp", path)
+    # A crash before these removals counts the exited workers twice until the next fold
+    for name, _ in exited:
+        os.remove(os.path.join(directory, name))
+
+def _merged_values(directory):
+    """metric name -> {label key: value} summed over the files of every worker"""
+    write_values(directory)
+    merged = {}
+    # One scrape at a time folds and reads, so no worker's values are counted twice or lost
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _fold_exited(directory)
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            worker = _read_worker(os.path.join(directory, name))
+            if worker is None:
+                continue
+            alive = worker["pid"] is not None and _alive(worker["pid"])
+            for metric in REGISTRY:
+                if isinstance(metric, Gauge) and not alive:
+                    continue
+                totals = merged.setdefault(metric.name, {})
+                for key, value in worker["values"].get(metric.name, []):
+                    _add(totals, tuple(key), value)
+    return merged
+
+def start_writer(directory, interval_seconds=5.0):
+    """Keep this worker's file in `directory` fresh until stop_writer()"""
+    os.makedirs(directory, exist_ok=True)
+    _writer_stop.clear()
+
+    def run():
+        while not _writer_stop.wait(interval_seconds):
+            write_values(directory)
+
+    threading.Thread(target=run, name="metrics-writer", daemon=True).start()
+
+def stop_writer(directory):
+    _writer_stop.set()
+    # Final values, so this worker's counters outlive it
+    write_values(directory)
+
+# ==================== PYMONGO MONITORING ====================
+
+class CommandTimer(monitoring.CommandListener):
+    """Times every MongoDB command by collection and command name"""
+
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self.pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        mongo_command_failures.inc(collection=collection, command=event.command_name)
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections per server address"""
+
+    def __init__(self):
+        self.open = {}
+        self.checked_out = {}
+        self.checkout_started = {}
+
+    def _address(self, event):
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _adjust(self, counts, gauge, event, delta):
+        address = self._address(event)
+        with _lock:
+            counts[address] = max(0, counts.get(address, 0) + delta)
+            value = counts[address]
+        gauge.set(value, address=address)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        mongo_pool_connections.set(0, address=address)
+        mongo_pool_checked_out.set(0, address=address)
+
+    def connection_created(self, event):
+        self._adjust(self.open, mongo_pool_connections, event, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._adjust(self.open, mongo_pool_connections, event, -1)
+
+    def connection_check_out_started(self, event):
+        self.checkout_started[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self.checkout_started.pop(threading.get_ident(), None)
+
+    def connection_checked_out(self, event):
+        started = self.checkout_started.pop(threading.get_ident(), None)
+        if started is not None:
+            mongo_pool_wait.observe(time.perf_counter() - started, address=self._address(event))
+        self._adjust(self.checked_out, mongo_pool_checked_out, event, 1)
+
+    def connection_checked_in(self, event):
+        self._adjust(self.checked_out, mongo_pool_checked_out, event, -1)
+
+def mongo_listeners():
+    """Listeners to pass as MongoClient(event_listeners=...)"""
+    return [CommandTimer(), PoolMonitor()]
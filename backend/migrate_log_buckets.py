@@ -0,0 +1,273 @@
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from datetime import datetime, timezone, timedelta
+from log_store import KINDS, BucketedLogs, DocumentLogs, day_of, to_binary
+from itertools import groupby
+import argparse
+import json
+import os
+import statistics
+import time
+import bson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+database_name = os.getenv("DATABASE_NAME", "apak_fitness")
+client = MongoClient(mongo_url)
+db = client[database_name]
+
+MIGRATION_BATCH_USERS = int(os.getenv("MIGRATION_BATCH_USERS", "200"))
+MIGRATION_PAUSE_SECONDS = float(os.getenv("MIGRATION_PAUSE_SECONDS", "0.2"))
+# Cursor batch size of the per-user log scan
+MIGRATION_BATCH_LOGS = int(os.getenv("MIGRATION_BATCH_LOGS", "200"))
+# Progress document, so an interrupted backfill resumes after the last finished user
+PROGRESS_ID = "log_buckets"
+
+# Online migration, with the API serving throughout:
+#   1. deploy with LOG_STORAGE=dual   every new write and delete goes to both layouts
+#   2. --backfill                     copy existing logs and tombstones into buckets
+#   3. --verify                       compare both layouts user by user
+#   4. deploy with LOG_STORAGE=buckets
+# The backfill merges into buckets with compare-and-set on their version, so it
+# never drops an entry a dual write added while it was copying that day.
+
+def stores(kind):
+    collection_name, bucket_collection, fields, images_collection = KINDS[kind]
+    return DocumentLogs(collection_name), BucketedLogs(bucket_collection, fields, images_collection)
+
+def _newer(entry, other):
+    # A later change (or the delete of the same change) wins
+    return (entry.get("s", 0), "x" in entry) > (other.get("s", 0), "x" in other)
+
+def merge_day(buckets, user_id, day, logs, max_retries=10):
+    """Merge one user-day of document logs into its bucket; returns True when the bucket changed"""
+    collection = db[buckets.collection_name]
+    user = to_binary(user_id)
+    source = {}
+    for log in logs:
+        entry = buckets.encode(log)
+        source[entry["i"]] = entry
+
+    for _ in range(max_retries):
+        bucket = collection.find_one({"u": user, "d": day})
+        existing = {entry["i"]: entry for entry in bucket["e"]} if bucket else {}
+        merged = dict(existing)
+        for entry_id, entry in source.items():
+            if entry_id not in merged or _newer(entry, merged[entry_id]):
+                merged[entry_id] = entry
+        if bucket is not None and merged == existing:
+            return False
+        entries = sorted(merged.values(), key=lambda entry: entry["t"])
+        live = sum(1 for entry in entries if "x" not in entry)
+        if bucket is None:
+            try:
+                collection.insert_one({"u": user, "d": day, "n": live, "v": 0, "e": entries})
+                return True
+            except DuplicateKeyError:
+                continue
+        result = collection.update_one(
+            {"_id": bucket["_id"], "v": bucket["v"]},
+            {"$set": {"e": entries, "n": live}, "$inc": {"v": 1}}
+        )
+        if result.matched_count:
+            return True
+    raise RuntimeError(f"Bucket {user_id} {day.date()} kept changing during the merge")
+
+def copy_images(buckets, logs):
+    if buckets.images_collection is None:
+        return
+    for log in logs:
+        if log.get("image_base64"):
+            db[buckets.images_collection].update_one(
+                {"_id": to_binary(log["id"])},
+                {"$setOnInsert": {"u": to_binary(log["user_id"]), "image_base64": log["image_base64"]}},
+                upsert=True
+            )
+
+def backfill_user(kind, user_id, batch_size=MIGRATION_BATCH_LOGS):
+    """Copy one user's document logs into buckets a day at a time; returns (logs copied, buckets changed)"""
+    documents, buckets = stores(kind)
+    # Tombstones too: clients syncing from an older cursor still need them. Listing both is_deleted
+    # values lets the (user_id, is_deleted, logged_at) index return them merged in logged_at order,
+    # so only one day of logs (and photos) is held at a time
+    query = {"user_id": user_id, "is_deleted": {"$in": [False, True]}}
+    copied = changed = 0
+    with db[documents.collection_name].find(query).sort("logged_at", 1).batch_size(batch_size) as cursor:
+        for day, logs in groupby(cursor, key=lambda log: day_of(log["logged_at"])):
+            logs = list(logs)
+            copy_images(buckets, logs)
+            changed += merge_day(buckets, user_id, day, logs)
+            copied += len(logs)
+    return copied, changed
+
+def backfill(kinds, batch_users, pause_seconds, restart=False):
+    for kind in kinds:
+        stores(kind)[1].ensure_indexes(db)
+    progress = db.migrations.find_one({"_id": PROGRESS_ID}) or {}
+    after = None if restart else progress.get("last_user_id")
+    if after:
+        print(f"↪️  Resuming after user {after}")
+    totals = {"users": 0, "logs": 0, "buckets_written": 0}
+    started = time.perf_counter()
+    while True:
+        query = {"_id": {"$gt": after}} if after else {}
+        user_ids = [user["_id"] for user in db.users.find(query, {"_id": 1}).sort("_id", 1).limit(batch_users)]
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            for kind in kinds:
+                logs, changed = backfill_user(kind, user_id)
+                totals["logs"] += logs
+                totals["buckets_written"] += changed
+        after = user_ids[-1]
+        totals["users"] += len(user_ids)
+        db.migrations.update_one(
+            {"_id": PROGRESS_ID},
+            {"$set": {"last_user_id": after, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        rate = totals["logs"] / (time.perf_counter() - started)
+        print(f"   {totals['users']} users, {totals['logs']} logs, {totals['buckets_written']} buckets written ({rate:.0f} logs/s)")
+        if len(user_ids) < batch_users:
+            break
+        time.sleep(pause_seconds)
+    db.migrations.update_one({"_id": PROGRESS_ID}, {"$set": {"finished_at": datetime.now(timezone.utc)}}, upsert=True)
+    return totals
+
+def verify(kinds, limit=None):
+    """User ids whose live logs differ between the layouts, per kind"""
+    mismatches = {kind: [] for kind in kinds}
+    cursor = db.users.find({}, {"_id": 1}).sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    checked = 0
+    for user in cursor:
+        for kind in kinds:
+            documents, buckets = stores(kind)
+            expected = {(log["id"], log.get("change_seq")) for log in documents.iterate(db, user["_id"])}
+            actual = {(log["id"], log.get("change_seq")) for log in buckets.iterate(db, user["_id"])}
+            if expected != actual:
+                mismatches[kind].append(user["_id"])
+        checked += 1
+    print(f"🔎 Verified {checked} users: " + ", ".join(f"{kind} {len(users)} mismatched" for kind, users in mismatches.items()))
+    return mismatches
+
+# ==================== COMPARISON ====================
+
+def collection_size(name):
+    """count / data / storage / index bytes, from collStats when the server has it"""
+    try:
+        stats = db.command({"collStats": name})
+        return {
+            "count": stats["count"], "data_bytes": stats["size"],
+            "storage_bytes": stats.get("storageSize"), "index_bytes": stats.get("totalIndexSize"),
+            "indexes": stats.get("nindexes"),
+        }
+    except (OperationFailure, NotImplementedError):
+        sizes = [len(bson.encode(doc)) for doc in db[name].find()]
+        return {"count": len(sizes), "data_bytes": sum(sizes), "storage_bytes": None, "index_bytes": None, "indexes": None}
+
+def _explain(cursor):
+    try:
+        stats = cursor.explain()["executionStats"]
+        return stats["totalKeysExamined"], stats["totalDocsExamined"]
+    except (OperationFailure, NotImplementedError, AttributeError, KeyError):
+        return None, None
+
+def scan_cost(kind, user_ids, days, repeats):
+    """Index keys and documents examined, and wall time, of a `days`-day view in both layouts"""
+    documents, buckets = stores(kind)
+    end = day_of(datetime.now(timezone.utc)) + timedelta(days=1)
+    start = end - timedelta(days=days)
+    report = {}
+    for label, store in (("documents", documents), ("buckets", buckets)):
+        keys, docs, timings, logs = [], [], [], 0
+        for user_id in user_ids:
+            if store is documents:
+                cursor = db[documents.collection_name].find(
+                    {"user_id": user_id, "is_deleted": False, "logged_at": {"$gte": start, "$lt": end}}, {"image_base64": 0})
+            else:
+                cursor = db[buckets.collection_name].find({"u": to_binary(user_id), "d": {"$gte": start, "$lt": end}})
+            examined_keys, examined_docs = _explain(cursor)
+            if examined_docs is None:
+                # No explain available: count what the query returns instead
+                examined_docs = len(list(cursor.clone()))
+            keys.append(examined_keys)
+            docs.append(examined_docs)
+            for _ in range(repeats):
+                started = time.perf_counter()
+                found = store.find(db, user_id, start, end, include_images=False)
+                timings.append((time.perf_counter() - started) * 1000)
+            logs += len(found)
+        report[label] = {
+            "logs_per_user": logs / max(1, len(user_ids)),
+            "keys_examined_per_user": statistics.fmean(keys) if None not in keys else None,
+            "docs_examined_per_user": statistics.fmean(docs),
+            "median_ms": statistics.median(timings) if timings else None,
+        }
+    return report
+
+def compare(kinds, sample_users, repeats):
+    user_ids = [user["_id"] for user in db.users.find({}, {"_id": 1}).sort("_id", 1).limit(sample_users)]
+    result = {"database": database_name, "sample_users": len(user_ids), "kinds": {}}
+    for kind in kinds:
+        documents, buckets = stores(kind)
+        storage = {"documents": collection_size(documents.collection_name), "buckets": collection_size(buckets.collection_name)}
+        if buckets.images_collection:
+            storage["bucket_images"] = collection_size(buckets.images_collection)
+        result["kinds"][kind] = {
+            "storage": storage,
+            "day_view": scan_cost(kind, user_ids, 1, repeats),
+            "week_view": scan_cost(kind, user_ids, 7, repeats),
+        }
+    return result
+
+def print_comparison(result):
+    print("\n" + "=" * 96)
+    print(f"📦 LOG STORAGE LAYOUTS ({result['database']}, {result['sample_users']} sampled users)")
+    print("=" * 96)
+    for kind, report in result["kinds"].items():
+        for label, stats in report["storage"].items():
+            index = f"{stats['index_bytes'] / 1024 / 1024:.2f} MB" if stats["index_bytes"] is not None else "-"
+            print(f"{kind:<9}{label:<15}{stats['count']:>10} docs {stats['data_bytes'] / 1024 / 1024:>10.2f} MB data   indexes {index}")
+        for view in ("day_view", "week_view"):
+            for label, stats in report[view].items():
+                keys = f"{stats['keys_examined_per_user']:.1f}" if stats["keys_examined_per_user"] is not None else "-"
+                median = f"{stats['median_ms']:.2f}" if stats["median_ms"] is not None else "-"
+                print(f"{kind:<9}{view:<10}{label:<11}{stats['logs_per_user']:>8.1f} logs  "
+                      f"{stats['docs_examined_per_user']:>8.1f} docs  {keys:>8} keys  {median:>8} ms")
+    print("=" * 96)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate food/workout logs to per-user-day buckets and compare the layouts")
+    parser.add_argument("--kinds", default="food,workout")
+    parser.add_argument("--backfill", action="store_true", help="copy document logs into buckets (run with LOG_STORAGE=dual deployed)")
+    parser.add_argument("--restart", action="store_true", help="backfill from the first user instead of resuming")
+    parser.add_argument("--verify", action="store_true", help="compare live logs of both layouts per user")
+    parser.add_argument("--verify-limit", type=int, default=None)
+    parser.add_argument("--compare", action="store_true", help="report storage size and day/week scan cost of both layouts")
+    parser.add_argument("--sample-users", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the comparison as JSON here")
+    parser.add_argument("--batch-users", type=int, default=MIGRATION_BATCH_USERS)
+    parser.add_argument("--pause", type=float, default=MIGRATION_PAUSE_SECONDS, help="seconds to sleep between user batches")
+    args = parser.parse_args()
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+
+    if args.backfill:
+        totals = backfill(kinds, args.batch_users, args.pause, args.restart)
+        print(f"✅ {totals['users']} users, {totals['logs']} logs backfilled, {totals['buckets_written']} buckets written")
+    if args.verify:
+        mismatches = verify(kinds, args.verify_limit)
+        for kind, user_ids in mismatches.items():
+            for user_id in user_ids[:20]:
+                print(f"   {kind}: {user_id}")
+    if args.compare:
+        result = compare(kinds, args.sample_users, args.repeats)
+        print_comparison(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2, default=str)
+            print(f"Result written to {args.output}")
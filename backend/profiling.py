@@ -0,0 +1,133 @@
+"""Opt-in per-request sampling profiler with speedscope output.
+
+A background thread samples the stack of the thread serving the request every
+few milliseconds via sys._current_frames(). Nothing runs unless a request is
+selected for profiling, so the cost when profiling is off is one header lookup.
+Async requests share the event loop thread, so samples taken while other
+requests are running on the loop are attributed to the profiled one as well;
+profile under light load for clean flamegraphs.
+"""
+from datetime import datetime, timezone
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+class Sampler:
+    def __init__(self, thread_id, interval_ms=1.0):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.frames = []
+        self.frame_index = {}
+        self.samples = []
+        self.weights = []
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _frame_id(self, code, lineno):
+        key = (code.co_filename, code.co_name, code.co_firstlineno)
+        index = self.frame_index.get(key)
+        if index is None:
+            index = self.frame_index[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append((now - last) * 1000)
+            last = now
+
+    def speedscope(self, name):
+        """Speedscope 'sampled' profile document"""
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "apak-fitness-profiler",
+            "name": name,
+            "activeProfileIndex": 0,
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": self.elapsed * 1000,
+                "samples": self.samples,
+                "weights": self.weights,
+            }],
+        }
+
+class ProfileStore:
+    """Speedscope files in a directory, newest first, pruned to the most recent `keep`"""
+
+    def __init__(self, directory, keep=200):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, sampler, method, route, status):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        filename = f"{stamp}_{method}_{slug}.speedscope.json"
+        document = sampler.speedscope(f"{method} {route} -> {status} ({sampler.elapsed * 1000:.1f} ms)")
+        with open(os.path.join(self.directory, filename), "w") as f:
+            json.dump(document, f)
+        self.prune()
+        return filename
+
+    def prune(self):
+        for name in self.names()[self.keep:]:
+            os.remove(os.path.join(self.directory, name))
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((name for name in os.listdir(self.directory) if name.endswith(".speedscope.json")), reverse=True)
+
+    def list(self, limit=50):
+        profiles = []
+        for name in self.names()[:limit]:
+            path = os.path.join(self.directory, name)
+            profiles.append({
+                "name": name,
+                "size_bytes": os.path.getsize(path),
+                "created_at": datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).isoformat(),
+            })
+        return profiles
+
+    def path(self, name):
+        """Absolute path of a stored profile, or None if the name is unknown"""
+        if name not in self.names():
+            return None
+        return os.path.join(self.directory, name)
+
+def should_profile(header_value, token, sample_rate):
+    # Constant-time comparison, so response timing does not leak the token
+    if token and header_value and hmac.compare_digest(header_value.encode(), token.encode()):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
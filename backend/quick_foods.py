@@ -0,0 +1,113 @@
+"""Per-user recent and frequent foods, maintained on every food-log write.
+
+Each user has one small document in `quick_foods` (keyed by user id) listing
+the foods they log, with how often and when they last logged each one and the
+portion they used. It keeps only the union of the top-K most recent and top-K
+most frequent entries, so it stays bounded however long the history gets, and
+re-logging screens read it with a single _id lookup instead of scanning
+food_logs. Writers use compare-and-set on a version field, so concurrent logs
+from the same user never lose an update.
+"""
+from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
+from log_store import DocumentLogs
+
+QUICK_FOODS_COLLECTION = "quick_foods"
+PORTION_FIELDS = ("portion_size", "calories", "protein", "carbs", "fat", "recipe_id")
+
+def _key(log):
+    return log.get("recipe_id") or log["food_name"]
+
+def _count(entries, log):
+    key = _key(log)
+    entry = entries.setdefault(key, {"key": key, "food_name": log["food_name"], "count": 0})
+    entry["count"] += 1
+    # Logs are applied oldest first, so the latest portion is the one offered for re-logging
+    entry["last_logged_at"] = log["logged_at"]
+    entry.update({field: log[field] for field in PORTION_FIELDS if log.get(field) is not None})
+
+class QuickFoods:
+    def __init__(self, top_k=20, backfill_logs=500, max_retries=5, food_logs=None):
+        self.top_k = top_k
+        self.food_logs = food_logs or DocumentLogs("food_logs")
+        # How much history a first read of a user without a document is rebuilt from
+        self.backfill_logs = backfill_logs
+        self.max_retries = max_retries
+
+    def record(self, db, user_id, logs):
+        """Count newly inserted food logs"""
+        def apply(entries):
+            for log in logs:
+                _count(entries, log)
+        self._update(db, user_id, apply)
+
+    def remove(self, db, user_id, log):
+        """Uncount a deleted food log; the last portion stays as it was"""
+        def apply(entries):
+            entry = entries.get(_key(log))
+            if entry is None:
+                return
+            entry["count"] -= 1
+            if entry["count"] <= 0:
+                del entries[entry["key"]]
+        self._update(db, user_id, apply)
+
+    def get(self, db, user_id, limit=10):
+        doc = db[QUICK_FOODS_COLLECTION].find_one({"_id": user_id})
+        if doc is None:
+            doc = self.rebuild(db, user_id)
+        entries = doc["foods"]
+        return {
+            "recent": _top(entries, "last_logged_at")[:limit],
+            "frequent": _top(entries, "count")[:limit],
+        }
+
+    def rebuild(self, db, user_id):
+        """Recreate a user's document from their latest food logs"""
+        logs = self.food_logs.find(db, user_id, include_images=False, limit=self.backfill_logs)
+        entries = {}
+        for log in reversed(logs):
+            _count(entries, log)
+        doc = {"_id": user_id, "foods": self._trim(entries), "version": 0, "updated_at": datetime.now(timezone.utc)}
+        try:
+            db[QUICK_FOODS_COLLECTION].insert_one(doc)
+        except DuplicateKeyError:
+            # A concurrent write created it first; that one is at least as fresh
+            return db[QUICK_FOODS_COLLECTION].find_one({"_id": user_id})
+        return doc
+
+    def _update(self, db, user_id, apply):
+        collection = db[QUICK_FOODS_COLLECTION]
+        for _ in range(self.max_retries):
+            doc = collection.find_one({"_id": user_id})
+            if doc is None:
+                # The rebuild reads food_logs, which already reflect the write that triggered this update
+                self.rebuild(db, user_id)
+                return
+            entries = {entry["key"]: entry for entry in doc["foods"]}
+            apply(entries)
+            result = collection.update_one(
+                {"_id": user_id, "version": doc["version"]},
+                {"$set": {"foods": self._trim(entries), "updated_at": datetime.now(timezone.utc)},
+                 "$inc": {"version": 1}}
+            )
+            if result.matched_count:
+                return
+        # Persistent contention: rebuild from the logs themselves on the next read
+        collection.delete_one({"_id": user_id})
+
+    def _trim(self, entries):
+        values = list(entries.values())
+        keep = {entry["key"] for entry in _top(values, "last_logged_at")[:self.top_k]}
+        keep.update(entry["key"] for entry in _top(values, "count")[:self.top_k])
+        return [entry for entry in values if entry["key"] in keep]
+
+def _utc(value):
+    # Documents read back without tz_aware carry naive UTC datetimes; new logs carry aware ones
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def _top(entries, field):
+    # Ties on count go to the more recent entry
+    if field == "last_logged_at":
+        return sorted(entries, key=lambda entry: _utc(entry["last_logged_at"]), reverse=True)
+    return sorted(entries, key=lambda entry: (entry[field], _utc(entry["last_logged_at"])), reverse=True)
@@ -0,0 +1,101 @@
+"""Token-bucket rate limiting for expensive endpoints.
+
+Each rule allows `capacity` requests in a burst, refilled continuously at
+capacity / period_seconds tokens per second. Buckets live in process memory by
+default; with the Mongo backend every check is one atomic find_one_and_update,
+so limits hold across workers and hosts.
+"""
+from pymongo import ReturnDocument
+import math
+import time
+from datetime import datetime, timezone
+
+RATE_LIMIT_COLLECTION = "rate_limits"
+
+def parse_rules(spec):
+    """Parse "analyze_food=10/60,login=5/60" into {"analyze_food": (10, 60.0), "login": (5, 60.0)}"""
+    rules = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition("=")
+        capacity, _, period = limit.partition("/")
+        rules[name.strip()] = (int(capacity), float(period or 60))
+    return rules
+
+class MemoryBuckets:
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        # key -> [tokens, updated_monotonic]
+        self.buckets = {}
+
+    def take(self, key, capacity, rate):
+        """Consume one token; returns seconds to wait, or 0 when the request is allowed"""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_entries:
+                self._prune(now, capacity, rate)
+            bucket = self.buckets[key] = [float(capacity), now]
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+
+    def _prune(self, now, capacity, rate):
+        # Buckets that have refilled completely carry no state worth keeping
+        idle_after = capacity / rate
+        for key in [key for key, (_, updated) in self.buckets.items() if now - updated >= idle_after]:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_entries:
+            oldest = sorted(self.buckets, key=lambda key: self.buckets[key][1])[:len(self.buckets) // 10 or 1]
+            for key in oldest:
+                del self.buckets[key]
+
+class MongoBuckets:
+    def __init__(self, collection, ttl_seconds=86400):
+        self.collection = collection
+        self.collection.create_index("updated_at", expireAfterSeconds=ttl_seconds)
+
+    def take(self, key, capacity, rate):
+        now = datetime.now(timezone.utc)
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}, rate]},
+        ]}]}
+        doc = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["allowed"]:
+            return 0
+        return (1 - doc["tokens"]) / rate
+
+class RateLimiter:
+    def __init__(self, rules, backend):
+        self.rules = rules
+        self.backend = backend
+
+    def check(self, rule, identity):
+        """Seconds until a retry can succeed (rounded up), or 0 when allowed or the rule is not configured"""
+        if rule not in self.rules:
+            return 0
+        capacity, period = self.rules[rule]
+        wait = self.backend.take(f"{rule}:{identity}", capacity, capacity / period)
+        return math.ceil(wait) if wait else 0
+
+def client_ip(request, trust_forwarded_for=False):
+    if trust_forwarded_for:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
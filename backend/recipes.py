@@ -0,0 +1,34 @@
+"""Nutrition math for user-defined recipes.
+
+A recipe is stored with the same per-100g fields as a turkish_foods entry,
+computed once when it is saved: the ingredients' per-100g columns are weighted
+by their gram amounts and summed, then normalised to 100 g of the finished
+dish. Logging a portion is then a single multiply, exactly like a catalog food.
+"""
+
+NUTRIENT_FIELDS = ("calories_per_100g", "protein_per_100g", "carbs_per_100g", "fat_per_100g")
+LOG_FIELDS = ("calories", "protein", "carbs", "fat")
+
+def nutrition_vector(food):
+    return [float(food.get(field) or 0) for field in NUTRIENT_FIELDS]
+
+def per_100g(foods, grams, cooked_grams=None):
+    """Per-100g vector of a dish made from `grams[i]` of `foods[i]`.
+
+    `cooked_grams` is the finished weight when cooking changes it (water lost or
+    absorbed); it defaults to the sum of the ingredient weights. Raises
+    ValueError for a dish that weighs nothing.
+    """
+    if len(foods) != len(grams):
+        raise ValueError("Each ingredient needs a gram amount")
+    final_grams = float(cooked_grams or sum(grams))
+    if final_grams <= 0:
+        raise ValueError("A recipe must weigh more than 0 g")
+    columns = zip(*(nutrition_vector(food) for food in foods))
+    # Each column holds nutrients per 100 g, so sum(value * grams / 100) is the dish total; scale that to 100 g
+    return [sum(value * amount for value, amount in zip(column, grams)) / final_grams for column in columns]
+
+def portion(recipe, portion_grams):
+    """Log-ready nutrition values for `portion_grams` of a food or recipe document"""
+    multiplier = portion_grams / 100
+    return {log_field: recipe[field] * multiplier for field, log_field in zip(NUTRIENT_FIELDS, LOG_FIELDS)}
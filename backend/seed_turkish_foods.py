@@ -1,6 +1,9 @@
 from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
+from catalog import name_key, CURATED_SOURCES
+from ingest_foods import ensure_catalog_indexes
+from catalog_publish import publish, FOOD_FIELDS
 
 load_dotenv()
 
@@ -141,10 +144,18 @@ turkish_foods = [
     {"name": "Çerez Karışımı", "calories_per_100g": 520, "protein_per_100g": 17, "carbs_per_100g": 30, "fat_per_100g": 38, "category": "Atıştırmalık"},
 ]
 
-# Clear existing and insert
-db.turkish_foods.delete_many({})
+# Build the new catalog next to the live one and swap it in atomically. Seed rows
+# are marked source "seed"; rows loaded by ingest_foods.py carry their dataset's
+# source and are carried over. Seed ids are never carried over, which also drops
+# seed rows an earlier ingest stamped with its own source.
 for food in turkish_foods:
     food["id"] = food["name"].lower().replace(" ", "_")
-    db.turkish_foods.insert_one(food)
+    food["name_key"] = name_key(food["name"])
+    food["source"] = "seed"
+version = publish(
+    db, "turkish_foods", turkish_foods, FOOD_FIELDS,
+    carry_over={"source": {"$nin": CURATED_SOURCES}, "id": {"$nin": [food["id"] for food in turkish_foods]}},
+    prepare=ensure_catalog_indexes
+)
 
-print(f"✅ {len(turkish_foods)} Turkish foods inserted successfully!")
+print(f"✅ {len(turkish_foods)} Turkish foods published as version {version}!")
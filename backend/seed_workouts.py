@@ -1,6 +1,7 @@
 from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
+from catalog_publish import publish, EXERCISE_FIELDS
 
 load_dotenv()
 
@@ -78,7 +79,7 @@ workout_exercises = [
     {"name": "Tenis", "calories_per_minute": 7, "category": "Raket Sporu", "intensity": "Yüksek"},
     {"name": "Badminton", "calories_per_minute": 6, "category": "Raket Sporu", "intensity": "Orta"},
     {"name": "Masa Tenisi", "calories_per_minute": 4, "category": "Raket Sporu", "intensity": "Orta"},
-    {"name": "Kayak", "calories_per_100g": 7, "category": "Kış Sporu", "intensity": "Yüksek"},
+    {"name": "Kayak", "calories_per_minute": 7, "category": "Kış Sporu", "intensity": "Yüksek"},
     {"name": "Snowboard", "calories_per_minute": 6, "category": "Kış Sporu", "intensity": "Yüksek"},
     
     # Diğer Aktiviteler
@@ -88,10 +89,12 @@ workout_exercises = [
     {"name": "Kar Küreme", "calories_per_minute": 7, "category": "Aktivite", "intensity": "Yüksek"},
 ]
 
-# Create collection for workout reference
-db.workout_exercises.delete_many({})
+# Build the new reference collection next to the live one and swap it in atomically
 for exercise in workout_exercises:
     exercise["id"] = exercise["name"].lower().replace(" ", "_").replace("(", "").replace(")", "")
-    db.workout_exercises.insert_one(exercise)
+version = publish(
+    db, "workout_exercises", workout_exercises, EXERCISE_FIELDS,
+    prepare=lambda collection: collection.create_index("name")
+)
 
-print(f"✅ {len(workout_exercises)} workout exercises inserted successfully!")
+print(f"✅ {len(workout_exercises)} workout exercises published as version {version}!")
@@ -1,24 +1,83 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Cookie, Response, Header
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Cookie, Response, Header, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timezone, timedelta
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 import os
 from dotenv import load_dotenv
 import uuid
-import base64
 import io
-from PIL import Image
-import requests
+import csv
+import json
+import re
+import zlib
 import asyncio
-from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
 import bcrypt
 import secrets
+import time
+import metrics
+import slow_queries
+import profiling
+import threading
+from memory_diagnostics import MemoryDiagnostics
+from catalog import Catalog, normalize_barcode, search_curated, search_ingested
+import rate_limit
+from idempotency import IdempotencyStore, IDEMPOTENCY_COLLECTION
+import uploads
+import recipes
+from quick_foods import QuickFoods
+import leaderboards
+import live_updates
+import group_commit
+import log_store
+import cold_storage
+import sync
+import llm_hedging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import logging
 
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger("apak")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(connect_database)
+    await warm_up()
+    live.start(db, asyncio.get_running_loop())
+    if metrics.MULTIPROC_DIR:
+        metrics.start_writer(metrics.MULTIPROC_DIR, float(os.getenv("METRICS_WRITE_SECONDS", "5")))
+    yield
+    app.state.ready = False
+    live.stop()
+    await drain_analyses(GRACEFUL_SHUTDOWN_SECONDS)
+    if log_writer is not None:
+        await log_writer.close(db)
+    if metrics.MULTIPROC_DIR:
+        metrics.stop_writer(metrics.MULTIPROC_DIR)
+    close_database()
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
+app.state.warmup = {}
+
+# Upload size cap, enforced while the body is received (added before CORS so 413s still carry CORS headers)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_MEAL_IMAGES = int(os.getenv("MAX_MEAL_IMAGES", "4"))
+# Allowance for multipart framing around each file
+UPLOAD_BODY_OVERHEAD_BYTES = 64 * 1024
+app.add_middleware(
+    uploads.UploadSizeLimitMiddleware,
+    limits={
+        "/api/analyze-food": MAX_UPLOAD_BYTES + UPLOAD_BODY_OVERHEAD_BYTES,
+        "/api/analyze-meal": MAX_MEAL_IMAGES * (MAX_UPLOAD_BYTES + UPLOAD_BODY_OVERHEAD_BYTES)
+    }
+)
 
 # CORS
 app.add_middleware(
@@ -29,14 +88,264 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB
+# Request metrics
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    slow_queries.request_scope.set(request.scope)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep series cardinality bounded
+        route = request.scope.get("route")
+        route_path = route.path if route else "unmatched"
+        metrics.http_request_duration.observe(time.perf_counter() - started, method=request.method, route=route_path)
+        metrics.http_requests.inc(method=request.method, route=route_path, status=status)
+
+# Request profiling (opt-in: privileged X-Profile header or sampling rate)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+profile_store = profiling.ProfileStore(os.getenv("PROFILE_DIR", "/tmp/apak_profiles"), int(os.getenv("PROFILE_KEEP", "200")))
+
+async def profile_request(request: Request, call_next):
+    if not profiling.should_profile(request.headers.get("x-profile"), PROFILE_TOKEN, PROFILE_SAMPLE_RATE):
+        return await call_next(request)
+    
+    sampler = profiling.Sampler(threading.get_ident(), PROFILE_INTERVAL_MS)
+    sampler.start()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        sampler.stop()
+        route = request.scope.get("route")
+        route_path = route.path if route else request.url.path
+        name = await run_in_threadpool(profile_store.save, sampler, request.method, route_path, status)
+    response.headers["X-Profile-Id"] = name
+    return response
+
+# Only installed when enabled, so there is no per-request cost when profiling is off
+if PROFILE_TOKEN or PROFILE_SAMPLE_RATE > 0:
+    app.middleware("http")(profile_request)
+
+# Memory diagnostics (tracemalloc, switched on at runtime from the admin endpoints)
+memory_diagnostics = MemoryDiagnostics(max_snapshots=int(os.getenv("MEMORY_MAX_SNAPSHOTS", "5")))
+# Per-route peaks need a middleware; like profiling it is only installed when asked for
+MEMORY_ROUTE_PEAKS = os.getenv("MEMORY_ROUTE_PEAKS") == "1"
+if MEMORY_ROUTE_PEAKS:
+    app.middleware("http")(memory_diagnostics.track_request)
+if os.getenv("MEMORY_TRACE_ON_START") == "1":
+    memory_diagnostics.start(int(os.getenv("MEMORY_TRACE_FRAMES", "10")))
+
+# Slow-query log
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+slow_query_recorder = slow_queries.SlowQueryRecorder(SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_EXPLAIN_SAMPLE_RATE)
+
+# MongoDB (the client is created by connect_database() in the lifespan handler, not at import)
 mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
 database_name = os.getenv("DATABASE_NAME", "apak_fitness")
-client = MongoClient(mongo_url)
-db = client[database_name]
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+client = None
+db = None
+
+# Rate limiting: "rule=capacity/seconds" token buckets, in memory or shared through Mongo
+RATE_LIMITS = rate_limit.parse_rules(os.getenv("RATE_LIMITS", "analyze_food=20/3600,login=10/60,register=5/3600"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR") == "1"
+rate_limiter = None
+
+# Idempotency keys for log-creating POSTs
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+idempotency_store = IdempotencyStore(wait_seconds=float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60")))
+
+# Reference catalogs served from memory once warm-up has loaded them
+catalog = Catalog(version_check_seconds=float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "5")))
+
+# Storage layout of food/workout logs: one document per log ("documents"), one per user per
+# day ("buckets"), or both written while migrate_log_buckets.py backfills ("dual")
+LOG_STORAGE = os.getenv("LOG_STORAGE", "documents")
+food_log_store = log_store.open_store("food", LOG_STORAGE)
+workout_log_store = log_store.open_store("workout", LOG_STORAGE)
+
+# Logs older than COLD_STORAGE_AFTER_DAYS that tier_cold_logs.py moved to per-user monthly files are read through
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", "")
+COLD_STORAGE_AFTER_DAYS = int(os.getenv("COLD_STORAGE_AFTER_DAYS", "180"))
+if COLD_STORAGE_DIR:
+    food_log_store = cold_storage.TieredLogs(food_log_store, cold_storage.ColdLogs(COLD_STORAGE_DIR, "food"), COLD_STORAGE_AFTER_DAYS)
+    workout_log_store = cold_storage.TieredLogs(workout_log_store, cold_storage.ColdLogs(COLD_STORAGE_DIR, "workout"), COLD_STORAGE_AFTER_DAYS)
+
+# Weekly friend leaderboards, maintained on workout writes
+leaderboard = leaderboards.Leaderboards(max_friends=int(os.getenv("MAX_FRIENDS", "1000")), workout_logs=workout_log_store)
+
+# Live dashboard push (SSE): heartbeat interval and maximum stream lifetime before the client reconnects
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "20"))
+LIVE_STREAM_MAX_SECONDS = float(os.getenv("LIVE_STREAM_MAX_SECONDS", "300"))
+live = live_updates.LiveUpdates(capped_size_bytes=int(os.getenv("LIVE_EVENTS_CAPPED_MB", "64")) * 1024 * 1024)
+
+# Per-user recent/frequent foods for quick re-logging
+quick_foods = QuickFoods(top_k=int(os.getenv("QUICK_FOODS_TOP_K", "20")), food_logs=food_log_store)
+
+# Optional group commit for food/workout log inserts: batches of up to LOG_WRITE_BATCH_SIZE
+# documents, each held at most LOG_WRITE_BATCH_MS, written with LOG_WRITE_CONCERN (w) / LOG_WRITE_JOURNAL (j)
+LOG_WRITE_BATCHING = os.getenv("LOG_WRITE_BATCHING") == "1"
+log_writer = group_commit.GroupCommitWriter(
+    max_batch=int(os.getenv("LOG_WRITE_BATCH_SIZE", "100")),
+    max_delay_ms=float(os.getenv("LOG_WRITE_BATCH_MS", "5")),
+    write_concern=group_commit.parse_write_concern(
+        os.getenv("LOG_WRITE_CONCERN"), os.getenv("LOG_WRITE_JOURNAL"), os.getenv("LOG_WRITE_WTIMEOUT_MS")
+    )
+) if LOG_WRITE_BATCHING else None
+
+def connect_database():
+    """Create this process's MongoClient and database handle (idempotent)"""
+    global client, db, rate_limiter
+    if client is None:
+        client = MongoClient(
+            mongo_url,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            event_listeners=metrics.mongo_listeners() + [slow_query_recorder]
+        )
+        db = client[database_name]
+        slow_query_recorder.attach(db)
+        if RATE_LIMIT_BACKEND == "mongo":
+            buckets = rate_limit.MongoBuckets(db[rate_limit.RATE_LIMIT_COLLECTION])
+        else:
+            buckets = rate_limit.MemoryBuckets()
+        rate_limiter = rate_limit.RateLimiter(RATE_LIMITS, buckets)
+    return db
 
-# Gemini API Key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+def close_database():
+    global client, db
+    slow_query_recorder.detach()
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+def ensure_indexes(database):
+    """Create the indexes the hot queries rely on; no-op when they already exist"""
+    database.user_sessions.create_index("session_token")
+    database.users.create_index("email")
+    database.food_logs.create_index([("user_id", 1), ("is_deleted", 1), ("logged_at", -1)])
+    database.food_logs.create_index("id")
+    database.workout_logs.create_index([("user_id", 1), ("is_deleted", 1), ("logged_at", -1)])
+    database.workout_logs.create_index("id")
+    database.achievements.create_index([("user_id", 1), ("earned_at", -1)])
+    database.turkish_foods.create_index("name")
+    database.turkish_foods.create_index("barcode", unique=True, partialFilterExpression={"barcode": {"$type": "string"}})
+    database.recipes.create_index([("user_id", 1), ("is_deleted", 1), ("name", 1)])
+    database.recipes.create_index("id")
+    sync.ensure_sync_indexes(database)
+    food_log_store.ensure_indexes(database)
+    workout_log_store.ensure_indexes(database)
+    database[leaderboards.FRIEND_REQUESTS_COLLECTION].create_index([("from_user_id", 1), ("to_user_id", 1)], unique=True)
+    database[leaderboards.FRIEND_REQUESTS_COLLECTION].create_index([("to_user_id", 1), ("created_at", -1)])
+    database[IDEMPOTENCY_COLLECTION].create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+
+def load_llm_client():
+    """Import the LLM SDK on first use (or during warm-up) instead of at module import"""
+    from emergentintegrations.llm import chat
+    return chat
+
+def _fill_connection_pool():
+    # Concurrent pings force the pool to open MONGO_MIN_POOL_SIZE connections now instead of on first requests
+    workers = max(1, MONGO_MIN_POOL_SIZE)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda _: client.admin.command("ping"), range(workers)))
+
+async def warm_up():
+    """Open the Mongo pool, verify indexes, preload catalogs and the LLM SDK, then mark the worker ready"""
+    timings = {}
+    
+    async def step(name, fn, *args):
+        started = time.perf_counter()
+        result = await run_in_threadpool(fn, *args)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+    
+    await step("mongo_ping_ms", client.admin.command, "ping")
+    await step("mongo_pool_ms", _fill_connection_pool)
+    await step("indexes_ms", ensure_indexes, db)
+    foods, exercises = await step("catalog_ms", catalog.load, db)
+    try:
+        await step("llm_import_ms", load_llm_client)
+    except ImportError as e:
+        logger.warning("LLM SDK could not be imported during warm-up: %s", e)
+    
+    app.state.warmup = timings
+    app.state.ready = True
+    logger.info("Warm-up complete (%d foods, %d exercises): %s", foods, exercises, timings)
+
+# Admin users (comma-separated emails) for diagnostics endpoints
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# LLM model chain ("provider:model,..."), tried in order and hedged when the current model is slow
+LLM_MODELS = llm_hedging.parse_models(os.getenv("LLM_MODELS", f"gemini:{GEMINI_MODEL}"))
+# Each provider's key comes from its own variable (GEMINI_API_KEY, OPENAI_API_KEY, ANTHROPIC_API_KEY, ...)
+LLM_API_KEYS = llm_hedging.api_keys(LLM_MODELS)
+if not os.getenv("LLM_FAKE_MODELS"):
+    unkeyed = [f"{provider}:{model}" for provider, model in LLM_MODELS if provider not in LLM_API_KEYS]
+    if len(unkeyed) == len(LLM_MODELS):
+        logger.warning("No API key for any model of LLM_MODELS; food analysis will fail")
+    elif unkeyed:
+        logger.warning("Skipping LLM models without an API key: %s", ", ".join(unkeyed))
+        LLM_MODELS = [(provider, model) for provider, model in LLM_MODELS if provider in LLM_API_KEYS]
+# Fixed hedge delay; unset means the current model's running p95 latency
+LLM_HEDGE_AFTER_MS = float(os.environ["LLM_HEDGE_AFTER_MS"]) if os.getenv("LLM_HEDGE_AFTER_MS") else None
+llm_chain = llm_hedging.HedgedModelChain(
+    LLM_MODELS,
+    hedge_after_ms=LLM_HEDGE_AFTER_MS,
+    default_hedge_ms=float(os.getenv("LLM_HEDGE_DEFAULT_MS", "4000"))
+)
+# Offline testing: "model=latency_ms~jitter_ms!failure_rate,..." replaces the SDK with fake backends
+llm_fake_backend = llm_hedging.FakeBackend.from_spec(os.environ["LLM_FAKE_MODELS"]) if os.getenv("LLM_FAKE_MODELS") else None
+if llm_fake_backend is not None:
+    llm_fake_backend.check(LLM_MODELS)
+
+# Emergent Auth
+EMERGENT_AUTH_URL = os.getenv("EMERGENT_AUTH_URL", "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data")
+
+def available_cpus():
+    """CPUs this process may actually use: its affinity mask, capped by a cgroup v2 CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+# Production serving: worker processes (default: one per usable CPU) and shutdown drain budget
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or available_cpus()
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "90"))
+
+# In-flight LLM analyses in this worker, drained before the Mongo client is closed on shutdown
+analyses_in_flight = 0
+
+async def drain_analyses(timeout):
+    deadline = time.monotonic() + timeout
+    while analyses_in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if analyses_in_flight:
+        logger.warning("Shutting down with %d LLM analyses still running", analyses_in_flight)
+
+# Export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
 
 # ==================== MODELS ====================
 
@@ -94,6 +403,18 @@ class TurkishFood(BaseModel):
     fat_per_100g: float
     category: str
 
+MAX_RECIPE_INGREDIENTS = 50
+
+class RecipeIngredient(BaseModel):
+    food_name: str = Field(min_length=1, max_length=200)
+    grams: float = Field(gt=0, allow_inf_nan=False)
+
+class RecipeCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=200)
+    ingredients: List[RecipeIngredient] = Field(min_length=1, max_length=MAX_RECIPE_INGREDIENTS)
+    # Finished weight when cooking changes it; defaults to the sum of the ingredients
+    cooked_grams: Optional[float] = Field(None, gt=0, allow_inf_nan=False)
+
 class WorkoutLog(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -136,9 +457,43 @@ async def get_current_user(session_token: Optional[str] = Cookie(None), authoriz
     user_doc["id"] = user_doc.pop("_id")
     return User(**user_doc)
 
+def _enforce_rate_limit(rule: str, identity: str):
+    if rate_limiter is None:
+        return
+    retry_after = rate_limiter.check(rule, identity)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Çok fazla istek. Lütfen biraz sonra tekrar deneyin",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+def rate_limited_by_user(rule: str, idempotent_route: Optional[str] = None):
+    """Dependency limiting a route per authenticated user (reuses the request's get_current_user result).
+
+    With `idempotent_route`, a retry whose Idempotency-Key the route already holds
+    is not charged, so it reaches the stored response instead of a 429.
+    """
+    async def dependency(current_user: User = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+        if idempotent_route and idempotency_store.is_retry(db, idempotency_key, current_user.id, idempotent_route):
+            return
+        _enforce_rate_limit(rule, f"user:{current_user.id}")
+    return dependency
+
+def rate_limited_by_ip(rule: str):
+    """Dependency limiting a route per client IP, for endpoints called before authentication"""
+    async def dependency(request: Request):
+        _enforce_rate_limit(rule, f"ip:{rate_limit.client_ip(request, TRUST_FORWARDED_FOR)}")
+    return dependency
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Bu işlem için yetkiniz yok")
+    return current_user
+
 # ==================== AUTH ENDPOINTS ====================
 
-@app.post("/api/auth/register")
+@app.post("/api/auth/register", dependencies=[Depends(rate_limited_by_ip("register"))])
 async def register_user(email: str, password: str, name: str, response: Response):
     """Register new user with email and password"""
     # Check if user already exists
@@ -183,7 +538,7 @@ async def register_user(email: str, password: str, name: str, response: Response
     
     return {"success": True, "user_id": user_id, "needs_onboarding": True}
 
-@app.post("/api/auth/login")
+@app.post("/api/auth/login", dependencies=[Depends(rate_limited_by_ip("login"))])
 async def login_user(email: str, password: str, response: Response):
     """Login user with email and password"""
     # Find user
@@ -226,8 +581,9 @@ async def login_user(email: str, password: str, response: Response):
 @app.post("/api/auth/session")
 async def create_session(session_id: str, response: Response):
     """Process session_id from Emergent Auth"""
+    import requests
     auth_response = requests.get(
-        "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+        EMERGENT_AUTH_URL,
         headers={"X-Session-ID": session_id}
     )
     
@@ -311,6 +667,7 @@ async def complete_onboarding(data: OnboardingData, current_user: User = Depends
     else:
         daily_calories = int(tdee)  # Maintenance
     
+    change = stamp_change(current_user.id)
     db.users.update_one(
         {"_id": current_user.id},
         {"$set": {
@@ -320,30 +677,143 @@ async def complete_onboarding(data: OnboardingData, current_user: User = Depends
             "weight_kg": data.weight_kg,
             "goal_weight_kg": data.goal_weight_kg,
             "activity_level": data.activity_level,
-            "daily_calorie_goal": daily_calories
+            "daily_calorie_goal": daily_calories,
+            **change
         }}
     )
     
+    live.publish(db, current_user.id, "profile.updated", {"daily_calorie_goal": daily_calories}, change["change_seq"])
     return {"success": True, "daily_calorie_goal": daily_calories}
 
+# ==================== LOG CHANGE HOOKS ====================
+
+async def insert_log(store, log: Dict[str, Any]):
+    """Insert one food or workout log, through the group-commit writer when enabled"""
+    if isinstance(store, cold_storage.TieredLogs):
+        store = store.hot
+    if log_writer is not None and isinstance(store, log_store.DocumentLogs):
+        await log_writer.insert(db, store.collection_name, log)
+    else:
+        await run_in_threadpool(store.insert, db, [log])
+
+async def add_logs(store, user: User, logs: List[Dict[str, Any]], created):
+    """Stamp, insert and announce new food or workout logs.
+
+    Reserving sequence numbers and the `created` hook (quick foods or the
+    leaderboard, and the live event) are blocking Mongo round trips. They run on
+    the threadpool so the event loop keeps accepting the concurrent inserts that
+    group commit batches together.
+    """
+    await run_in_threadpool(stamp_change, user.id, logs)
+    if len(logs) == 1:
+        await insert_log(store, logs[0])
+    else:
+        await run_in_threadpool(store.insert, db, logs)
+    await run_in_threadpool(created, user, logs)
+
+def stamp_change(user_id: str, docs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Give docs (or one update, when none are passed) consecutive numbers from the user's change sequence"""
+    count = len(docs) if docs else 1
+    last = live_updates.next_seq(db, user_id, count)
+    changed_at = datetime.now(timezone.utc)
+    for offset, doc in enumerate(docs or []):
+        doc["change_seq"] = last - count + 1 + offset
+        doc["changed_at"] = changed_at
+    return {"change_seq": last, "changed_at": changed_at}
+
+def _log_event(log: Dict[str, Any], sign: int, fields: List[str]) -> Dict[str, Any]:
+    """Compact live event: the log (without its image) and the change it makes to its day's totals"""
+    logged_at = log["logged_at"]
+    delta = {"date": logged_at.date().isoformat()}
+    delta.update({field: sign * (log.get(field) or 0) for field in fields})
+    if sign > 0:
+        return {"log": {key: value for key, value in log.items() if key not in ("_id", "image_base64")}, "delta": delta}
+    return {"id": log["id"], "delta": delta}
+
+def food_logs_created(user: User, logs: List[Dict[str, Any]]):
+    quick_foods.record(db, user.id, logs)
+    for log in logs:
+        live.publish(db, user.id, "food_log.created", _log_event(log, 1, ["calories", "protein", "carbs", "fat"]), log["change_seq"])
+
+def food_log_deleted(user: User, log: Dict[str, Any]):
+    quick_foods.remove(db, user.id, log)
+    live.publish(db, user.id, "food_log.deleted", _log_event(log, -1, ["calories", "protein", "carbs", "fat"]), log["change_seq"])
+
+def workout_logs_created(user: User, logs: List[Dict[str, Any]]):
+    for log in logs:
+        leaderboard.record(db, user, log)
+        live.publish(db, user.id, "workout_log.created", _log_event(log, 1, ["calories_burned", "duration_minutes"]), log["change_seq"])
+
+def workout_log_deleted(user: User, log: Dict[str, Any]):
+    leaderboard.remove(db, user.id, log)
+    live.publish(db, user.id, "workout_log.deleted", _log_event(log, -1, ["calories_burned", "duration_minutes"]), log["change_seq"])
+
 # ==================== FOOD ANALYSIS WITH GEMINI ====================
 
-@app.post("/api/analyze-food")
-async def analyze_food(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    # Read image
-    image_data = await file.read()
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
+@app.post("/api/analyze-food", dependencies=[Depends(rate_limited_by_user("analyze_food", "POST /api/analyze-food"))])
+async def analyze_food(file: UploadFile = File(...), current_user: User = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    global analyses_in_flight
+    analyses_in_flight += 1
+    try:
+        return await idempotency_store.run(db, idempotency_key, current_user.id, "POST /api/analyze-food", lambda: _analyze_food(file, current_user))
+    finally:
+        analyses_in_flight -= 1
+
+NUTRITIONIST_SYSTEM_MESSAGE = "Sen bir beslenme uzmanısın. Yemek fotoğraflarını analiz ederek yemek adını, tahmini porsiyon miktarını ve besin değerlerini tahmin ediyorsun."
+
+def _parse_llm_json(response: str):
+    response_text = response.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+    return json.loads(response_text.strip())
+
+async def _ask_llm(session_prefix: str, prompt: str, images_base64: List[str]):
+    """Send one prompt with images through the hedged model chain and return the parsed JSON answer"""
+    if llm_fake_backend is not None:
+        return await llm_chain.run(
+            lambda provider, model: llm_fake_backend.send(provider, model, prompt, images_base64), _parse_llm_json
+        )
+    
+    llm = load_llm_client()
+    
+    async def send(provider, model):
+        chat = llm.LlmChat(
+            api_key=LLM_API_KEYS.get(provider, ""),
+            session_id=f"{session_prefix}_{uuid.uuid4()}",
+            system_message=NUTRITIONIST_SYSTEM_MESSAGE
+        ).with_model(provider, model)
+        user_message = llm.UserMessage(
+            text=prompt,
+            file_contents=[llm.ImageContent(image_base64=image_base64) for image_base64 in images_base64]
+        )
+        return await chat.send_message(user_message)
+    
+    return await llm_chain.run(send, _parse_llm_json)
+
+def _food_log_from_analysis(user_id: str, dish: Dict[str, Any], image_base64: Optional[str], image_sha256: str, logged_at: datetime) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "food_name": dish["food_name"],
+        "portion_size": dish["portion_size"],
+        "calories": float(dish["calories"]),
+        "protein": float(dish.get("protein", 0)),
+        "carbs": float(dish.get("carbs", 0)),
+        "fat": float(dish.get("fat", 0)),
+        "image_base64": image_base64,
+        "image_sha256": image_sha256,
+        "logged_at": logged_at,
+        "is_deleted": False
+    }
+
+async def _analyze_food(file: UploadFile, current_user: User):
+    # Read image in chunks: size cap, magic-byte check, sha256 and base64 in one pass
+    image_base64, image_sha256, _, _ = await uploads.read_image(file, MAX_UPLOAD_BYTES)
     
     # Analyze with Gemini
     try:
-        chat = LlmChat(
-            api_key=GEMINI_API_KEY,
-            session_id=f"food_analysis_{uuid.uuid4()}",
-            system_message="Sen bir beslenme uzmanısın. Yemek fotoğraflarını analiz ederek yemek adını, tahmini porsiyon miktarını ve besin değerlerini tahmin ediyorsun."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        image_content = ImageContent(image_base64=image_base64)
-        
         prompt = """Bu görseldeki yemeği analiz et ve aşağıdaki bilgileri JSON formatında ver:
 {
   "food_name": "yemek adı (Türkçe)",
@@ -356,42 +826,86 @@ async def analyze_food(file: UploadFile = File(...), current_user: User = Depend
 
 Sadece JSON formatında cevap ver, başka açıklama ekleme."""
         
-        user_message = UserMessage(
-            text=prompt,
-            file_contents=[image_content]
-        )
+        food_data = await _ask_llm("food_analysis", prompt, [image_base64])
         
-        response = await chat.send_message(user_message)
+        # Save to database
+        food_log = _food_log_from_analysis(current_user.id, food_data, image_base64, image_sha256, datetime.now(timezone.utc))
+        await add_logs(food_log_store, current_user, [food_log], food_logs_created)
         
-        # Parse response
-        import json
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
+        return food_data
         
-        food_data = json.loads(response_text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analiz hatası: {str(e)}")
+
+@app.post("/api/analyze-meal", dependencies=[Depends(rate_limited_by_user("analyze_food", "POST /api/analyze-meal"))])
+async def analyze_meal(files: List[UploadFile] = File(...), current_user: User = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    """Analyze up to MAX_MEAL_IMAGES photos, each possibly showing several dishes, in one LLM call"""
+    global analyses_in_flight
+    analyses_in_flight += 1
+    try:
+        return await idempotency_store.run(db, idempotency_key, current_user.id, "POST /api/analyze-meal", lambda: _analyze_meal(files, current_user))
+    finally:
+        analyses_in_flight -= 1
+
+async def _analyze_meal(files: List[UploadFile], current_user: User):
+    if len(files) > MAX_MEAL_IMAGES:
+        raise HTTPException(status_code=400, detail=f"En fazla {MAX_MEAL_IMAGES} fotoğraf yükleyebilirsiniz")
+    
+    images = [await uploads.read_image(file, MAX_UPLOAD_BYTES) for file in files]
+    
+    try:
+        prompt = f"""Sana {len(images)} adet yemek fotoğrafı gönderiyorum (sırayla 0'dan {len(images) - 1}'e kadar numaralı).
+Her fotoğrafta birden fazla yemek olabilir (örn: çorba, pilav, salata, ekmek). Her fotoğraftaki HER yemeği ayrı ayrı analiz et ve JSON formatında ver:
+{{
+  "images": [
+    {{
+      "image_index": fotoğraf numarası (sayı),
+      "dishes": [
+        {{
+          "food_name": "yemek adı (Türkçe)",
+          "portion_size": "tahmini porsiyon (örn: '1 kase', '1 porsiyon', '2 dilim', '100 gram', vb.)",
+          "calories": tahmini kalori sayısı (sayı),
+          "protein": protein gramı (sayı),
+          "carbs": karbonhidrat gramı (sayı),
+          "fat": yağ gramı (sayı)
+        }}
+      ]
+    }}
+  ]
+}}
+
+Sadece JSON formatında cevap ver, başka açıklama ekleme."""
         
-        # Save to database
-        food_log = {
-            "id": str(uuid.uuid4()),
-            "user_id": current_user.id,
-            "food_name": food_data["food_name"],
-            "portion_size": food_data["portion_size"],
-            "calories": float(food_data["calories"]),
-            "protein": float(food_data.get("protein", 0)),
-            "carbs": float(food_data.get("carbs", 0)),
-            "fat": float(food_data.get("fat", 0)),
-            "image_base64": image_base64,
-            "logged_at": datetime.now(timezone.utc),
-            "is_deleted": False
-        }
+        analysis = await _ask_llm("meal_analysis", prompt, [image_base64 for image_base64, _, _, _ in images])
         
-        db.food_logs.insert_one(food_log)
+        # One log per dish; the photo itself is stored once, on the first dish of each image
+        meal_id = str(uuid.uuid4())
+        logged_at = datetime.now(timezone.utc)
+        food_logs = []
+        results = []
+        for item in analysis.get("images", []):
+            index = int(item.get("image_index", 0))
+            if index < 0 or index >= len(images):
+                continue
+            image_base64, image_sha256, _, _ = images[index]
+            dishes = item.get("dishes", [])
+            for position, dish in enumerate(dishes):
+                food_log = _food_log_from_analysis(
+                    current_user.id, dish, image_base64 if position == 0 else None, image_sha256, logged_at
+                )
+                food_log["meal_id"] = meal_id
+                food_logs.append(food_log)
+            results.append({"image_index": index, "dishes": dishes})
         
-        return food_data
+        if food_logs:
+            await add_logs(food_log_store, current_user, food_logs, food_logs_created)
+        
+        return {
+            "meal_id": meal_id,
+            "images": results,
+            "total_calories": sum(log["calories"] for log in food_logs),
+            "dishes_count": len(food_logs)
+        }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analiz hatası: {str(e)}")
@@ -400,43 +914,65 @@ Sadece JSON formatında cevap ver, başka açıklama ekleme."""
 
 @app.get("/api/food-logs")
 async def get_food_logs(date: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {"user_id": current_user.id, "is_deleted": False}
-    
+    start_date = end_date = None
     if date:
         start_date = datetime.fromisoformat(date.replace('Z', '+00:00'))
         end_date = start_date + timedelta(days=1)
-        query["logged_at"] = {"$gte": start_date, "$lt": end_date}
     
-    logs = list(db.food_logs.find(query).sort("logged_at", -1))
+    logs = food_log_store.find(db, current_user.id, start_date, end_date)
     for log in logs:
         log["_id"] = str(log.get("_id", ""))
     return logs
 
 @app.delete("/api/food-logs/{log_id}")
 async def delete_food_log(log_id: str, current_user: User = Depends(get_current_user)):
-    db.food_logs.update_one(
-        {"id": log_id, "user_id": current_user.id},
-        {"$set": {"is_deleted": True}}
-    )
+    # A number taken for a delete that matches nothing would leave a gap that resets live-update replays
+    if not food_log_store.live_ids(db, current_user.id, [log_id]):
+        return {"success": True}
+    change = stamp_change(current_user.id)
+    deleted = food_log_store.delete(db, current_user.id, log_id, change)
+    if deleted:
+        food_log_deleted(current_user, deleted)
     return {"success": True}
 
 # ==================== TURKISH FOODS DATABASE ====================
 
 @app.get("/api/turkish-foods")
 async def get_turkish_foods(search: Optional[str] = None):
-    query = {}
-    if search:
-        query["name"] = {"$regex": search, "$options": "i"}
+    if catalog.loaded:
+        metrics.record_cache("food_catalog", True)
+        catalog.refresh_if_stale(db)
+        return catalog.search_foods(db, search, limit=50)
     
-    foods = list(db.turkish_foods.find(query).limit(50))
-    for food in foods:
-        food["_id"] = str(food.get("_id", ""))
-    return foods
+    metrics.record_cache("food_catalog", False)
+    foods = search_curated(db, search, 50)
+    return foods + search_ingested(db, search, 50 - len(foods))
+
+@app.get("/api/foods/barcode/{barcode}")
+async def get_food_by_barcode(barcode: str):
+    food = db.turkish_foods.find_one({"barcode": normalize_barcode(barcode)}, {"_id": 0})
+    if not food:
+        raise HTTPException(status_code=404, detail="Ürün bulunamadı")
+    return food
 
 @app.post("/api/food-logs/manual")
-async def add_manual_food_log(food_name: str, portion_grams: float, current_user: User = Depends(get_current_user)):
+async def add_manual_food_log(food_name: str, portion_grams: float, current_user: User = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return await idempotency_store.run(
+        db, idempotency_key, current_user.id, "POST /api/food-logs/manual",
+        lambda: _add_manual_food_log(food_name, portion_grams, current_user)
+    )
+
+def _find_catalog_food(food_name: str):
+    if catalog.loaded:
+        metrics.record_cache("food_catalog", True)
+        catalog.refresh_if_stale(db)
+        return catalog.find_food(db, food_name)
+    metrics.record_cache("food_catalog", False)
+    return next(iter(search_curated(db, food_name, 1) or search_ingested(db, food_name, 1)), None)
+
+async def _add_manual_food_log(food_name: str, portion_grams: float, current_user: User):
     # Find food in Turkish foods database
-    food = db.turkish_foods.find_one({"name": {"$regex": food_name, "$options": "i"}})
+    food = _find_catalog_food(food_name)
     
     if not food:
         raise HTTPException(status_code=404, detail="Yemek bulunamadı")
@@ -457,29 +993,121 @@ async def add_manual_food_log(food_name: str, portion_grams: float, current_user
         "is_deleted": False
     }
     
-    db.food_logs.insert_one(food_log)
+    await add_logs(food_log_store, current_user, [food_log], food_logs_created)
     # Remove MongoDB _id for JSON serialization
     food_log.pop("_id", None)
     return food_log
 
+# ==================== RECIPES ====================
+
+@app.post("/api/recipes")
+async def create_recipe(data: RecipeCreate, current_user: User = Depends(get_current_user)):
+    """Save a home-made dish with its per-100g nutrition computed from catalog ingredients"""
+    foods = []
+    for ingredient in data.ingredients:
+        food = _find_catalog_food(ingredient.food_name)
+        if not food:
+            raise HTTPException(status_code=404, detail=f"Malzeme bulunamadı: {ingredient.food_name}")
+        foods.append(food)
+    
+    grams = [ingredient.grams for ingredient in data.ingredients]
+    vector = recipes.per_100g(foods, grams, data.cooked_grams)
+    recipe = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "name": data.name,
+        "category": "Tarif",
+        "ingredients": [{"food_name": food["name"], "grams": amount} for food, amount in zip(foods, grams)],
+        "total_grams": data.cooked_grams or sum(grams),
+        **dict(zip(recipes.NUTRIENT_FIELDS, vector)),
+        "created_at": datetime.now(timezone.utc),
+        "is_deleted": False
+    }
+    
+    db.recipes.insert_one(recipe)
+    recipe.pop("_id", None)
+    return recipe
+
+@app.get("/api/recipes")
+async def get_recipes(search: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    return _search_recipes(current_user.id, search, limit=100)
+
+def _search_recipes(user_id: str, search: Optional[str], limit: int):
+    query = {"user_id": user_id, "is_deleted": False}
+    if search:
+        query["name"] = {"$regex": re.escape(search), "$options": "i"}
+    return list(db.recipes.find(query, {"_id": 0}).sort("name", 1).limit(limit))
+
+@app.delete("/api/recipes/{recipe_id}")
+async def delete_recipe(recipe_id: str, current_user: User = Depends(get_current_user)):
+    db.recipes.update_one(
+        {"id": recipe_id, "user_id": current_user.id},
+        {"$set": {"is_deleted": True, "deleted_at": datetime.now(timezone.utc)}}
+    )
+    return {"success": True}
+
+@app.get("/api/foods/quick")
+async def get_quick_foods(limit: int = 10, current_user: User = Depends(get_current_user)):
+    """Recently and most frequently logged foods with their last portion, for one-tap re-logging"""
+    return quick_foods.get(db, current_user.id, limit=min(limit, quick_foods.top_k))
+
+@app.get("/api/foods/search")
+async def search_foods(search: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """The user's recipes followed by catalog foods, in the same per-100g shape"""
+    results = [dict(recipe, source="recipe") for recipe in _search_recipes(current_user.id, search, limit=50)]
+    foods = await get_turkish_foods(search)
+    results.extend(dict(food, source="catalog") for food in foods[:50 - len(results)])
+    return results
+
+@app.post("/api/food-logs/recipe")
+async def add_recipe_food_log(recipe_id: str, portion_grams: float = Query(gt=0, allow_inf_nan=False), current_user: User = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return await idempotency_store.run(
+        db, idempotency_key, current_user.id, "POST /api/food-logs/recipe",
+        lambda: _add_recipe_food_log(recipe_id, portion_grams, current_user)
+    )
+
+async def _add_recipe_food_log(recipe_id: str, portion_grams: float, current_user: User):
+    recipe = db.recipes.find_one({"id": recipe_id, "user_id": current_user.id, "is_deleted": False})
+    if not recipe:
+        raise HTTPException(status_code=404, detail="Tarif bulunamadı")
+    
+    food_log = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "food_name": recipe["name"],
+        "portion_size": f"{portion_grams}g",
+        **recipes.portion(recipe, portion_grams),
+        "recipe_id": recipe_id,
+        "logged_at": datetime.now(timezone.utc),
+        "is_deleted": False
+    }
+    
+    await add_logs(food_log_store, current_user, [food_log], food_logs_created)
+    food_log.pop("_id", None)
+    return food_log
+
 # ==================== WORKOUT LOGS ====================
 
 @app.get("/api/workout-logs")
 async def get_workout_logs(date: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {"user_id": current_user.id, "is_deleted": False}
-    
+    start_date = end_date = None
     if date:
         start_date = datetime.fromisoformat(date.replace('Z', '+00:00'))
         end_date = start_date + timedelta(days=1)
-        query["logged_at"] = {"$gte": start_date, "$lt": end_date}
     
-    logs = list(db.workout_logs.find(query).sort("logged_at", -1))
+    logs = workout_log_store.find(db, current_user.id, start_date, end_date)
     for log in logs:
         log["_id"] = str(log.get("_id", ""))
     return logs
 
 @app.post("/api/workout-logs")
-async def add_workout_log(exercise_name: str, duration_minutes: int, calories_burned: float, current_user: User = Depends(get_current_user)):
+async def add_workout_log(exercise_name: str, duration_minutes: int, calories_burned: float, current_user: User = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return await idempotency_store.run(
+        db, idempotency_key, current_user.id, "POST /api/workout-logs",
+        lambda: _add_workout_log(exercise_name, duration_minutes, calories_burned, current_user)
+    )
+
+async def _add_workout_log(exercise_name: str, duration_minutes: int, calories_burned: float, current_user: User):
     workout_log = {
         "id": str(uuid.uuid4()),
         "user_id": current_user.id,
@@ -490,19 +1118,142 @@ async def add_workout_log(exercise_name: str, duration_minutes: int, calories_bu
         "is_deleted": False
     }
     
-    db.workout_logs.insert_one(workout_log)
+    await add_logs(workout_log_store, current_user, [workout_log], workout_logs_created)
     # Remove MongoDB _id for JSON serialization
     workout_log.pop("_id", None)
     return workout_log
 
 @app.delete("/api/workout-logs/{log_id}")
 async def delete_workout_log(log_id: str, current_user: User = Depends(get_current_user)):
-    db.workout_logs.update_one(
-        {"id": log_id, "user_id": current_user.id},
-        {"$set": {"is_deleted": True}}
+    # A number taken for a delete that matches nothing would leave a gap that resets live-update replays
+    if not workout_log_store.live_ids(db, current_user.id, [log_id]):
+        return {"success": True}
+    change = stamp_change(current_user.id)
+    deleted = workout_log_store.delete(db, current_user.id, log_id, change)
+    if deleted:
+        workout_log_deleted(current_user, deleted)
+    return {"success": True}
+
+# ==================== SYNC ====================
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "5"))
+sync_sources = [
+    ("food_log", food_log_store),
+    ("workout_log", workout_log_store),
+    ("achievement", log_store.DocumentLogs("achievements", soft_delete=False)),
+]
+
+@app.get("/api/sync")
+async def sync_changes(since: Optional[int] = None, after: Optional[str] = None, limit: int = SYNC_PAGE_SIZE, include_images: bool = False, current_user: User = Depends(get_current_user)):
+    """Food logs, workout logs, achievements and profile changed after `since`, with tombstones for deletes.
+
+    Without `since` (or after a `reset`) the response is a full snapshot, paged too:
+    while `has_more` is true, call again with the returned `after` token, or with the
+    returned cursor once a page has no `after`.
+    """
+    try:
+        return sync.changes_since(
+            db, current_user.id, since, limit=max(1, min(limit, SYNC_PAGE_SIZE)),
+            settle_seconds=SYNC_SETTLE_SECONDS, include_images=include_images, sources=sync_sources, after=after
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ==================== LIVE UPDATES ====================
+
+@app.get("/api/events/stream")
+async def event_stream(request: Request, since: Optional[int] = None, last_event_id: Optional[str] = Header(None), current_user: User = Depends(get_current_user)):
+    """Server-Sent Events with the user's log and stats deltas; EventSource resumes via Last-Event-ID"""
+    after = since
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    return StreamingResponse(
+        live_updates.stream(live, db, current_user.id, after, LIVE_HEARTBEAT_SECONDS, LIVE_STREAM_MAX_SECONDS, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
+
+# ==================== FRIENDS & LEADERBOARDS ====================
+
+@app.get("/api/friends")
+async def get_friends(current_user: User = Depends(get_current_user)):
+    ids = leaderboards.friend_ids(db, current_user.id)
+    users = db.users.find({"_id": {"$in": ids}, "is_deleted": False}, {"name": 1, "picture": 1})
+    return [{"id": user["_id"], "name": user["name"], "picture": user.get("picture")} for user in users]
+
+@app.post("/api/friends/requests")
+async def send_friend_request(email: str, current_user: User = Depends(get_current_user)):
+    friend = db.users.find_one({"email": email, "is_deleted": False}, {"_id": 1})
+    if not friend:
+        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+    friend_id = friend["_id"]
+    if friend_id == current_user.id:
+        raise HTTPException(status_code=400, detail="Kendinize arkadaşlık isteği gönderemezsiniz")
+    friends = leaderboards.friend_ids(db, current_user.id)
+    if friend_id in friends:
+        raise HTTPException(status_code=400, detail="Zaten arkadaşsınız")
+    if len(friends) >= leaderboard.max_friends:
+        raise HTTPException(status_code=400, detail="Arkadaş sınırına ulaştınız")
+    
+    # A pending request in the other direction means both want it: accept right away
+    reverse = db[leaderboards.FRIEND_REQUESTS_COLLECTION].find_one_and_delete(
+        {"from_user_id": friend_id, "to_user_id": current_user.id}
+    )
+    if reverse:
+        leaderboards.add_friendship(db, current_user.id, friend_id)
+        return {"success": True, "status": "accepted"}
+    
+    request_doc = {
+        "id": str(uuid.uuid4()),
+        "from_user_id": current_user.id,
+        "from_name": current_user.name,
+        "to_user_id": friend_id,
+        "created_at": datetime.now(timezone.utc)
+    }
+    try:
+        db[leaderboards.FRIEND_REQUESTS_COLLECTION].insert_one(request_doc)
+    except DuplicateKeyError:
+        pass
+    return {"success": True, "status": "pending"}
+
+@app.get("/api/friends/requests")
+async def get_friend_requests(current_user: User = Depends(get_current_user)):
+    return list(db[leaderboards.FRIEND_REQUESTS_COLLECTION].find(
+        {"to_user_id": current_user.id}, {"_id": 0}
+    ).sort("created_at", -1).limit(100))
+
+@app.post("/api/friends/requests/{request_id}/accept")
+async def accept_friend_request(request_id: str, current_user: User = Depends(get_current_user)):
+    request_doc = db[leaderboards.FRIEND_REQUESTS_COLLECTION].find_one_and_delete(
+        {"id": request_id, "to_user_id": current_user.id}
+    )
+    if not request_doc:
+        raise HTTPException(status_code=404, detail="Arkadaşlık isteği bulunamadı")
+    leaderboards.add_friendship(db, current_user.id, request_doc["from_user_id"])
     return {"success": True}
 
+@app.delete("/api/friends/requests/{request_id}")
+async def decline_friend_request(request_id: str, current_user: User = Depends(get_current_user)):
+    # Declines an incoming request or withdraws an outgoing one
+    db[leaderboards.FRIEND_REQUESTS_COLLECTION].delete_one({
+        "id": request_id,
+        "$or": [{"to_user_id": current_user.id}, {"from_user_id": current_user.id}]
+    })
+    return {"success": True}
+
+@app.delete("/api/friends/{friend_id}")
+async def remove_friend(friend_id: str, current_user: User = Depends(get_current_user)):
+    leaderboards.remove_friendship(db, current_user.id, friend_id)
+    return {"success": True}
+
+@app.get("/api/leaderboards/weekly")
+async def get_weekly_leaderboard(metric: str = "calories", limit: int = 10, current_user: User = Depends(get_current_user)):
+    """This ISO week's ranking among the user and their friends, with the user's own rank"""
+    if metric not in leaderboards.METRICS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz metrik. Seçenekler: {', '.join(leaderboards.METRICS)}")
+    return leaderboard.board(db, current_user.id, metric, limit=min(limit, 100))
+
 # ==================== STATS ====================
 
 @app.get("/api/stats/daily")
@@ -516,18 +1267,10 @@ async def get_daily_stats(date: Optional[str] = None, current_user: User = Depen
     end_date = start_date + timedelta(days=1)
     
     # Get food logs
-    food_logs = list(db.food_logs.find({
-        "user_id": current_user.id,
-        "is_deleted": False,
-        "logged_at": {"$gte": start_date, "$lt": end_date}
-    }))
+    food_logs = food_log_store.find(db, current_user.id, start_date, end_date, include_images=False)
     
     # Get workout logs
-    workout_logs = list(db.workout_logs.find({
-        "user_id": current_user.id,
-        "is_deleted": False,
-        "logged_at": {"$gte": start_date, "$lt": end_date}
-    }))
+    workout_logs = workout_log_store.find(db, current_user.id, start_date, end_date, include_images=False)
     
     total_calories_consumed = sum(log["calories"] for log in food_logs)
     total_calories_burned = sum(log["calories_burned"] for log in workout_logs)
@@ -561,17 +1304,9 @@ async def get_weekly_stats(current_user: User = Depends(get_current_user)):
         day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
         day_end = day_start + timedelta(days=1)
         
-        food_logs = list(db.food_logs.find({
-            "user_id": current_user.id,
-            "is_deleted": False,
-            "logged_at": {"$gte": day_start, "$lt": day_end}
-        }))
+        food_logs = food_log_store.find(db, current_user.id, day_start, day_end, include_images=False)
         
-        workout_logs = list(db.workout_logs.find({
-            "user_id": current_user.id,
-            "is_deleted": False,
-            "logged_at": {"$gte": day_start, "$lt": day_end}
-        }))
+        workout_logs = workout_log_store.find(db, current_user.id, day_start, day_end, include_images=False)
         
         calories_consumed = sum(log["calories"] for log in food_logs)
         calories_burned = sum(log["calories_burned"] for log in workout_logs)
@@ -594,6 +1329,224 @@ async def get_achievements(current_user: User = Depends(get_current_user)):
         achievement["_id"] = str(achievement.get("_id", ""))
     return achievements
 
+# ==================== EXPORT ====================
+
+EXPORT_CSV_COLUMNS = [
+    "type", "id", "logged_at", "food_name", "portion_size", "calories", "protein", "carbs", "fat",
+    "exercise_name", "duration_minutes", "calories_burned", "title", "description", "icon", "earned_at",
+    "image_base64"
+]
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _export_records(user_id: str, include_images: bool, batch_size: int):
+    """Yield (type, doc) pairs for a user's history, one cursor batch at a time"""
+    for record_type, store in sync_sources:
+        for doc in store.iterate(db, user_id, include_images, batch_size):
+            doc.pop("user_id", None)
+            doc.pop("is_deleted", None)
+            yield record_type, doc
+
+def _export_chunks(user_id: str, export_format: str, include_images: bool, batch_size: int):
+    """Serialize export records into text chunks of at most batch_size rows"""
+    buffer = io.StringIO()
+    writer = None
+    if export_format == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        # Send the header right away so the client sees the first bytes immediately
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    rows = 0
+    for record_type, doc in _export_records(user_id, include_images, batch_size):
+        if writer:
+            row = {key: (_json_default(value) if isinstance(value, datetime) else value) for key, value in doc.items()}
+            row["type"] = record_type
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps({"type": record_type, **doc}, default=_json_default, ensure_ascii=False))
+            buffer.write("\n")
+        rows += 1
+        if rows >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    
+    if rows:
+        yield buffer.getvalue()
+
+def _gzip_chunks(chunks):
+    """Compress text chunks on the fly, flushing after each chunk so output is never held back"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.get("/api/export")
+async def export_history(
+    format: str = "ndjson",
+    include_images: bool = False,
+    gzip: bool = False,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the user's full history as NDJSON or CSV with constant memory use"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Geçersiz format. 'ndjson' veya 'csv' kullanın")
+    if batch_size < 1 or batch_size > 10000:
+        raise HTTPException(status_code=400, detail="batch_size 1 ile 10000 arasında olmalı")
+    
+    chunks = _export_chunks(current_user.id, format, include_images, batch_size)
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8"
+    filename = f"apak_export.{format}"
+    headers = {}
+    
+    if gzip:
+        chunks = _gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    else:
+        chunks = (chunk.encode("utf-8") for chunk in chunks)
+    
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    # Sync generator: Starlette iterates it in a threadpool, so blocking cursor reads stay off the event loop
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+# ==================== HEALTH ====================
+
+@app.get("/api/health")
+async def health(response: Response):
+    """Readiness: 200 only after the warm-up phase has completed"""
+    if not app.state.ready:
+        response.status_code = 503
+    return {
+        "ready": app.state.ready,
+        "warmup": app.state.warmup,
+        "catalog_versions": catalog.versions,
+        "live_connections": live.connections
+    }
+
+# ==================== METRICS ====================
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of route, Mongo, LLM, pool and cache metrics"""
+    # Merging the workers' files is file IO; keep it off the event loop
+    return PlainTextResponse(await run_in_threadpool(metrics.render), media_type="text/plain; version=0.0.4")
+
+# ==================== ADMIN DIAGNOSTICS ====================
+
+@app.get("/api/admin/slow-queries")
+async def get_slow_queries(limit: int = 20, hours: Optional[float] = None, admin: User = Depends(get_admin_user)):
+    """Slow query shapes ranked by total time, with sampled explain summaries"""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours) if hours else None
+    return slow_query_recorder.top_shapes(limit=min(limit, 200), since=since)
+
+@app.get("/api/admin/llm-models")
+async def get_llm_models(admin: User = Depends(get_admin_user)):
+    """Per-model latency percentiles, win rates and hedge delays of the LLM chain"""
+    return {"fake_backend": llm_fake_backend is not None, "models": llm_chain.summary()}
+
+@app.get("/api/admin/profiles")
+async def list_profiles(limit: int = 50, admin: User = Depends(get_admin_user)):
+    """Recently stored request profiles, newest first"""
+    return profile_store.list(limit=min(limit, 500))
+
+@app.get("/api/admin/profiles/{name}")
+async def get_profile(name: str, admin: User = Depends(get_admin_user)):
+    """Download a stored profile; open it at https://www.speedscope.app"""
+    path = profile_store.path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profil bulunamadı")
+    return FileResponse(path, media_type="application/json", filename=name)
+
+MEMORY_GROUP_BY = ("lineno", "filename", "traceback")
+
+@app.get("/api/admin/memory")
+async def get_memory_status(admin: User = Depends(get_admin_user)):
+    # Tracing and snapshots belong to the worker that served this request
+    return dict(memory_diagnostics.status(), route_peaks=MEMORY_ROUTE_PEAKS, worker_pid=os.getpid())
+
+@app.post("/api/admin/memory/start")
+async def start_memory_tracing(frames: int = 10, admin: User = Depends(get_admin_user)):
+    return memory_diagnostics.start(max(1, min(frames, 50)))
+
+@app.post("/api/admin/memory/stop")
+async def stop_memory_tracing(admin: User = Depends(get_admin_user)):
+    return memory_diagnostics.stop()
+
+@app.post("/api/admin/memory/snapshots")
+async def take_memory_snapshot(group_by: str = "lineno", limit: int = 25, admin: User = Depends(get_admin_user)):
+    """Take a tracemalloc snapshot and return its top allocation sites"""
+    if group_by not in MEMORY_GROUP_BY:
+        raise HTTPException(status_code=400, detail="group_by: lineno, filename veya traceback olmalı")
+    snapshot_id = await run_in_threadpool(memory_diagnostics.take_snapshot)
+    if snapshot_id is None:
+        raise HTTPException(status_code=409, detail="Bellek izleme kapalı. Önce /api/admin/memory/start çağırın")
+    return await run_in_threadpool(memory_diagnostics.top, snapshot_id, group_by, limit)
+
+@app.get("/api/admin/memory/snapshots/{snapshot_id}")
+async def get_memory_snapshot(snapshot_id: int, group_by: str = "lineno", limit: int = 25, admin: User = Depends(get_admin_user)):
+    if group_by not in MEMORY_GROUP_BY:
+        raise HTTPException(status_code=400, detail="group_by: lineno, filename veya traceback olmalı")
+    if snapshot_id not in memory_diagnostics.snapshots:
+        raise HTTPException(status_code=404, detail=f"Snapshot bulunamadı (worker {os.getpid()})")
+    return await run_in_threadpool(memory_diagnostics.top, snapshot_id, group_by, limit)
+
+@app.get("/api/admin/memory/diff")
+async def diff_memory_snapshots(from_id: int, to_id: int, group_by: str = "lineno", limit: int = 25, admin: User = Depends(get_admin_user)):
+    """Allocation growth between two snapshots, largest first"""
+    if group_by not in MEMORY_GROUP_BY:
+        raise HTTPException(status_code=400, detail="group_by: lineno, filename veya traceback olmalı")
+    if from_id not in memory_diagnostics.snapshots or to_id not in memory_diagnostics.snapshots:
+        raise HTTPException(status_code=404, detail=f"Snapshot bulunamadı (worker {os.getpid()})")
+    return await run_in_threadpool(memory_diagnostics.diff, from_id, to_id, group_by, limit)
+
+@app.get("/api/admin/memory/routes")
+async def get_memory_by_route(reset: bool = False, admin: User = Depends(get_admin_user)):
+    """Peak traced allocation per route while tracing is on (needs MEMORY_ROUTE_PEAKS=1)"""
+    if not MEMORY_ROUTE_PEAKS:
+        raise HTTPException(status_code=409, detail="Rota bazlı bellek ölçümü kapalı. MEMORY_ROUTE_PEAKS=1 ile başlatın")
+    routes = memory_diagnostics.routes()
+    if reset:
+        memory_diagnostics.reset_routes()
+    return routes
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Workers are separate processes that each import server and run their own lifespan,
+    # so the Mongo client, catalog cache and background executors are created per worker.
+    # The parent binds the socket once and the workers share it. On SIGTERM each worker
+    # stops accepting and waits up to GRACEFUL_SHUTDOWN_SECONDS for in-flight requests.
+    #
+    # State that would otherwise be per worker is shared for WEB_CONCURRENCY > 1 (the
+    # workers inherit these variables): /metrics sums every worker's values from
+    # METRICS_MULTIPROC_DIR, and rate-limit buckets default to Mongo so a limit is not
+    # multiplied by the number of workers. Memory diagnostics and profiles stay per
+    # worker (admin responses carry the worker's pid); run one worker to use them.
+    if WEB_CONCURRENCY > 1:
+        import glob
+        import tempfile
+        metrics_dir = os.environ.setdefault("METRICS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="apak_metrics_"))
+        os.makedirs(metrics_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(stale)
+        os.environ.setdefault("RATE_LIMIT_BACKEND", "mongo")
+        logger.info("Starting %d workers, metrics in %s, rate limits in %s",
+                    WEB_CONCURRENCY, metrics_dir, os.environ["RATE_LIMIT_BACKEND"])
+    uvicorn.run(
+        "server:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8001")),
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS
+    )
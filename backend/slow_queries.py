@@ -0,0 +1,186 @@
+"""Slow-query recorder hooked into pymongo command monitoring.
+
+Commands slower than the threshold are written to a capped collection with the
+originating route and a normalized query shape (values replaced by "?"). A
+sample of them is re-run as explain("executionStats") so collection scans and
+missing indexes show up next to the timings. All writes and explains happen on
+a background thread, never on the request path.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+import json
+import random
+
+SLOW_QUERY_COLLECTION = "slow_queries"
+
+# Commands whose shape is meaningful and which explain() understands
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+SHAPE_FIELDS = ("filter", "query", "q", "sort", "projection", "pipeline", "key", "updates", "deletes", "update")
+
+# Set per request by the HTTP middleware; the ASGI scope carries the matched route once routing has run
+request_scope = ContextVar("request_scope", default=None)
+
+def current_route():
+    scope = request_scope.get()
+    if not scope:
+        return "background"
+    route = scope.get("route")
+    return route.path if route else scope.get("path", "unmatched")
+
+def normalize(value):
+    """Replace literal values with "?" while keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = normalize(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def query_shape(command_name, command):
+    shape = {}
+    for field in SHAPE_FIELDS:
+        if field not in command:
+            continue
+        if field in ("sort", "projection"):
+            # Sort and projection keys and directions are part of the shape, not values
+            shape[field] = dict(command[field])
+        else:
+            shape[field] = normalize(command[field])
+    return json.dumps(shape, sort_keys=True, default=str, ensure_ascii=False)
+
+def _walk(plan):
+    while plan:
+        yield plan
+        if "inputStage" in plan:
+            plan = plan["inputStage"]
+        elif plan.get("inputStages"):
+            plan = plan["inputStages"][0]
+        else:
+            plan = None
+
+def summarize_explain(explain):
+    """Keep the parts of an explain() result that point at missing indexes, without literal values"""
+    planner = explain.get("queryPlanner") or {}
+    if not planner and explain.get("stages"):
+        planner = explain["stages"][0].get("$cursor", {}).get("queryPlanner", {})
+    winning = planner.get("winningPlan", {})
+    winning = winning.get("queryPlan", winning)
+    stats = explain.get("executionStats", {})
+    plans = list(_walk(winning))
+    stages = [plan.get("stage", "?") for plan in plans]
+    return {
+        "stages": stages,
+        "collection_scan": "COLLSCAN" in stages,
+        "index_names": sorted({plan["indexName"] for plan in plans if plan.get("indexName")}),
+        "n_returned": stats.get("nReturned"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "execution_time_ms": stats.get("executionTimeMillis"),
+    }
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    def __init__(self, threshold_ms=100, explain_sample_rate=0.1, capped_size_bytes=16 * 1024 * 1024):
+        self.threshold_micros = threshold_ms * 1000
+        self.explain_sample_rate = explain_sample_rate
+        self.capped_size_bytes = capped_size_bytes
+        self.db = None
+        self.pending = {}
+        self.executor = None
+
+    def attach(self, db):
+        """Bind the database used for explain() and storage, creating the capped collection if needed.
+
+        Called once per worker process, so the background thread is never inherited across a fork.
+        """
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query")
+        try:
+            db.create_collection(SLOW_QUERY_COLLECTION, capped=True, size=self.capped_size_bytes)
+        except CollectionInvalid:
+            pass
+
+    def detach(self):
+        """Flush pending records and stop the background thread"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.executor = None
+        self.db = None
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if collection == SLOW_QUERY_COLLECTION:
+            return
+        self.pending[(event.connection_id, event.request_id)] = (event.database_name, event.command, current_route())
+
+    def succeeded(self, event):
+        pending = self.pending.pop((event.connection_id, event.request_id), None)
+        if pending and event.duration_micros >= self.threshold_micros and self.executor is not None:
+            self.executor.submit(self._record, event.command_name, event.duration_micros, *pending)
+
+    def failed(self, event):
+        self.pending.pop((event.connection_id, event.request_id), None)
+
+    def _record(self, command_name, duration_micros, database_name, command, route):
+        collection = command.get(command_name)
+        record = {
+            "at": datetime.now(timezone.utc),
+            "route": route,
+            "collection": collection,
+            "command": command_name,
+            "shape": f"{collection}.{command_name} {query_shape(command_name, command)}",
+            "duration_ms": duration_micros / 1000,
+            "explain": None,
+        }
+        if random.random() < self.explain_sample_rate:
+            record["explain"] = self._explain(database_name, command)
+        try:
+            self.db[SLOW_QUERY_COLLECTION].insert_one(record)
+        except PyMongoError:
+            pass
+
+    def _explain(self, database_name, command):
+        explained = {key: value for key, value in command.items()
+                     if not key.startswith("$") and key not in ("lsid", "txnNumber", "cursor", "readConcern")}
+        if "pipeline" in explained:
+            explained["cursor"] = {}
+        try:
+            result = self.db.client[database_name].command("explain", explained, verbosity="executionStats")
+        except PyMongoError as e:
+            return {"error": str(e)}
+        return summarize_explain(result)
+
+    def top_shapes(self, limit=20, since=None):
+        """Shapes ranked by total time spent, with the latest sampled explain summary"""
+        match = {"at": {"$gte": since}} if since else {}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"at": -1}},
+            {"$group": {
+                "_id": "$shape",
+                "count": {"$sum": 1},
+                "total_ms": {"$sum": "$duration_ms"},
+                "max_ms": {"$max": "$duration_ms"},
+                "avg_ms": {"$avg": "$duration_ms"},
+                "routes": {"$addToSet": "$route"},
+                "last_seen": {"$first": "$at"},
+                "explains": {"$push": "$explain"},
+            }},
+            {"$sort": {"total_ms": -1}},
+            {"$limit": limit},
+        ]
+        shapes = []
+        for doc in self.db[SLOW_QUERY_COLLECTION].aggregate(pipeline):
+            explain = next((item for item in doc.pop("explains") if item), None)
+            doc["shape"] = doc.pop("_id")
+            doc["explain"] = explain
+            shapes.append(doc)
+        return shapes
@@ -0,0 +1,150 @@
+"""Delta sync for offline-first clients.
+
+Every created, modified or deleted food log, workout log, achievement and
+profile carries `change_seq`, a number from the user's change sequence (see
+live_updates.next_seq). /api/sync?since=<cursor> returns the documents whose
+change_seq is above the cursor in sequence order, with tombstones for deletes,
+so its cost follows the number of changes rather than the size of the history.
+A full snapshot (no cursor, or after a reset) is paged too, source by source
+in (change_seq, id) order, with an opaque `after` token between pages; its
+last page carries the cursor for the delta syncs that follow.
+
+A sequence number is reserved just before its document is written, so for a
+moment a higher number can be visible while a lower one is still in flight.
+The returned cursor therefore never moves past changes younger than
+`settle_seconds`; those are sent again on the next sync, and clients apply
+changes as idempotent upserts keyed by id.
+"""
+from datetime import datetime, timezone, timedelta
+from live_updates import SEQUENCES_COLLECTION
+from log_store import DocumentLogs
+from itertools import repeat
+import base64
+import binascii
+import heapq
+import json
+
+# (record type, log store); the server passes its own stores when logs are bucketed
+SOURCES = [
+    ("food_log", DocumentLogs("food_logs")),
+    ("workout_log", DocumentLogs("workout_logs")),
+    ("achievement", DocumentLogs("achievements", soft_delete=False)),
+]
+PROFILE_FIELDS = ["name", "picture", "age", "gender", "height_cm", "weight_kg", "goal_weight_kg",
+                  "activity_level", "daily_calorie_goal", "change_seq", "changed_at"]
+
+def ensure_sync_indexes(db):
+    for _, store in SOURCES:
+        # Serves delta pages, and snapshot pages with the id tie-break
+        db[store.collection_name].create_index([("user_id", 1), ("change_seq", 1), ("id", 1)])
+
+def _change(record_type, doc):
+    change = {"type": record_type, "id": doc.get("id"), "change_seq": doc.get("change_seq", 0), "changed_at": doc.get("changed_at")}
+    if doc.pop("is_deleted", False):
+        change["op"] = "delete"
+    else:
+        doc.pop("user_id", None)
+        change.update(op="upsert", data=doc)
+    return change
+
+def _profile(db, query):
+    profile = db.users.find_one(query, {field: 1 for field in PROFILE_FIELDS})
+    if profile is None:
+        return []
+    profile["id"] = profile.pop("_id")
+    return [profile]
+
+def _utc(moment):
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def _encode_after(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def _decode_after(after):
+    """Snapshot page state from an `after` token; ValueError when the token is not one of ours"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(after + "=" * (-len(after) % 4)))
+        return {key: state[key] for key in ("top", "settled", "recent", "source", "position")}
+    except (TypeError, KeyError, UnicodeDecodeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError("Invalid snapshot token") from e
+
+def _snapshot(db, user_id, sequence, after, limit, settled_before, include_images, sources):
+    """One page of a full snapshot, in (source, position within the source's store) order"""
+    if after:
+        state = _decode_after(after)
+        position = state["position"]
+    else:
+        # Writes after the first page are replayed by the delta syncs that follow, so the snapshot
+        # hands over the cursor of its start, held back like a delta page
+        settled = _utc(sequence.get("updated_at", settled_before)) <= settled_before
+        state = {"top": sequence.get("seq", 0) if settled else 0, "settled": settled,
+                 "recent": None, "source": 0, "position": None}
+        position = None
+
+    pages = []
+    for index in range(state["source"], len(sources) + 1):
+        start = position if index == state["source"] else None
+        if index < len(sources):
+            record_type, store = sources[index]
+            docs = store.snapshot(db, user_id, start, limit + 1 - len(pages), include_images)
+        else:
+            # The profile comes last, so a page never ends on it with more to follow
+            record_type, docs = "profile", [(None, doc) for doc in _profile(db, {"_id": user_id})]
+        # The position is the store's own (a tiered store's says which tier and month), kept opaque here
+        pages.extend((index, doc_position, _change(record_type, doc)) for doc_position, doc in docs)
+        if len(pages) > limit:
+            break
+
+    has_more = len(pages) > limit
+    pages = pages[:limit]
+    changes = [change for _, _, change in pages]
+    for change in changes:
+        if not state["settled"]:
+            state["top"] = max(state["top"], change["change_seq"])
+        if change["change_seq"] and change["changed_at"] and _utc(change["changed_at"]) > settled_before:
+            state["recent"] = min(state["recent"] or change["change_seq"], change["change_seq"])
+    if has_more:
+        index, last, _ = pages[-1]
+        state.update(source=index, position=last)
+        return {"reset": False, "cursor": 0, "has_more": True, "after": _encode_after(state), "changes": changes}
+    cursor = min(state["top"], state["recent"] - 1) if state["recent"] else state["top"]
+    return {"reset": False, "cursor": cursor, "has_more": False, "after": None, "changes": changes}
+
+def changes_since(db, user_id, since=None, limit=500, settle_seconds=5, include_images=False, sources=None, after=None):
+    """Changes after cursor `since`; a missing or zero cursor means a full snapshot, paged with `after`"""
+    sequence = db[SEQUENCES_COLLECTION].find_one({"_id": user_id}) or {}
+    current = sequence.get("seq", 0)
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+    if after or not since:
+        return _snapshot(db, user_id, sequence, after, limit, settled_before, include_images, sources or SOURCES)
+    if since > current or since < sequence.get("compacted_seq", 0):
+        # Unknown cursor, or tombstones after it were compacted away: start over with a snapshot
+        return {"reset": True, "cursor": 0, "has_more": False, "after": None, "changes": []}
+
+    streams = []
+    for record_type, store in sources or SOURCES:
+        docs = store.changes(db, user_id, since, limit + 1, include_images)
+        streams.append(map(_change, repeat(record_type), docs))
+
+    streams.append(map(_change, repeat("profile"), _profile(db, {"_id": user_id, "change_seq": {"$gt": since}})))
+
+    merged = heapq.merge(*streams, key=lambda change: change["change_seq"])
+    changes = [change for _, change in zip(range(limit + 1), merged)]
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    # Where the next sync should resume without skipping writes still in flight.
+    # Sequence numbers in flight are the newest ones, so only the last page holds back.
+    returned = max([change["change_seq"] for change in changes] + [since])
+    sequence_settled = _utc(sequence.get("updated_at", settled_before)) <= settled_before
+    recent = [change["change_seq"] for change in changes
+              if change["change_seq"] and change["changed_at"] and _utc(change["changed_at"]) > settled_before]
+    if has_more:
+        cursor = returned
+    elif recent:
+        cursor = max(min(recent) - 1, since)
+    elif sequence_settled:
+        cursor = current
+    else:
+        cursor = returned
+    return {"reset": False, "cursor": cursor, "has_more": has_more, "after": None, "changes": changes}
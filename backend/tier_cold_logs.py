@@ -0,0 +1,118 @@
+from pymongo import MongoClient
+from datetime import datetime, timezone, timedelta
+from cold_storage import ColdLogs, TieredLogs, month_of
+from live_updates import SEQUENCES_COLLECTION
+import log_store
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+database_name = os.getenv("DATABASE_NAME", "apak_fitness")
+client = MongoClient(mongo_url)
+db = client[database_name]
+
+# Same settings as the API: it skips the cold tier for ranges newer than its COLD_STORAGE_AFTER_DAYS,
+# so the API's value must not be larger than this job's
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", "")
+COLD_STORAGE_AFTER_DAYS = int(os.getenv("COLD_STORAGE_AFTER_DAYS", "180"))
+LOG_STORAGE = os.getenv("LOG_STORAGE", "documents")
+TIERING_BATCH_USERS = int(os.getenv("TIERING_BATCH_USERS", "100"))
+TIERING_PAUSE_SECONDS = float(os.getenv("TIERING_PAUSE_SECONDS", "0.2"))
+# Logs read, copied and evicted per round, so a user's history is never held in memory at once
+TIERING_BATCH_LOGS = int(os.getenv("TIERING_BATCH_LOGS", "500"))
+
+def tier_user(kind, user_id, cutoff, root, dry_run=False, batch_size=TIERING_BATCH_LOGS):
+    """Move one user's live logs of `kind` logged before cutoff into cold partitions, `batch_size` at a time"""
+    hot = log_store.open_store(kind, LOG_STORAGE)
+    if dry_run:
+        return len(hot.find(db, user_id, end=cutoff, include_images=False)), 0
+    cold = ColdLogs(root, kind)
+    tiered = TieredLogs(hot, cold, 0)
+    moved, months = set(), set()
+    while True:
+        # Newest first; each batch leaves the hot store before the next find, so the same query pages through
+        logs = hot.find(db, user_id, end=cutoff, include_images=True, limit=batch_size)
+        log_ids = [log["id"] for log in logs]
+        if not moved.isdisjoint(log_ids):
+            raise RuntimeError(f"{kind} logs of {user_id} are still hot after eviction")
+        if not logs:
+            break
+        # Evicts only after the partitions are on disk; a crash in between leaves logs in both tiers, which reads dedupe
+        tiered.archive(db, user_id, logs)
+        # Sync cursors from before these logs can no longer replay them from the hot store
+        moved_seq = max(log.get("change_seq", 0) for log in logs)
+        if moved_seq:
+            db[SEQUENCES_COLLECTION].update_one({"_id": user_id}, {"$max": {"compacted_seq": moved_seq}}, upsert=True)
+        moved.update(log_ids)
+        months.update(month_of(log["logged_at"]) for log in logs)
+        if len(logs) < batch_size:
+            break
+    return len(moved), cold.size(user_id, months)
+
+def reindex(root, kinds=tuple(log_store.KINDS)):
+    """Rebuild the cold month index from the partitions on disk, for logs tiered before it existed"""
+    indexed = 0
+    for kind in kinds:
+        cold = ColdLogs(root, kind)
+        tiered = TieredLogs(log_store.open_store(kind, LOG_STORAGE), cold, 0)
+        for user_id in cold.users():
+            for _, logs in cold.find_months(user_id, include_images=False):
+                tiered.index(db, user_id, logs)
+                indexed += len(logs)
+    return indexed
+
+def run_tiering(root, after_days=COLD_STORAGE_AFTER_DAYS, kinds=tuple(log_store.KINDS),
+                batch_users=TIERING_BATCH_USERS, pause_seconds=TIERING_PAUSE_SECONDS, dry_run=False):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=after_days)
+    print(f"🧊 Tiering {', '.join(kinds)} logs older than {cutoff.isoformat()} into {root}")
+    totals = {"users": 0, "logs": 0, "bytes": 0}
+    after = None
+    while True:
+        query = {"_id": {"$gt": after}} if after else {}
+        user_ids = [user["_id"] for user in db.users.find(query, {"_id": 1}).sort("_id", 1).limit(batch_users)]
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            for kind in kinds:
+                moved, written = tier_user(kind, user_id, cutoff, root, dry_run)
+                totals["logs"] += moved
+                totals["bytes"] += written
+        totals["users"] += len(user_ids)
+        after = user_ids[-1]
+        print(f"   {totals['users']} users, {totals['logs']} logs {'found' if dry_run else 'moved'}")
+        if len(user_ids) < batch_users:
+            break
+        time.sleep(pause_seconds)
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old food/workout logs into compressed per-user monthly files")
+    parser.add_argument("--dir", default=COLD_STORAGE_DIR, help="cold storage root (default: COLD_STORAGE_DIR)")
+    parser.add_argument("--after-days", type=int, default=COLD_STORAGE_AFTER_DAYS)
+    parser.add_argument("--kinds", default=",".join(log_store.KINDS))
+    parser.add_argument("--batch-users", type=int, default=TIERING_BATCH_USERS)
+    parser.add_argument("--pause", type=float, default=TIERING_PAUSE_SECONDS, help="seconds to sleep between user batches")
+    parser.add_argument("--interval", type=float, default=0, help="repeat every N seconds (0 = run once)")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the cold month index from the partitions and exit")
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error("--dir or COLD_STORAGE_DIR is required")
+    if args.after_days != COLD_STORAGE_AFTER_DAYS:
+        print(f"⚠️  --after-days {args.after_days} differs from COLD_STORAGE_AFTER_DAYS={COLD_STORAGE_AFTER_DAYS}; "
+              "the API must use a value no larger than this run's")
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    if args.reindex:
+        print(f"✅ {reindex(args.dir, kinds)} cold logs indexed")
+        raise SystemExit(0)
+    while True:
+        totals = run_tiering(args.dir, args.after_days, kinds, args.batch_users, args.pause, args.dry_run)
+        print(f"✅ {totals['logs']} logs tiered for {totals['users']} users, {totals['bytes'] / (1024 * 1024):.2f} MB of partitions written")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
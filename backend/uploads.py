@@ -0,0 +1,135 @@
+"""Streaming, size-capped image upload handling.
+
+UploadSizeLimitMiddleware rejects oversized request bodies with 413 before or
+while they are received, so a huge upload is never fully parsed; for a chunked
+body it cuts the app off with a disconnect and answers the 413 itself. read_image()
+then walks the spooled upload in fixed chunks, checking magic bytes on the
+first chunk, hashing incrementally and base64-encoding chunk by chunk. The raw
+image is never held in memory as a whole. The encoded pieces and the string
+they are joined into do briefly coexist, so the peak is about two copies of the
+base64 text (roughly 2.7x the image size) instead of about 3.7x for reading the
+whole file and then encoding and decoding it.
+"""
+from fastapi import HTTPException
+import base64
+import hashlib
+import json
+
+# Multiple of 3 so per-chunk base64 output concatenates without padding in between
+CHUNK_SIZE = 3 * 64 * 1024
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1", b"avif"}
+
+class UploadSizeLimitMiddleware:
+    """Pure ASGI middleware enforcing a maximum request body size on selected paths"""
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                return await _too_large(send)
+
+        # A chunked body has no Content-Length: count it as it arrives
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # The app sees a client that went away and stops parsing; the 413 is sent below
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not started:
+            await _too_large(send)
+
+async def _too_large(send):
+    body = json.dumps({"detail": "Dosya çok büyük"}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def sniff_image_type(head):
+    """MIME type from the first bytes of a file, or None if it is not a supported image"""
+    for signature, mime in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIF_BRANDS:
+        return "image/avif" if head[8:12] == b"avif" else "image/heic"
+    return None
+
+async def read_image(upload, max_bytes):
+    """Validate, hash and base64-encode an UploadFile in chunks.
+
+    Returns (image_base64, sha256_hex, size_bytes, mime_type).
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail="Dosya çok büyük")
+
+    digest = hashlib.sha256()
+    pieces = []
+    size = 0
+    mime = None
+    pending = b""
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail="Dosya çok büyük")
+        if mime is None:
+            mime = sniff_image_type(pending + chunk)
+            if mime is None:
+                raise HTTPException(status_code=415, detail="Desteklenmeyen dosya türü. Lütfen bir fotoğraf yükleyin")
+        digest.update(chunk)
+        data = pending + chunk if pending else chunk
+        usable = len(data) - len(data) % 3
+        pieces.append(base64.b64encode(memoryview(data)[:usable]).decode("ascii"))
+        pending = data[usable:]
+
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Boş dosya")
+    if pending:
+        pieces.append(base64.b64encode(pending).decode("ascii"))
+
+    image_base64 = "".join(pieces)
+    return image_base64, digest.hexdigest(), size, mime
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+APAK Fitness Backend Micro-Benchmarks
+Times the backend hot paths directly (no HTTP) against a seeded dataset and
+reports time and allocations per call. Results are stored as JSON so runs can
+be compared.
+
+Usage:
+    python backend_bench.py --logs 100000
+    python backend_bench.py --logs 100000 --compare bench_results/<previous>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone, timedelta
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+# seed_dataset drops collections, so it only ever runs against databases named like this
+BENCH_DATABASE_PREFIX = "apak_bench_"
+
+BENCH_FOODS = [
+    ("Mercimek Çorbası", 56, 3.5, 9, 1, "Çorba"),
+    ("Ezogelin Çorbası", 65, 3, 11, 1.2, "Çorba"),
+    ("Adana Kebap", 280, 18, 2, 23, "Et"),
+    ("İskender Kebap", 195, 16, 10, 11, "Et"),
+    ("Şiş Kebap", 220, 25, 0, 13, "Et"),
+    ("Pirinç Pilavı", 130, 2.7, 28, 0.3, "Tahıl"),
+    ("Bulgur Pilavı", 342, 12, 76, 1.3, "Tahıl"),
+    ("Çoban Salata", 45, 1, 5, 2.5, "Salata"),
+    ("Beyaz Ekmek", 265, 9, 49, 3.2, "Ekmek"),
+    ("Baklava", 428, 6, 52, 22, "Tatlı"),
+]
+
+def load_server():
+    """Import server.py and open its database connection without starting the HTTP app"""
+    sys.path.insert(0, BACKEND_DIR)
+    import server
+    server.connect_database()
+    return server
+
+# ==================== STARTUP ====================
+
+def measure_import(repeats):
+    """Wall time of `import server` in a fresh interpreter, in milliseconds"""
+    code = "import time; started = time.perf_counter(); import server; print((time.perf_counter() - started) * 1000)"
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+def measure_first_requests(mongo_url, port=8102):
+    """Boot the app and time spawn -> ready -> first and second catalog requests"""
+    import httpx
+    from backend_loadtest import start_app, start_stub_auth_server
+
+    auth_server, auth_url = start_stub_auth_server()
+    spawned = time.perf_counter()
+    process = start_app(port, mongo_url, f"{BENCH_DATABASE_PREFIX}startup", auth_url, 0)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        with httpx.Client(base_url=base_url, timeout=30) as http:
+            while True:
+                try:
+                    health = http.get("/api/health")
+                    if health.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() - spawned > 60:
+                    raise RuntimeError("API did not become ready within 60s")
+                time.sleep(0.05)
+            ready = time.perf_counter() - spawned
+            requests_ms = []
+            for _ in range(2):
+                started = time.perf_counter()
+                http.get("/api/turkish-foods", params={"search": "kebap"})
+                requests_ms.append((time.perf_counter() - started) * 1000)
+        return {
+            "ready_s": ready,
+            "warmup_ms": health.json().get("warmup"),
+            "first_request_ms": requests_ms[0],
+            "second_request_ms": requests_ms[1],
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        auth_server.shutdown()
+
+# ==================== DATASET ====================
+
+def seed_dataset(db, total_logs, users, seed=42):
+    """Seed users, sessions, the food catalog and total_logs food/workout logs.
+
+    The benchmarked user gets an even share of the logs, spread over the last 90
+    days. Re-running with the same size reuses the existing dataset.
+    """
+    if not db.name.startswith(BENCH_DATABASE_PREFIX):
+        raise SystemExit(f"Refusing to seed {db.name!r}: benchmark databases must be named {BENCH_DATABASE_PREFIX}*")
+    meta = db.bench_meta.find_one({"_id": "dataset"})
+    if meta and meta["total_logs"] == total_logs and meta["users"] == users:
+        return meta
+
+    print(f"🌱 Seeding {total_logs} logs for {users} users...")
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    for name in ("users", "user_sessions", "food_logs", "workout_logs", "turkish_foods", "achievements", "bench_meta"):
+        db[name].drop()
+
+    db.turkish_foods.insert_many([
+        {
+            "id": name.lower().replace(" ", "_"),
+            "name": name,
+            "calories_per_100g": calories,
+            "protein_per_100g": protein,
+            "carbs_per_100g": carbs,
+            "fat_per_100g": fat,
+            "category": category,
+        }
+        for name, calories, protein, carbs, fat, category in BENCH_FOODS
+    ])
+
+    user_ids = [f"bench-user-{i}" for i in range(users)]
+    now = datetime.now(timezone.utc)
+    db.users.insert_many([
+        {
+            "_id": user_id,
+            "email": f"{user_id}@bench.local",
+            "name": user_id,
+            "picture": None,
+            "age": 30,
+            "gender": "kadın",
+            "height_cm": 165.0,
+            "weight_kg": 62.0,
+            "goal_weight_kg": 58.0,
+            "activity_level": "orta",
+            "daily_calorie_goal": 1800,
+            "created_at": now,
+            "is_deleted": False,
+        }
+        for user_id in user_ids
+    ])
+    db.user_sessions.insert_many([
+        {
+            "user_id": user_id,
+            "session_token": f"bench-token-{user_id}",
+            "expires_at": now + timedelta(days=365),
+            "created_at": now,
+        }
+        for user_id in user_ids
+    ])
+
+    batch_size = 10000
+    food_share = int(total_logs * 0.8)
+    for collection, count in (("food_logs", food_share), ("workout_logs", total_logs - food_share)):
+        batch = []
+        for i in range(count):
+            logged_at = now - timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+            user_id = user_ids[i % users]
+            if collection == "food_logs":
+                name, calories, protein, carbs, fat, _ = rng.choice(BENCH_FOODS)
+                multiplier = rng.choice([0.5, 1, 1.5, 2])
+                doc = {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "user_id": user_id,
+                    "food_name": name,
+                    "portion_size": f"{multiplier * 100}g",
+                    "calories": calories * multiplier,
+                    "protein": protein * multiplier,
+                    "carbs": carbs * multiplier,
+                    "fat": fat * multiplier,
+                    "logged_at": logged_at,
+                    "is_deleted": rng.random() < 0.05,
+                }
+            else:
+                duration = rng.choice([15, 30, 45, 60])
+                doc = {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "user_id": user_id,
+                    "exercise_name": "Koşu (Orta - 10 km/sa)",
+                    "duration_minutes": duration,
+                    "calories_burned": duration * 10.0,
+                    "logged_at": logged_at,
+                    "is_deleted": rng.random() < 0.05,
+                }
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                db[collection].insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            db[collection].insert_many(batch, ordered=False)
+
+    meta = {"_id": "dataset", "total_logs": total_logs, "users": users, "seeded_at": now}
+    db.bench_meta.insert_one(meta)
+    print(f"   seeded in {time.perf_counter() - started:.1f}s")
+    return meta
+
+# ==================== BENCHMARKS ====================
+
+def build_benchmarks(server, user):
+    """Map of benchmark name -> zero-argument callable returning a coroutine or value"""
+    from fastapi.encoders import jsonable_encoder
+    token = f"bench-token-{user.id}"
+    food_logs = asyncio.run(server.get_food_logs(date=None, current_user=user))
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+    return {
+        "get_current_user": lambda: server.get_current_user(session_token=token, authorization=None),
+        "get_current_user (bearer)": lambda: server.get_current_user(session_token=None, authorization=f"Bearer {token}"),
+        "get_daily_stats": lambda: server.get_daily_stats(date=today, current_user=user),
+        "get_weekly_stats": lambda: server.get_weekly_stats(current_user=user),
+        "get_turkish_foods (all)": lambda: server.get_turkish_foods(search=None),
+        "get_turkish_foods (search)": lambda: server.get_turkish_foods(search="kebap"),
+        "add_manual_food_log": lambda: server.add_manual_food_log(food_name="pilav", portion_grams=150, current_user=user, idempotency_key=None),
+        "get_food_logs": lambda: server.get_food_logs(date=None, current_user=user),
+        f"serialize food_logs ({len(food_logs)} rows)": lambda: json.dumps(jsonable_encoder(food_logs)).encode("utf-8"),
+    }
+
+def call(fn, loop):
+    result = fn()
+    if asyncio.iscoroutine(result):
+        result = loop.run_until_complete(result)
+    return result
+
+def measure(fn, loop, iterations, warmup, alloc_iterations):
+    for _ in range(warmup):
+        call(fn, loop)
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter_ns()
+        call(fn, loop)
+        timings.append((time.perf_counter_ns() - started) / 1e3)
+
+    # Allocations are measured separately so tracemalloc overhead does not skew timings
+    allocated, peaks, blocks = [], [], []
+    for _ in range(alloc_iterations):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        call(fn, loop)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        growth = [stat for stat in after.compare_to(before, "filename") if stat.size_diff > 0]
+        allocated.append(sum(stat.size_diff for stat in growth))
+        blocks.append(sum(stat.count_diff for stat in growth if stat.count_diff > 0))
+        peaks.append(peak)
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_us": statistics.fmean(timings),
+        "median_us": statistics.median(timings),
+        "p95_us": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_us": timings[0],
+        "stdev_us": statistics.pstdev(timings),
+        "retained_bytes": statistics.median(allocated) if allocated else None,
+        "retained_blocks": statistics.median(blocks) if blocks else None,
+        "peak_bytes": statistics.median(peaks) if peaks else None,
+    }
+
+def print_results(results, baseline=None):
+    print("\n" + "=" * 104)
+    print(f"{'benchmark':<40}{'median µs':>12}{'p95 µs':>12}{'peak KiB':>12}{'retained KiB':>14}{'vs baseline':>14}")
+    print("=" * 104)
+    previous = (baseline or {}).get("benchmarks", {})
+    for name, stats in results.items():
+        change = ""
+        if name in previous and previous[name]["median_us"]:
+            ratio = stats["median_us"] / previous[name]["median_us"]
+            change = f"{(ratio - 1) * 100:+.1f}%"
+        print(f"{name:<40}{stats['median_us']:>12.1f}{stats['p95_us']:>12.1f}"
+              f"{(stats['peak_bytes'] or 0) / 1024:>12.1f}{(stats['retained_bytes'] or 0) / 1024:>14.1f}{change:>14}")
+    print("=" * 104)
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for APAK Fitness backend hot paths")
+    parser.add_argument("--logs", type=int, default=1000, help="total seeded logs, e.g. 1000 / 100000 / 1000000")
+    parser.add_argument("--users", type=int, default=None, help="users sharing the logs (default: logs / 1000, min 1)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--alloc-iterations", type=int, default=3)
+    parser.add_argument("--only", default=None, help="substring filter on benchmark names")
+    parser.add_argument("--results-dir", default="bench_results")
+    parser.add_argument("--compare", default=None, help="previous result file to compare against")
+    parser.add_argument("--startup", action="store_true", help="measure import time and time-to-first-request instead")
+    parser.add_argument("--mongo-url", default=os.getenv("MONGO_URL", "mongodb://127.0.0.1:27017/"))
+    parser.add_argument("--database", default=None,
+                        help=f"benchmark database, dropped and re-seeded as needed (default: {BENCH_DATABASE_PREFIX}<logs>)")
+    args = parser.parse_args()
+    database = args.database or f"{BENCH_DATABASE_PREFIX}{args.logs}"
+    if not database.startswith(BENCH_DATABASE_PREFIX):
+        parser.error(f"--database must start with {BENCH_DATABASE_PREFIX!r}; the benchmark drops its collections")
+
+    if args.startup:
+        result = {"import_ms": measure_import(5), **measure_first_requests(args.mongo_url)}
+        print("🚀 Startup:")
+        for key, value in result.items():
+            print(f"   {key}: {value}")
+        os.makedirs(args.results_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        with open(os.path.join(args.results_dir, f"startup_{stamp}.json"), "w") as f:
+            json.dump(dict(result, created_at=stamp), f, indent=2)
+        return
+
+    users = args.users or max(1, args.logs // 1000)
+    # Set outright: an exported DATABASE_NAME (from .env or the shell) must never be the one seeded
+    os.environ["DATABASE_NAME"] = database
+    os.environ["MONGO_URL"] = args.mongo_url
+    server = load_server()
+    seed_dataset(server.db, args.logs, users)
+
+    loop = asyncio.new_event_loop()
+    # Same state as a served worker: indexes verified and catalogs in memory
+    loop.run_until_complete(server.warm_up())
+    user = loop.run_until_complete(server.get_current_user(session_token="bench-token-bench-user-0", authorization=None))
+    benchmarks = build_benchmarks(server, user)
+
+    started_at = datetime.now(timezone.utc)
+    print("🚀 Running APAK Fitness micro-benchmarks")
+    print(f"Dataset: {args.logs} logs, {users} users, database={server.database_name}")
+    results = {}
+    for name, fn in benchmarks.items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(fn, loop, args.iterations, args.warmup, args.alloc_iterations)
+        print(f"   {name}: {results[name]['median_us']:.1f} µs")
+
+    # Drop the logs written by add_manual_food_log so the seeded dataset stays stable across runs
+    server.db.food_logs.delete_many({"user_id": user.id, "logged_at": {"$gte": started_at}})
+
+    baseline = json.load(open(args.compare)) if args.compare else None
+    print_results(results, baseline)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.results_dir, f"bench_{args.logs}_{stamp}.json")
+    with open(path, "w") as f:
+        json.dump({
+            "created_at": stamp,
+            "dataset": {"logs": args.logs, "users": users},
+            "python": sys.version.split()[0],
+            "benchmarks": results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
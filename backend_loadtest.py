@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+APAK Fitness Backend Load Test Harness
+Boots the API against a local mongod with a stub LLM and a stub auth server,
+drives concurrent user scenarios and reports throughput and latency percentiles
+per endpoint.
+
+Usage:
+    python backend_loadtest.py --users 50 --duration 30 --output loadtest_result.json
+    python backend_loadtest.py --thresholds loadtest_thresholds.json --baseline previous.json
+    python backend_loadtest.py --scenarios log_meal=1 --app-env LOG_WRITE_BATCHING=1 --baseline unbatched.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from PIL import Image
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+DEFAULT_SCENARIOS = "login=1,log_meal=4,poll_stats=8,analyze_photo=1"
+# The load test replaces the catalog and drops its database at exit, so it only touches databases named like this
+LOADTEST_DATABASE_PREFIX = "apak_loadtest_"
+
+LOADTEST_FOODS = [
+    {"id": "mercimek_corbasi", "name": "Mercimek Çorbası", "calories_per_100g": 56, "protein_per_100g": 3.5, "carbs_per_100g": 9, "fat_per_100g": 1, "category": "Çorba"},
+    {"id": "pirinc_pilavi", "name": "Pirinç Pilavı", "calories_per_100g": 130, "protein_per_100g": 2.7, "carbs_per_100g": 28, "fat_per_100g": 0.3, "category": "Tahıl"},
+    {"id": "coban_salata", "name": "Çoban Salata", "calories_per_100g": 45, "protein_per_100g": 1, "carbs_per_100g": 5, "fat_per_100g": 2.5, "category": "Salata"},
+    {"id": "adana_kebap", "name": "Adana Kebap", "calories_per_100g": 280, "protein_per_100g": 18, "carbs_per_100g": 2, "fat_per_100g": 23, "category": "Et"},
+]
+
+# ==================== STUB SERVICES ====================
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    """Answers Emergent Auth session-data lookups for any X-Session-ID"""
+
+    def do_GET(self):
+        session_id = self.headers.get("X-Session-ID", "")
+        body = json.dumps({
+            "email": f"{session_id}@loadtest.local",
+            "name": f"Load Test {session_id[:8]}",
+            "picture": None,
+            "session_token": f"stub_{uuid.uuid4().hex}",
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_auth_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAuthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/session-data"
+
+def install_stub_llm(delay_ms):
+    """Replace emergentintegrations.llm.chat with an offline fake before server is imported"""
+    import types
+
+    class LlmChat:
+        def __init__(self, api_key=None, session_id=None, system_message=None):
+            self.session_id = session_id
+
+        def with_model(self, provider, model):
+            return self
+
+        async def send_message(self, message):
+            await asyncio.sleep(random.uniform(0.5, 1.5) * delay_ms / 1000)
+            food = random.choice(LOADTEST_FOODS)
+            return "```json\n" + json.dumps({
+                "food_name": food["name"],
+                "portion_size": "1 porsiyon",
+                "calories": food["calories_per_100g"] * 2,
+                "protein": food["protein_per_100g"] * 2,
+                "carbs": food["carbs_per_100g"] * 2,
+                "fat": food["fat_per_100g"] * 2,
+            }, ensure_ascii=False) + "\n```"
+
+    class UserMessage:
+        def __init__(self, text, file_contents=None):
+            self.text = text
+            self.file_contents = file_contents or []
+
+    class ImageContent:
+        def __init__(self, image_base64):
+            self.image_base64 = image_base64
+
+    chat = types.ModuleType("emergentintegrations.llm.chat")
+    chat.LlmChat, chat.UserMessage, chat.ImageContent = LlmChat, UserMessage, ImageContent
+    llm = types.ModuleType("emergentintegrations.llm")
+    llm.chat = chat
+    root = types.ModuleType("emergentintegrations")
+    root.llm = llm
+    sys.modules.update({
+        "emergentintegrations": root,
+        "emergentintegrations.llm": llm,
+        "emergentintegrations.llm.chat": chat,
+    })
+
+def serve_app(port, llm_delay_ms):
+    """Entry point of the app subprocess: stub the LLM, then run uvicorn on server.app"""
+    install_stub_llm(llm_delay_ms)
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+    import server
+
+    db = server.connect_database()
+    if not db.name.startswith(LOADTEST_DATABASE_PREFIX):
+        raise SystemExit(f"Refusing to replace the catalog of {db.name!r}: load test databases must be named {LOADTEST_DATABASE_PREFIX}*")
+    db.turkish_foods.delete_many({})
+    db.turkish_foods.insert_many([dict(food) for food in LOADTEST_FOODS])
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+def start_mongod(mongod_binary, port):
+    dbpath = os.path.join("/tmp", f"apak_loadtest_mongod_{port}")
+    os.makedirs(dbpath, exist_ok=True)
+    process = subprocess.Popen(
+        [mongod_binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, f"mongodb://127.0.0.1:{port}/"
+
+def start_app(port, mongo_url, database_name, auth_url, llm_delay_ms, app_env=None, rate_limits=""):
+    env = dict(os.environ)
+    env.update({
+        "MONGO_URL": mongo_url,
+        "DATABASE_NAME": database_name,
+        "EMERGENT_AUTH_URL": auth_url,
+        "GEMINI_API_KEY": "stub",
+        # Every virtual user registers and logs in from 127.0.0.1, so the per-IP defaults
+        # (register=5/3600, login=10/60) would reject most of them; off unless asked for
+        "RATE_LIMITS": rate_limits,
+    })
+    env.update(app_env or {})
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-app", "--port", str(port), "--llm-delay-ms", str(llm_delay_ms)],
+        env=env,
+        cwd=BACKEND_DIR,
+    )
+
+async def wait_until_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            try:
+                response = await http.get(f"{base_url}/api/health")
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"API did not become ready at {base_url} within {timeout}s")
+
+# ==================== METRICS ====================
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, status):
+        self.samples.setdefault(endpoint, []).append(seconds * 1000)
+        statuses = self.statuses.setdefault(endpoint, {})
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if status == "error" or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+                "mean_ms": sum(ordered) / len(ordered),
+                "p50_ms": percentile(ordered, 50),
+                "p95_ms": percentile(ordered, 95),
+                "p99_ms": percentile(ordered, 99),
+                "max_ms": ordered[-1],
+                "statuses": self.statuses[endpoint],
+            }
+        total = sum(item["requests"] for item in endpoints.values())
+        return {
+            "total_requests": total,
+            "total_errors": sum(item["errors"] for item in endpoints.values()),
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+# ==================== SCENARIOS ====================
+
+class VirtualUser:
+    def __init__(self, http, recorder, index, test_image):
+        self.http = http
+        self.recorder = recorder
+        self.index = index
+        self.test_image = test_image
+        self.email = f"loadtest_{index}_{uuid.uuid4().hex[:8]}@loadtest.local"
+        self.password = "loadtest-password"
+        self.headers = {}
+        self.log_ids = []
+
+    async def request(self, method, url, endpoint, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, time.perf_counter() - started, "error")
+            return None
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code)
+        return response
+
+    def use_token(self, response):
+        if response is not None and "session_token" in response.cookies:
+            self.headers = {"Authorization": f"Bearer {response.cookies['session_token']}"}
+
+    async def register(self):
+        response = await self.request(
+            "POST", "/api/auth/register", "POST /api/auth/register",
+            params={"email": self.email, "password": self.password, "name": f"Load Test {self.index}"},
+        )
+        self.use_token(response)
+
+    async def login(self):
+        if random.random() < 0.5:
+            response = await self.request(
+                "POST", "/api/auth/login", "POST /api/auth/login",
+                params={"email": self.email, "password": self.password},
+            )
+            self.use_token(response)
+        else:
+            # OAuth path through the stub auth server; keep the password session afterwards
+            saved = self.headers
+            response = await self.request(
+                "POST", "/api/auth/session", "POST /api/auth/session",
+                params={"session_id": f"oauth{self.index}"},
+            )
+            self.headers = saved
+        await self.request("GET", "/api/auth/me", "GET /api/auth/me")
+
+    async def log_meal(self):
+        food = random.choice(LOADTEST_FOODS)
+        await self.request(
+            "POST", "/api/food-logs/manual", "POST /api/food-logs/manual",
+            params={"food_name": food["name"], "portion_grams": random.choice([50, 100, 150, 250])},
+        )
+        if random.random() < 0.3:
+            await self.request("POST", "/api/workout-logs", "POST /api/workout-logs", params={
+                "exercise_name": "Yürüyüş (Hızlı)",
+                "duration_minutes": 30,
+                "calories_burned": 150,
+            })
+        await self.request("GET", "/api/food-logs", "GET /api/food-logs")
+
+    async def poll_stats(self):
+        await self.request("GET", "/api/stats/daily", "GET /api/stats/daily")
+        if random.random() < 0.25:
+            await self.request("GET", "/api/stats/weekly", "GET /api/stats/weekly")
+        if random.random() < 0.1:
+            await self.request("GET", "/api/achievements", "GET /api/achievements")
+
+    async def analyze_photo(self):
+        await self.request(
+            "POST", "/api/analyze-food", "POST /api/analyze-food",
+            files={"file": ("meal.jpg", self.test_image, "image/jpeg")},
+        )
+
+async def run_user(user, scenarios, weights, deadline, think_time):
+    await user.register()
+    while time.monotonic() < deadline:
+        scenario = random.choices(scenarios, weights=weights)[0]
+        await getattr(user, scenario)()
+        if think_time:
+            await asyncio.sleep(random.uniform(0, 2 * think_time))
+
+async def run_load(base_url, users, duration, scenario_spec, think_time, ramp_up):
+    scenarios, weights = [], []
+    for item in scenario_spec.split(","):
+        name, _, weight = item.partition("=")
+        if not hasattr(VirtualUser, name.strip()):
+            raise ValueError(f"Unknown scenario: {name}")
+        scenarios.append(name.strip())
+        weights.append(float(weight or 1))
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), color="orange").save(buffer, format="JPEG")
+    test_image = buffer.getvalue()
+
+    recorder = LatencyRecorder()
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        started = time.monotonic()
+        deadline = started + ramp_up + duration
+        tasks = []
+        for index in range(users):
+            user = VirtualUser(http, recorder, index, test_image)
+            tasks.append(asyncio.create_task(run_user(user, scenarios, weights, deadline, think_time)))
+            if ramp_up:
+                await asyncio.sleep(ramp_up / users)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+    return recorder.summary(elapsed), elapsed
+
+# ==================== REGRESSION CHECKS ====================
+
+def check_regressions(result, thresholds=None, baseline=None, max_regression=0.2):
+    """Return human-readable violations of absolute thresholds and of a baseline run.
+
+    thresholds: {"GET /api/stats/daily": {"p95_ms": 50, "error_rate": 0.01}, "*": {...}}
+    """
+    violations = []
+    endpoints = result["endpoints"]
+
+    for endpoint, stats in endpoints.items():
+        limits = dict((thresholds or {}).get("*", {}))
+        limits.update((thresholds or {}).get(endpoint, {}))
+        for metric, limit in limits.items():
+            if metric == "error_rate":
+                value = stats["errors"] / stats["requests"]
+            else:
+                value = stats.get(metric)
+            if value is not None and value > limit:
+                violations.append(f"{endpoint} {metric}={value:.3f} exceeds threshold {limit}")
+
+    if baseline:
+        for endpoint, stats in endpoints.items():
+            previous = baseline.get("endpoints", {}).get(endpoint)
+            if not previous:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                if previous[metric] and stats[metric] > previous[metric] * (1 + max_regression):
+                    violations.append(
+                        f"{endpoint} {metric} regressed {previous[metric]:.1f} -> {stats[metric]:.1f} ms"
+                    )
+
+    return violations
+
+def print_report(result, elapsed):
+    print("\n" + "=" * 96)
+    print(f"📊 LOAD TEST RESULTS ({elapsed:.1f}s, {result['total_requests']} requests, "
+          f"{result['throughput_rps']:.1f} req/s, {result['total_errors']} errors)")
+    print("=" * 96)
+    print(f"{'endpoint':<34}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"{endpoint:<34}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print("=" * 96)
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the APAK Fitness API")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady load after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=2)
+    parser.add_argument("--think-time", type=float, default=0.1, help="mean pause between scenario steps")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help="weighted scenario mix, e.g. login=1,poll_stats=5")
+    parser.add_argument("--llm-delay-ms", type=float, default=800, help="mean latency of the stub LLM")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the booted API, e.g. LOG_WRITE_BATCHING=1 (repeatable)")
+    parser.add_argument("--rate-limits", default="", metavar="SPEC",
+                        help="RATE_LIMITS for the booted API, e.g. analyze_food=20/3600 (default: none)")
+    parser.add_argument("--base-url", default=None, help="test an already running API instead of booting one")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--mongo-url", default=os.getenv("LOADTEST_MONGO_URL", "mongodb://127.0.0.1:27017/"))
+    parser.add_argument("--mongod", default=None, help="path to a mongod binary to start on a scratch dbpath")
+    parser.add_argument("--database", default=f"{LOADTEST_DATABASE_PREFIX}{int(time.time())}",
+                        help=f"scratch database, dropped at exit unless --keep-database (must start with {LOADTEST_DATABASE_PREFIX!r})")
+    parser.add_argument("--keep-database", action="store_true")
+    parser.add_argument("--output", default="loadtest_result.json")
+    parser.add_argument("--thresholds", default=None, help="JSON file with per-endpoint limits")
+    parser.add_argument("--baseline", default=None, help="previous result file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative slowdown vs baseline")
+    parser.add_argument("--serve-app", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_app:
+        serve_app(args.port, args.llm_delay_ms)
+        return 0
+    if not args.database.startswith(LOADTEST_DATABASE_PREFIX):
+        parser.error(f"--database must start with {LOADTEST_DATABASE_PREFIX!r}; the load test drops it at exit")
+    app_env = dict(item.split("=", 1) for item in args.app_env)
+    if "DATABASE_NAME" in app_env:
+        parser.error("use --database instead of --app-env DATABASE_NAME")
+
+    processes = []
+    auth_server = None
+    try:
+        base_url = args.base_url
+        mongo_url = args.mongo_url
+        if not base_url:
+            if args.mongod:
+                mongod, mongo_url = start_mongod(args.mongod, 27099)
+                processes.append(mongod)
+            auth_server, auth_url = start_stub_auth_server()
+            processes.append(start_app(args.port, mongo_url, args.database, auth_url, args.llm_delay_ms, app_env, args.rate_limits))
+            base_url = f"http://127.0.0.1:{args.port}"
+
+        print("🚀 Starting APAK Fitness Load Test")
+        print(f"Target: {base_url}  users={args.users}  duration={args.duration}s  scenarios={args.scenarios}")
+        asyncio.run(wait_until_ready(base_url))
+        result, elapsed = asyncio.run(
+            run_load(base_url, args.users, args.duration, args.scenarios, args.think_time, args.ramp_up)
+        )
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=10)
+        if auth_server:
+            auth_server.shutdown()
+        if not args.base_url and not args.keep_database and args.database.startswith(LOADTEST_DATABASE_PREFIX):
+            from pymongo import MongoClient
+            MongoClient(mongo_url).drop_database(args.database)
+
+    result.update({
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_seconds": elapsed,
+        "config": {
+            "users": args.users,
+            "duration": args.duration,
+            "scenarios": args.scenarios,
+            "llm_delay_ms": args.llm_delay_ms,
+            "base_url": base_url,
+            "app_env": app_env,
+            "rate_limits": args.rate_limits,
+        },
+    })
+    print_report(result, elapsed)
+
+    thresholds = json.load(open(args.thresholds)) if args.thresholds else None
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+    violations = check_regressions(result, thresholds, baseline, args.max_regression)
+    result["violations"] = violations
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Result written to {args.output}")
+
+    if violations:
+        print("\n❌ REGRESSIONS:")
+        for violation in violations:
+            print(f"   {violation}")
+        return 1
+    print("✅ All thresholds met")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The backend modules import each other as top-level modules (`import metrics`), as they do when server.py runs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import mongomock
+import pytest
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["apak_test"]
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cold_storage import ColdLogs, TieredLogs, month_of
+from live_updates import SEQUENCES_COLLECTION
+from log_store import FOOD_FIELDS, BucketedLogs, DocumentLogs
+import tier_cold_logs
+
+NOW = datetime.now(timezone.utc)
+CUTOFF = NOW - timedelta(days=180)
+
+def old_logs(count, user_id="ayse", image_every=0):
+    logs = []
+    for index in range(count):
+        logged_at = NOW - timedelta(days=200 + 9 * index)
+        log = {"id": f"log-{index}", "user_id": user_id, "food_name": "Simit", "calories": 280.0,
+               "logged_at": logged_at, "changed_at": logged_at, "change_seq": index + 1, "is_deleted": False}
+        if image_every and index % image_every == 0:
+            log.update(image_base64="aGVsbG8=", image_sha256="h")
+        logs.append(log)
+    return logs
+
+def tombstone(db, store, log_id, seq=100):
+    return store.delete(db, "ayse", log_id, {"change_seq": seq, "changed_at": NOW})
+
+@pytest.fixture(params=["documents", "buckets"])
+def mode(request, db, monkeypatch):
+    monkeypatch.setattr(tier_cold_logs, "db", db)
+    monkeypatch.setattr(tier_cold_logs, "LOG_STORAGE", request.param)
+    return request.param
+
+def hot_store(mode):
+    return DocumentLogs("food_logs") if mode == "documents" else BucketedLogs("food_log_days", FOOD_FIELDS, "food_log_images")
+
+def test_tiering_pages_through_the_history(db, mode, tmp_path):
+    hot = hot_store(mode)
+    hot.insert(db, old_logs(10, image_every=3))
+    moved, written = tier_cold_logs.tier_user("food", "ayse", CUTOFF, str(tmp_path), batch_size=3)
+    cold = ColdLogs(str(tmp_path), "food")
+    assert moved == 10 and written == cold.size("ayse", cold.months("ayse"))
+    assert hot.find(db, "ayse") == []
+    assert sorted(log["id"] for log in cold.find("ayse")) == sorted(f"log-{index}" for index in range(10))
+    assert sum(1 for log in cold.find("ayse") if log.get("image_base64")) == 4
+    assert db[SEQUENCES_COLLECTION].find_one({"_id": "ayse"})["compacted_seq"] == 10
+
+def test_log_deleted_while_tiering_stays_deleted(db, mode, tmp_path, monkeypatch):
+    hot = hot_store(mode)
+    hot.insert(db, old_logs(4))
+    append = ColdLogs.append
+
+    def append_then_delete(self, user_id, logs):
+        written = append(self, user_id, logs)
+        # The API deletes the log between the copy and the eviction
+        tombstone(db, hot, "log-1")
+        return written
+
+    monkeypatch.setattr(ColdLogs, "append", append_then_delete)
+    tier_cold_logs.tier_user("food", "ayse", CUTOFF, str(tmp_path))
+    cold = ColdLogs(str(tmp_path), "food")
+    assert sorted(log["id"] for log in cold.find("ayse")) == ["log-0", "log-2", "log-3"]
+    tiered = TieredLogs(hot, cold, 180)
+    assert sorted(log["id"] for log in tiered.find(db, "ayse")) == ["log-0", "log-2", "log-3"]
+    assert hot.deleted_ids(db, "ayse", ["log-1", "log-2"]) == {"log-1"}
+
+def test_reads_skip_cold_copies_of_hot_tombstones(db, mode, tmp_path):
+    # A tiering run that stopped after copying, before it evicted or cleaned up
+    hot = hot_store(mode)
+    logs = old_logs(3)
+    hot.insert(db, [dict(log) for log in logs])
+    cold = ColdLogs(str(tmp_path), "food")
+    cold.append("ayse", logs)
+    tombstone(db, hot, "log-0")
+    tiered = TieredLogs(hot, cold, 180)
+
+    assert sorted(log["id"] for log in tiered.find(db, "ayse")) == ["log-1", "log-2"]
+    assert sorted(log["id"] for log in tiered.iterate(db, "ayse", batch_size=1)) == ["log-1", "log-2"]
+    assert sorted(log["id"] for _, log in tiered.snapshot(db, "ayse", None, 10)) == ["log-1", "log-2"]
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Months read from cold partitions"""
+    months = []
+    read = ColdLogs.read
+
+    def counting(self, user_id, month):
+        months.append(month)
+        return read(self, user_id, month)
+
+    monkeypatch.setattr(ColdLogs, "read", counting)
+    return months
+
+def tiered_history(db, mode, tmp_path, count=30):
+    # About three logs a month over nine months, all in the cold tier
+    hot = hot_store(mode)
+    hot.insert(db, old_logs(count))
+    tier_cold_logs.tier_user("food", "ayse", CUTOFF, str(tmp_path))
+    return TieredLogs(hot, ColdLogs(str(tmp_path), "food"), 180)
+
+def test_find_reads_only_the_months_it_needs(db, mode, tmp_path, reads):
+    tiered = tiered_history(db, mode, tmp_path)
+    months = tiered.cold.months("ayse")
+    reads.clear()
+    assert tiered.find(db, "ayse", start=NOW - timedelta(days=30)) == []
+    assert reads == []
+
+    start = datetime.strptime(months[2], "%Y-%m").replace(tzinfo=timezone.utc)
+    end = datetime.strptime(months[4], "%Y-%m").replace(tzinfo=timezone.utc)
+    found = tiered.find(db, "ayse", start=start, end=end)
+    assert found and all(month_of(log["logged_at"]) in months[2:4] for log in found)
+    assert sorted(reads) == months[2:4]
+
+    reads.clear()
+    assert [log["id"] for log in tiered.find(db, "ayse", limit=1)] == ["log-0"]
+    assert reads == [months[-1]]
+
+def test_deleting_a_cold_log_reads_one_month(db, mode, tmp_path, reads):
+    tiered = tiered_history(db, mode, tmp_path)
+    reads.clear()
+    assert tiered.live_ids(db, "ayse", ["log-7", "no-such-log"]) == {"log-7"}
+    assert tombstone(db, tiered, "log-7")["is_deleted"]
+    assert len(reads) == 1
+    assert tiered.live_ids(db, "ayse", ["log-7"]) == set()
+    assert tombstone(db, tiered, "no-such-log") is None and len(reads) == 1
+
+def test_snapshot_pages_open_the_cursor_month_onwards(db, mode, tmp_path, reads):
+    tiered = tiered_history(db, mode, tmp_path)
+    ids, after = [], None
+    while True:
+        reads.clear()
+        page = tiered.snapshot(db, "ayse", after, 2)
+        # A page opens the month its cursor points into, and at most the next one to fill up
+        assert len(reads) <= 2 and (after is None or reads[0] == after[1])
+        ids.extend(log["id"] for _, log in page)
+        if len(page) < 2:
+            break
+        after = page[-1][0]
+    assert sorted(ids) == sorted(f"log-{index}" for index in range(30)) and len(ids) == 30
+
+def test_iterate_streams_one_month_at_a_time(db, mode, tmp_path, reads):
+    tiered = tiered_history(db, mode, tmp_path)
+    reads.clear()
+    logs = tiered.iterate(db, "ayse", batch_size=2)
+    assert next(logs)["id"] == "log-29"
+    assert reads == [tiered.cold.months("ayse")[0]]
+    assert len(list(logs)) == 29
+
+def test_bucket_eviction_keeps_photos_of_deleted_logs(db, tmp_path):
+    hot = hot_store("buckets")
+    hot.insert(db, old_logs(2, image_every=1))
+    tombstone(db, hot, "log-0")
+    hot.evict(db, "ayse", ["log-0", "log-1"])
+    assert [log["id"] for log in hot.find(db, "ayse")] == []
+    assert db.food_log_images.count_documents({}) == 1
+    assert hot.deleted_ids(db, "ayse", ["log-0", "log-1"]) == {"log-0"}
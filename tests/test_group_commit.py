@@ -0,0 +1,101 @@
+import asyncio
+
+import mongomock
+import pytest
+from pymongo import WriteConcern
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError, WriteError
+
+from group_commit import GroupCommitWriter, parse_write_concern
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Sizes of the insert_many calls the writer makes"""
+    sizes = []
+    insert_many = mongomock.collection.Collection.insert_many
+
+    def counting(self, documents, *args, **kwargs):
+        sizes.append(len(documents))
+        return insert_many(self, documents, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_many", counting)
+    return sizes
+
+def fail_with(monkeypatch, error):
+    def failing(self, documents, *args, **kwargs):
+        raise error
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_many", failing)
+
+def insert_all(db, writer, docs):
+    """Insert docs concurrently; returns each one's outcome (None or the exception)"""
+    async def run():
+        results = await asyncio.gather(*(writer.insert(db, "food_logs", doc) for doc in docs), return_exceptions=True)
+        await writer.close(db)
+        return results
+    return asyncio.run(run())
+
+def test_full_batch_is_written_in_one_round_trip(db, batches):
+    writer = GroupCommitWriter(max_batch=3, max_delay_ms=10_000)
+    assert insert_all(db, writer, [{"id": index} for index in range(3)]) == [None] * 3
+    assert batches == [3]
+    assert sorted(doc["id"] for doc in db.food_logs.find()) == [0, 1, 2]
+
+def test_partial_batch_is_written_after_the_delay(db, batches):
+    writer = GroupCommitWriter(max_batch=100, max_delay_ms=5)
+    assert insert_all(db, writer, [{"id": index} for index in range(4)]) == [None] * 4
+    assert batches == [4]
+
+def test_batches_split_at_max_batch(db, batches):
+    writer = GroupCommitWriter(max_batch=2, max_delay_ms=5)
+    assert insert_all(db, writer, [{"id": index} for index in range(5)]) == [None] * 5
+    assert batches == [2, 2, 1]
+
+def test_close_writes_what_is_still_buffered(db, batches):
+    writer = GroupCommitWriter(max_batch=100, max_delay_ms=60_000)
+
+    async def run():
+        tasks = [asyncio.create_task(writer.insert(db, "food_logs", {"id": index})) for index in range(2)]
+        await asyncio.sleep(0)
+        await writer.close(db)
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [None, None]
+    assert batches == [2]
+
+def test_duplicate_key_fails_only_its_own_document(db):
+    db.food_logs.create_index("id", unique=True)
+    db.food_logs.insert_one({"id": 1})
+    writer = GroupCommitWriter(max_batch=3, max_delay_ms=10_000)
+    results = insert_all(db, writer, [{"id": 0}, {"id": 1}, {"id": 2}])
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], DuplicateKeyError) and results[1].code == 11000
+    assert db.food_logs.count_documents({}) == 3
+
+def test_other_write_errors_are_routed_by_index(db, monkeypatch):
+    fail_with(monkeypatch, BulkWriteError({"writeErrors": [{"index": 2, "code": 121, "errmsg": "Document failed validation"}]}))
+    writer = GroupCommitWriter(max_batch=3, max_delay_ms=10_000)
+    results = insert_all(db, writer, [{"id": index} for index in range(3)])
+    assert results[:2] == [None, None]
+    assert type(results[2]) is WriteError and results[2].code == 121
+
+def test_network_failure_fails_the_whole_batch(db, monkeypatch):
+    error = AutoReconnect("connection reset")
+    fail_with(monkeypatch, error)
+    writer = GroupCommitWriter(max_batch=3, max_delay_ms=10_000)
+    assert insert_all(db, writer, [{"id": index} for index in range(3)]) == [error] * 3
+
+def test_batches_are_per_collection(db, batches):
+    writer = GroupCommitWriter(max_batch=2, max_delay_ms=5)
+
+    async def run():
+        await asyncio.gather(*(writer.insert(db, name, {"id": index})
+                               for index in range(2) for name in ("food_logs", "workout_logs")))
+        await writer.close(db)
+
+    asyncio.run(run())
+    assert batches == [2, 2]
+    assert db.food_logs.count_documents({}) == db.workout_logs.count_documents({}) == 2
+
+def test_parse_write_concern():
+    assert parse_write_concern() is None
+    assert parse_write_concern("majority", "true", "500") == WriteConcern(w="majority", j=True, wtimeout=500)
+    assert parse_write_concern("0", "") == WriteConcern(w=0)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from idempotency import IDEMPOTENCY_COLLECTION, IdempotencyStore
+
+ROUTE = "POST /api/workout-logs"
+
+def counting_handler(result=None, delay=0.0):
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result if result is not None else {"id": f"log-{len(calls)}"}
+
+    return handler, calls
+
+def run(store, db, key, handler, user_id="ayse", route=ROUTE, **kwargs):
+    return asyncio.run(store.run(db, key, user_id, route, handler, **kwargs))
+
+def body(response):
+    return json.loads(response.body)
+
+def test_first_call_runs_and_stores_the_response(db):
+    store = IdempotencyStore()
+    handler, calls = counting_handler()
+    assert run(store, db, "k1", handler) == {"id": "log-1"}
+    record = db[IDEMPOTENCY_COLLECTION].find_one({"_id": "ayse:k1"})
+    assert (record["state"], record["status_code"], record["body"], record["route"]) == ("done", 200, {"id": "log-1"}, ROUTE)
+    assert store.is_retry(db, "k1", "ayse", ROUTE) and not store.is_retry(db, "k1", "ayse", "POST /api/food-logs/manual")
+
+def test_retry_replays_without_running_again(db):
+    store = IdempotencyStore()
+    handler, calls = counting_handler()
+    run(store, db, "k1", handler)
+    replayed = run(store, db, "k1", handler)
+    assert len(calls) == 1
+    assert body(replayed) == {"id": "log-1"} and replayed.headers["Idempotent-Replayed"] == "true"
+
+def test_without_a_key_every_call_runs(db):
+    store = IdempotencyStore()
+    handler, calls = counting_handler()
+    run(store, db, None, handler)
+    run(store, db, None, handler)
+    assert len(calls) == 2
+
+def test_concurrent_duplicate_waits_for_the_original(db):
+    store = IdempotencyStore(wait_seconds=5)
+    handler, calls = counting_handler(delay=0.2)
+
+    async def both():
+        return await asyncio.gather(*(store.run(db, "k1", "ayse", ROUTE, handler) for _ in range(2)))
+
+    first, second = asyncio.run(both())
+    assert len(calls) == 1
+    assert first == {"id": "log-1"} and body(second) == {"id": "log-1"}
+
+def test_replay_keeps_the_status_code(db):
+    store = IdempotencyStore()
+    handler, _ = counting_handler()
+    run(store, db, "created", handler, status_code=201)
+    assert run(store, db, "created", handler).status_code == 201
+
+    handler, _ = counting_handler(JSONResponse({"queued": True}, status_code=202))
+    run(store, db, "accepted", handler)
+    replayed = run(store, db, "accepted", handler)
+    assert (replayed.status_code, body(replayed)) == (202, {"queued": True})
+
+def test_failures_are_not_stored(db):
+    store = IdempotencyStore()
+    handler, calls = counting_handler(JSONResponse({"detail": "busy"}, status_code=503))
+    assert run(store, db, "k1", handler).status_code == 503
+    assert db[IDEMPOTENCY_COLLECTION].count_documents({}) == 0
+
+    async def failing():
+        calls.append(1)
+        raise HTTPException(status_code=500, detail="LLM down")
+
+    with pytest.raises(HTTPException):
+        run(store, db, "k1", failing)
+    assert db[IDEMPOTENCY_COLLECTION].count_documents({}) == 0
+    handler, calls = counting_handler()
+    assert run(store, db, "k1", handler) == {"id": "log-1"}
+
+def test_key_reused_on_another_route_is_rejected(db):
+    store = IdempotencyStore()
+    handler, calls = counting_handler()
+    run(store, db, "k1", handler)
+    with pytest.raises(HTTPException) as error:
+        run(store, db, "k1", handler, route="POST /api/food-logs/manual")
+    assert error.value.status_code == 422 and len(calls) == 1
+
+def test_stale_claim_of_another_route_is_not_taken_over(db):
+    store = IdempotencyStore(lock_seconds=1)
+    old = datetime.now(timezone.utc) - timedelta(minutes=5)
+    db[IDEMPOTENCY_COLLECTION].insert_one({"_id": "ayse:k1", "user_id": "ayse", "route": "POST /api/analyze-food",
+                                           "state": "in_progress", "created_at": old})
+    handler, calls = counting_handler()
+    with pytest.raises(HTTPException) as error:
+        run(store, db, "k1", handler)
+    assert error.value.status_code == 422 and calls == []
+
+    db[IDEMPOTENCY_COLLECTION].update_one({"_id": "ayse:k1"}, {"$set": {"route": ROUTE}})
+    assert run(store, db, "k1", handler) == {"id": "log-1"}
+
+def test_waiting_gives_up_at_the_deadline(db, monkeypatch):
+    store = IdempotencyStore(wait_seconds=0.3)
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(seconds):
+        sleeps.append(seconds)
+        await sleep(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", recording_sleep)
+    # Claims keep failing while the record keeps disappearing: the request must back off, not spin
+    monkeypatch.setattr(store, "_claim", lambda *args: False)
+    handler, calls = counting_handler()
+    with pytest.raises(HTTPException) as error:
+        run(store, db, "k1", handler)
+    assert error.value.status_code == 409 and calls == []
+    assert 1 <= len(sleeps) <= 5 and sleeps[0] == 0.05
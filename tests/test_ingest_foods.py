@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from ingest_foods import read_json_array
+
+def write(tmp_path, text):
+    path = tmp_path / "foods.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+def test_items_straddling_chunks_are_read(tmp_path):
+    foods = [{"name": f"Yemek {index}", "calories_per_100g": index} for index in range(50)]
+    assert list(read_json_array(write(tmp_path, json.dumps(foods)), chunk_size=7)) == foods
+
+def test_malformed_array_fails_without_buffering_the_rest(tmp_path, monkeypatch):
+    # An unterminated string swallows the rest of the file
+    path = write(tmp_path, '[{"name": "Simit"}, {"name": "Açma' + " x" * 50_000 + "]")
+    sizes = []
+    original = json.JSONDecoder.raw_decode
+
+    def recording(self, buffer, position=0):
+        sizes.append(len(buffer))
+        return original(self, buffer, position)
+
+    monkeypatch.setattr(json.JSONDecoder, "raw_decode", recording)
+    items = read_json_array(path, chunk_size=1024, max_item_chars=4096)
+    assert next(items) == {"name": "Simit"}
+    with pytest.raises(ValueError, match="no complete JSON value"):
+        next(items)
+    assert max(sizes) <= 4096 + 2 * 1024
+
+def test_truncated_array_raises(tmp_path):
+    items = read_json_array(write(tmp_path, '[{"name": "Simit"}, {"name": '), chunk_size=8)
+    assert next(items) == {"name": "Simit"}
+    with pytest.raises(ValueError):
+        next(items)
@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from leaderboards import STATS_COLLECTION, Leaderboards, add_friendship, friend_ids, iso_week, remove_friendship
+import metrics
+
+def user(user_id):
+    return SimpleNamespace(id=user_id, name=user_id.title(), picture=None)
+
+def workout(db, user_id, days_ago=0, calories=100.0, minutes=30, insert=True):
+    logged_at = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    log = {"id": f"{user_id}-{days_ago}-{calories}", "user_id": user_id, "exercise_name": "Koşu",
+           "duration_minutes": minutes, "calories_burned": calories, "logged_at": logged_at, "is_deleted": False}
+    if insert:
+        db.workout_logs.insert_one(dict(log))
+    return log
+
+def stats(db, user_id):
+    return db[STATS_COLLECTION].find_one({"_id": user_id})
+
+def test_friendships_are_symmetric(db):
+    add_friendship(db, "ayse", "mehmet")
+    add_friendship(db, "ayse", "mehmet")
+    assert friend_ids(db, "ayse") == ["mehmet"] and friend_ids(db, "mehmet") == ["ayse"]
+    remove_friendship(db, "mehmet", "ayse")
+    assert friend_ids(db, "ayse") == [] and friend_ids(db, "mehmet") == []
+
+def test_record_accumulates_weekly_totals(db):
+    boards = Leaderboards()
+    boards.record(db, user("ayse"), workout(db, "ayse", calories=200, minutes=40))
+    boards.record(db, user("ayse"), workout(db, "ayse", calories=150, minutes=20))
+    doc = stats(db, "ayse")
+    assert (doc["calories_burned"], doc["minutes"], doc["workouts"], doc["version"]) == (350, 60, 2, 1)
+    assert doc["week"] == iso_week(datetime.now(timezone.utc))
+
+def test_first_write_of_a_new_week_starts_from_zero(db):
+    boards = Leaderboards()
+    boards.record(db, user("ayse"), workout(db, "ayse", days_ago=14, calories=500))
+    boards.record(db, user("ayse"), workout(db, "ayse", calories=100))
+    doc = stats(db, "ayse")
+    assert (doc["calories_burned"], doc["workouts"]) == (100, 1)
+
+def test_stale_week_reads_as_zero(db):
+    boards = Leaderboards()
+    boards.record(db, user("ayse"), workout(db, "ayse", days_ago=14, calories=500))
+    assert boards.board(db, "ayse")["me"]["value"] == 0
+
+def test_streak_counts_consecutive_days(db):
+    boards = Leaderboards()
+    for days_ago in (4, 2, 1, 0, 0):
+        boards.record(db, user("ayse"), workout(db, "ayse", days_ago=days_ago, calories=100 + days_ago))
+    doc = stats(db, "ayse")
+    assert (doc["current_streak"], doc["longest_streak"]) == (3, 3)
+    assert boards.board(db, "ayse", metric="streak")["me"]["value"] == 3
+
+def test_broken_streak_reads_as_zero(db):
+    boards = Leaderboards()
+    boards.record(db, user("ayse"), workout(db, "ayse", days_ago=3))
+    assert boards.board(db, "ayse", metric="streak")["me"]["value"] == 0
+
+def test_remove_uncounts_and_recounts_the_streak(db):
+    boards = Leaderboards()
+    logs = [workout(db, "ayse", days_ago=days_ago) for days_ago in (2, 1, 0)]
+    for log in logs:
+        boards.record(db, user("ayse"), log)
+    # Deleting yesterday's only workout splits the streak
+    db.workout_logs.update_one({"id": logs[1]["id"]}, {"$set": {"is_deleted": True}})
+    boards.remove(db, "ayse", logs[1])
+    doc = stats(db, "ayse")
+    assert doc["current_streak"] == 1
+    assert doc["last_workout_day"] == datetime.now(timezone.utc).date().isoformat()
+
+def test_remove_keeps_the_streak_while_its_day_has_workouts(db):
+    boards = Leaderboards()
+    for days_ago in (1, 0):
+        boards.record(db, user("ayse"), workout(db, "ayse", days_ago=days_ago))
+    second = workout(db, "ayse", calories=50)
+    boards.record(db, user("ayse"), second)
+    workouts = stats(db, "ayse")["workouts"]
+    finds = []
+    find = boards.workout_logs.find
+    boards.workout_logs.find = lambda *args, **kwargs: finds.append(kwargs) or find(*args, **kwargs)
+    db.workout_logs.update_one({"id": second["id"]}, {"$set": {"is_deleted": True}})
+    boards.remove(db, "ayse", second)
+    # One look at the deleted log's day, no walk over the history
+    assert finds == [{"include_images": False, "limit": 1}]
+    assert (stats(db, "ayse")["current_streak"], stats(db, "ayse")["workouts"]) == (2, workouts - 1)
+
+def test_remove_of_the_streaks_last_day(db):
+    boards = Leaderboards()
+    logs = [workout(db, "ayse", days_ago=days_ago) for days_ago in (2, 1, 0)]
+    for log in logs:
+        boards.record(db, user("ayse"), log)
+    db.workout_logs.update_one({"id": logs[2]["id"]}, {"$set": {"is_deleted": True}})
+    boards.remove(db, "ayse", logs[2])
+    doc = stats(db, "ayse")
+    assert (doc["current_streak"], doc["last_workout_day"]) == (2, logs[1]["logged_at"].date().isoformat())
+
+def test_remove_of_an_earlier_week_leaves_this_week_alone(db):
+    boards = Leaderboards()
+    old = workout(db, "ayse", days_ago=14)
+    boards.record(db, user("ayse"), old)
+    boards.record(db, user("ayse"), workout(db, "ayse", calories=300))
+    db.workout_logs.update_one({"id": old["id"]}, {"$set": {"is_deleted": True}})
+    boards.remove(db, "ayse", old)
+    assert (stats(db, "ayse")["calories_burned"], stats(db, "ayse")["workouts"]) == (300, 1)
+
+def test_board_ranks_ties_with_gaps(db):
+    boards = Leaderboards()
+    for name, calories in (("ayse", 300), ("mehmet", 200), ("zeynep", 200), ("ali", 100)):
+        boards.record(db, user(name), workout(db, name, calories=calories))
+        if name != "ayse":
+            add_friendship(db, "ayse", name)
+    add_friendship(db, "ayse", "can")
+    board = boards.board(db, "ayse")
+    assert [(entry["user_id"], entry["rank"]) for entry in board["top"]] == [
+        ("ayse", 1), ("mehmet", 2), ("zeynep", 2), ("ali", 4), ("can", 5),
+    ]
+    assert board["participants"] == 5
+
+def test_board_limit_still_reports_own_rank(db):
+    boards = Leaderboards()
+    for name, calories in (("ayse", 10), ("mehmet", 200), ("zeynep", 300)):
+        boards.record(db, user(name), workout(db, name, calories=calories))
+    add_friendship(db, "ayse", "mehmet")
+    add_friendship(db, "ayse", "zeynep")
+    board = boards.board(db, "ayse", limit=1)
+    assert [entry["user_id"] for entry in board["top"]] == ["zeynep"]
+    assert (board["me"]["user_id"], board["me"]["rank"]) == ("ayse", 3)
+
+def test_board_only_sees_friends(db):
+    boards = Leaderboards()
+    boards.record(db, user("ayse"), workout(db, "ayse"))
+    boards.record(db, user("stranger"), workout(db, "stranger", calories=999))
+    assert [entry["user_id"] for entry in boards.board(db, "ayse")["top"]] == ["ayse"]
+
+def test_concurrent_write_is_retried_not_lost(db):
+    boards = Leaderboards()
+    boards.record(db, user("ayse"), workout(db, "ayse", calories=100))
+    collection = db[STATS_COLLECTION]
+    find_one = collection.find_one
+    raced = []
+
+    def find_one_then_race(*args, **kwargs):
+        doc = find_one(*args, **kwargs)
+        if not raced:
+            raced.append(True)
+            Leaderboards().record(db, user("ayse"), workout(db, "ayse", calories=50))
+        return doc
+
+    collection.find_one = find_one_then_race
+    try:
+        boards.record(db, user("ayse"), workout(db, "ayse", calories=25))
+    finally:
+        del collection.find_one
+    assert (stats(db, "ayse")["calories_burned"], stats(db, "ayse")["workouts"]) == (175, 3)
+
+def test_exhausted_retries_fall_back_to_an_increment(db):
+    boards = Leaderboards(max_retries=3)
+    for days_ago in (1, 0):
+        boards.record(db, user("ayse"), workout(db, "ayse", days_ago=days_ago, calories=100))
+    before = stats(db, "ayse")
+    collection = db[STATS_COLLECTION]
+    find_one = collection.find_one
+    rounds = []
+
+    def find_one_then_bump(*args, **kwargs):
+        # Another writer wins every round
+        doc = find_one(*args, **kwargs)
+        rounds.append(1)
+        collection.update_one({"_id": "ayse"}, {"$inc": {"version": 1}})
+        return doc
+
+    fallbacks = sum(metrics.leaderboard_fallbacks.values.values())
+    collection.find_one = find_one_then_bump
+    try:
+        boards.record(db, user("ayse"), workout(db, "ayse", calories=25, minutes=10))
+    finally:
+        del collection.find_one
+    doc = stats(db, "ayse")
+    assert len(rounds) == 3
+    assert (doc["calories_burned"], doc["minutes"], doc["workouts"]) == (
+        before["calories_burned"] + 25, before["minutes"] + 10, before["workouts"] + 1)
+    # The streak is recounted from the logs: yesterday and today
+    assert (doc["current_streak"], doc["longest_streak"]) == (2, 2)
+    assert doc["last_workout_day"] == datetime.now(timezone.utc).date().isoformat()
+    assert sum(metrics.leaderboard_fallbacks.values.values()) == fallbacks + 1
+
+def test_iso_week_crosses_years():
+    assert iso_week(datetime(2026, 1, 1, tzinfo=timezone.utc)) == "2026-W01"
+    assert iso_week(datetime(2027, 1, 1, tzinfo=timezone.utc)) == "2026-W53"
@@ -0,0 +1,85 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from live_updates import EVENTS_COLLECTION, LiveUpdates, next_seq
+import server
+
+@pytest.fixture
+def app_db(db, monkeypatch):
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+def user():
+    return server.User(_id="ayse", email="ayse@example.com", name="Ayşe")
+
+def add_food(db):
+    log = {"id": str(uuid.uuid4()), "user_id": "ayse", "food_name": "Simit", "calories": 280.0,
+           "logged_at": datetime.now(timezone.utc), "is_deleted": False}
+    server.stamp_change("ayse", [log])
+    server.food_log_store.insert(db, [log])
+    server.food_logs_created(user(), [log])
+    return log
+
+def test_replay_returns_events_after_the_cursor(db):
+    live = LiveUpdates()
+    first = live.publish(db, "ayse", "a", {})
+    second = live.publish(db, "ayse", "b", {})
+    assert [event["seq"] for event in live.replay(db, "ayse", first)] == [second]
+    assert live.replay(db, "ayse", second) == []
+
+def test_replay_resets_when_events_rolled_out(db):
+    live = LiveUpdates()
+    first = live.publish(db, "ayse", "a", {})
+    live.publish(db, "ayse", "b", {})
+    live.publish(db, "ayse", "c", {})
+    # The capped collection dropped the oldest events
+    db[EVENTS_COLLECTION].delete_many({"seq": {"$lte": first + 1}})
+    assert live.replay(db, "ayse", first) is None
+
+def test_replay_skips_numbers_that_never_had_an_event(db):
+    live = LiveUpdates()
+    first = live.publish(db, "ayse", "a", {})
+    # A write reserved a number and failed before publishing
+    next_seq(db, "ayse")
+    third = live.publish(db, "ayse", "c", {})
+    assert [event["seq"] for event in live.replay(db, "ayse", first)] == [third]
+
+def test_catch_up_resumes_each_user_by_seq(db):
+    live = LiveUpdates()
+    live.loop = asyncio.new_event_loop()
+    subscription = live.subscribe("ayse")
+    first = live.publish(db, "ayse", "a", {})
+    live.caught_up("ayse", first)
+    # Written by another worker whose ObjectIds sort before this one's
+    older_id = ObjectId.from_datetime(datetime(2000, 1, 1, tzinfo=timezone.utc))
+    db[EVENTS_COLLECTION].insert_one({"_id": older_id, "user_id": "ayse", "seq": next_seq(db, "ayse"),
+                                      "type": "b", "data": {}, "created_at": datetime.now(timezone.utc)})
+    third = live.publish(db, "ayse", "c", {})
+    live.publish(db, "mehmet", "d", {})
+    try:
+        live._catch_up(db)
+        live.loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        live.loop.close()
+    events = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+    assert [event["type"] for event in events] == ["b", "c"]
+    assert live.delivered == {"ayse": third}
+    live.unsubscribe("ayse", subscription)
+    assert live.delivered == {}
+
+def test_deleting_a_missing_log_takes_no_sequence_number(app_db):
+    log = add_food(app_db)
+    before = server.live.current_seq(app_db, "ayse")
+    asyncio.run(server.delete_food_log("no-such-log", current_user=user()))
+    asyncio.run(server.delete_workout_log("no-such-log", current_user=user()))
+    assert server.live.current_seq(app_db, "ayse") == before
+
+    asyncio.run(server.delete_food_log(log["id"], current_user=user()))
+    asyncio.run(server.delete_food_log(log["id"], current_user=user()))
+    events = server.live.replay(app_db, "ayse", before)
+    assert [event["type"] for event in events] == ["food_log.deleted"]
+    assert server.live.current_seq(app_db, "ayse") == before + 1
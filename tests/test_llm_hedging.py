@@ -0,0 +1,91 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import llm_hedging
+from llm_hedging import FakeBackend, HedgedModelChain, api_keys, parse_models
+
+def run(chain, backend, prompt=None, images=None):
+    return asyncio.run(chain.run(lambda provider, model: backend.send(provider, model, prompt, images), json.loads))
+
+def test_parse_models_defaults_provider_to_gemini():
+    assert parse_models("gemini:gemini-2.0-flash, openai:gpt-4o-mini,gemini-1.5-flash") == [
+        ("gemini", "gemini-2.0-flash"), ("openai", "gpt-4o-mini"), ("gemini", "gemini-1.5-flash"),
+    ]
+
+def test_api_keys_are_read_per_provider():
+    models = parse_models("gemini-2.0-flash,openai:gpt-4o-mini,anthropic:claude,mistral:small")
+    environ = {"GEMINI_API_KEY": "g", "OPENAI_API_KEY": "", "ANTHROPIC_API_KEY": "a", "MISTRAL_API_KEY": "m"}
+    assert api_keys(models, environ) == {"gemini": "g", "anthropic": "a", "mistral": "m"}
+
+@pytest.mark.parametrize("spec", ["", " ", ", ,"])
+def test_parse_models_rejects_empty_chain(spec):
+    with pytest.raises(ValueError):
+        parse_models(spec)
+
+def test_chain_needs_a_model():
+    with pytest.raises(ValueError):
+        HedgedModelChain([])
+
+def test_slow_model_is_hedged_by_the_next_one():
+    backend = FakeBackend.from_spec("slow=1000,fast=20")
+    chain = HedgedModelChain(parse_models("slow,fast"), default_hedge_ms=50)
+    started = time.perf_counter()
+    result = run(chain, backend)
+    assert result["food_name"] == llm_hedging.FAKE_DISHES[0]["food_name"]
+    assert time.perf_counter() - started < 0.5
+    slow, fast = chain.summary()
+    assert (slow["hedged"], slow["wins"], slow["cancelled"]) == (1, 0, 1)
+    assert (fast["calls"], fast["wins"]) == (1, 1)
+
+def test_failed_model_hands_over_without_waiting_for_the_hedge_delay():
+    backend = FakeBackend.from_spec("bad=10!1,good=10")
+    chain = HedgedModelChain(parse_models("bad,good"), default_hedge_ms=5000)
+    started = time.perf_counter()
+    run(chain, backend)
+    assert time.perf_counter() - started < 1
+    bad, good = chain.summary()
+    assert (bad["failures"], bad["hedged"], good["wins"]) == (1, 0, 1)
+
+def test_last_error_is_raised_when_every_model_fails():
+    backend = FakeBackend.from_spec("bad=1!1,worse=1!1")
+    chain = HedgedModelChain(parse_models("bad,worse"))
+    with pytest.raises(RuntimeError):
+        run(chain, backend)
+    assert [row["failures"] for row in chain.summary()] == [1, 1]
+
+def test_unparsable_answer_counts_as_a_failure():
+    backend = FakeBackend({"garbled": llm_hedging.FakeModel(1, response="not json"), "good": llm_hedging.FakeModel(1)})
+    chain = HedgedModelChain(parse_models("garbled,good"))
+    assert run(chain, backend)["calories"] == llm_hedging.FAKE_DISHES[0]["calories"]
+    assert [row["wins"] for row in chain.summary()] == [0, 1]
+
+def test_same_model_name_under_two_providers_keeps_separate_stats():
+    backend = FakeBackend.from_spec("gemini:shared=1!1,openai:shared=1")
+    chain = HedgedModelChain(parse_models("gemini:shared,openai:shared"))
+    run(chain, backend)
+    gemini, openai = chain.summary()
+    assert (gemini["provider"], gemini["failures"], gemini["wins"]) == ("gemini", 1, 0)
+    assert (openai["provider"], openai["failures"], openai["wins"]) == ("openai", 0, 1)
+
+def test_hedge_delay_follows_the_running_percentile_after_enough_samples():
+    chain = HedgedModelChain(parse_models("m"), default_hedge_ms=4000, min_samples=3)
+    assert chain.hedge_delay(("gemini", "m")) == 4
+    chain.stats[("gemini", "m")].latencies.extend([0.1, 0.2, 0.3])
+    assert chain.hedge_delay(("gemini", "m")) == 0.3
+    assert HedgedModelChain(parse_models("m"), hedge_after_ms=250).hedge_delay(("gemini", "m")) == 0.25
+
+def test_fake_meal_answer_has_dishes_for_every_image():
+    backend = FakeBackend.from_spec("m=1")
+    chain = HedgedModelChain(parse_models("m"))
+    answer = run(chain, backend, prompt='{"images": [{"image_index": 0, "dishes": []}]}', images=["a", "b"])
+    assert [item["image_index"] for item in answer["images"]] == [0, 1]
+    assert all(len(item["dishes"]) == len(llm_hedging.FAKE_DISHES) for item in answer["images"])
+
+def test_fake_backend_check_reports_models_without_a_fake():
+    backend = FakeBackend.from_spec("gemini-2.0-flash=1,openai:gpt-4o-mini=1")
+    backend.check(parse_models("gemini:gemini-2.0-flash,openai:gpt-4o-mini"))
+    with pytest.raises(ValueError, match="anthropic:claude"):
+        backend.check(parse_models("gemini-2.0-flash,anthropic:claude"))
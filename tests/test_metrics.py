@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def write_worker(directory, pid, failures, checked_out):
+    values = {
+        metrics.llm_failures.name: [[["fake", "m"], failures]],
+        metrics.mongo_pool_checked_out.name: [[["db:27017"], checked_out]],
+    }
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump({"pid": pid, "values": values}, f)
+
+def test_exited_workers_are_folded_into_one_file(tmp_path):
+    directory = str(tmp_path)
+    first, second = exited_pid(), exited_pid()
+    write_worker(directory, first, 2, 5)
+    write_worker(directory, second, 3, 7)
+
+    merged = metrics._merged_values(directory)
+    assert merged[metrics.llm_failures.name][("fake", "m")] == 5
+    # Gauges only count live workers
+    assert ("db:27017",) not in merged[metrics.mongo_pool_checked_out.name]
+    assert sorted(os.listdir(directory)) == sorted([".lock", metrics.EXITED_FILE, f"{os.getpid()}.json"])
+
+    # Folding again, after another worker exits, keeps the totals
+    third = exited_pid()
+    write_worker(directory, third, 1, 1)
+    assert metrics._merged_values(directory)[metrics.llm_failures.name][("fake", "m")] == 6
+    assert metrics._merged_values(directory)[metrics.llm_failures.name][("fake", "m")] == 6
+    assert not os.path.exists(os.path.join(directory, f"{third}.json"))
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+from quick_foods import QUICK_FOODS_COLLECTION, QuickFoods
+
+START = datetime(2026, 3, 2, 8, tzinfo=timezone.utc)
+
+def food_log(db, name, minutes, calories=100.0, recipe_id=None, user_id="u1", insert=True):
+    log = {
+        "id": f"{name}-{minutes}", "user_id": user_id, "food_name": name, "portion_size": f"{calories:.0f} kcal",
+        "calories": calories, "protein": 1.0, "carbs": 2.0, "fat": 3.0,
+        "logged_at": START + timedelta(minutes=minutes), "is_deleted": False,
+    }
+    if recipe_id:
+        log["recipe_id"] = recipe_id
+    if insert:
+        db.food_logs.insert_one(dict(log))
+    return log
+
+def names(entries):
+    return [entry["food_name"] for entry in entries]
+
+def test_first_write_rebuilds_from_the_logs(db):
+    quick = QuickFoods()
+    food_log(db, "Simit", 0)
+    food_log(db, "Simit", 10)
+    quick.record(db, "u1", [food_log(db, "Ayran", 20)])
+    doc = db[QUICK_FOODS_COLLECTION].find_one({"_id": "u1"})
+    assert {entry["food_name"]: entry["count"] for entry in doc["foods"]} == {"Simit": 2, "Ayran": 1}
+
+def test_record_counts_and_keeps_the_latest_portion(db):
+    quick = QuickFoods()
+    quick.record(db, "u1", [food_log(db, "Simit", 0, calories=280)])
+    quick.record(db, "u1", [food_log(db, "Simit", 30, calories=140), food_log(db, "Çay", 40)])
+    quick.record(db, "u1", [food_log(db, "Ayran", 50)])
+    foods = quick.get(db, "u1")
+    assert names(foods["recent"]) == ["Ayran", "Çay", "Simit"]
+    assert names(foods["frequent"]) == ["Simit", "Ayran", "Çay"]
+    simit = foods["frequent"][0]
+    assert (simit["count"], simit["calories"]) == (2, 140)
+
+def test_recipes_are_counted_by_recipe_id(db):
+    quick = QuickFoods()
+    quick.record(db, "u1", [food_log(db, "Ev yapımı mercimek", 0, recipe_id="r1")])
+    quick.record(db, "u1", [food_log(db, "Mercimek (annemin)", 5, recipe_id="r1")])
+    [entry] = quick.get(db, "u1")["frequent"]
+    assert (entry["key"], entry["count"], entry["food_name"]) == ("r1", 2, "Ev yapımı mercimek")
+
+def test_remove_uncounts_and_drops_at_zero(db):
+    quick = QuickFoods()
+    simit = food_log(db, "Simit", 0)
+    quick.record(db, "u1", [simit])
+    quick.record(db, "u1", [food_log(db, "Simit", 10), food_log(db, "Çay", 20)])
+    quick.remove(db, "u1", simit)
+    quick.remove(db, "u1", food_log(db, "Çay", 20, insert=False))
+    quick.remove(db, "u1", food_log(db, "Unknown", 30, insert=False))
+    [entry] = quick.get(db, "u1")["frequent"]
+    assert (entry["food_name"], entry["count"]) == ("Simit", 1)
+
+def test_trim_keeps_the_union_of_most_recent_and_most_frequent(db):
+    quick = QuickFoods(top_k=2)
+    quick.record(db, "u1", [food_log(db, "Simit", minute) for minute in range(3)])
+    quick.record(db, "u1", [food_log(db, "Çay", minute) for minute in range(10, 12)])
+    quick.record(db, "u1", [food_log(db, "Ayran", 20), food_log(db, "Pilav", 21), food_log(db, "Lahmacun", 22)])
+    doc = db[QUICK_FOODS_COLLECTION].find_one({"_id": "u1"})
+    # Lahmacun and Pilav are the two most recent, Simit and Çay the two most frequent
+    assert sorted(entry["food_name"] for entry in doc["foods"]) == ["Lahmacun", "Pilav", "Simit", "Çay"]
+
+def test_concurrent_write_is_retried_not_lost(db):
+    quick = QuickFoods()
+    quick.record(db, "u1", [food_log(db, "Simit", 0)])
+    collection = db[QUICK_FOODS_COLLECTION]
+    find_one = collection.find_one
+    raced = []
+
+    def find_one_then_race(*args, **kwargs):
+        doc = find_one(*args, **kwargs)
+        if not raced:
+            # Another request lands between this read and the compare-and-set below
+            raced.append(True)
+            QuickFoods().record(db, "u1", [food_log(db, "Çay", 5)])
+        return doc
+
+    collection.find_one = find_one_then_race
+    try:
+        quick.record(db, "u1", [food_log(db, "Ayran", 10)])
+    finally:
+        del collection.find_one
+    doc = find_one({"_id": "u1"})
+    assert sorted(entry["food_name"] for entry in doc["foods"]) == ["Ayran", "Simit", "Çay"]
+    assert doc["version"] == 2
+
+def test_persistent_contention_drops_the_document_for_a_rebuild(db):
+    quick = QuickFoods(max_retries=2)
+    quick.record(db, "u1", [food_log(db, "Simit", 0)])
+    collection = db[QUICK_FOODS_COLLECTION]
+    find_one = collection.find_one
+
+    def stale_find_one(*args, **kwargs):
+        doc = find_one(*args, **kwargs)
+        if doc is not None:
+            doc["version"] -= 1
+        return doc
+
+    collection.find_one = stale_find_one
+    try:
+        quick.record(db, "u1", [food_log(db, "Çay", 5)])
+    finally:
+        del collection.find_one
+    assert collection.count_documents({}) == 0
+    assert names(quick.get(db, "u1")["frequent"]) == ["Çay", "Simit"]
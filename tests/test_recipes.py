@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import recipes
+import server
+
+SIMIT = {"name": "Simit", "calories_per_100g": 275.0, "protein_per_100g": 9.0, "carbs_per_100g": 52.0, "fat_per_100g": 4.0}
+PEYNIR = {"name": "Beyaz Peynir", "calories_per_100g": 310.0, "protein_per_100g": 17.0, "carbs_per_100g": 1.0, "fat_per_100g": 26.0}
+
+def test_per_100g_weights_ingredients_by_grams():
+    # 100 g simit + 50 g peynir = 275 + 155 kcal over 150 g
+    calories, protein, carbs, fat = recipes.per_100g([SIMIT, PEYNIR], [100, 50])
+    assert calories == pytest.approx(430 / 1.5)
+    assert protein == pytest.approx(17.5 / 1.5)
+    assert (carbs, fat) == (pytest.approx(52.5 / 1.5), pytest.approx(17 / 1.5))
+
+def test_cooked_weight_concentrates_the_dish():
+    raw = recipes.per_100g([SIMIT], [200])
+    # Half the water cooked off: the same nutrients in 100 g of dish
+    assert recipes.per_100g([SIMIT], [200], cooked_grams=100) == pytest.approx([value * 2 for value in raw])
+
+def test_portion_scales_from_100g():
+    recipe = dict(zip(recipes.NUTRIENT_FIELDS, recipes.per_100g([SIMIT, PEYNIR], [100, 50])))
+    assert recipes.portion(recipe, 150) == pytest.approx({"calories": 430, "protein": 17.5, "carbs": 52.5, "fat": 17})
+    assert recipes.portion(recipe, 0)["calories"] == 0
+
+def test_weightless_dish_is_rejected():
+    with pytest.raises(ValueError):
+        recipes.per_100g([SIMIT], [0])
+    with pytest.raises(ValueError):
+        recipes.per_100g([SIMIT, PEYNIR], [100])
+
+@pytest.mark.parametrize("data", [
+    {"name": "Tost", "ingredients": []},
+    {"name": "", "ingredients": [{"food_name": "Simit", "grams": 100}]},
+    {"name": "Tost", "ingredients": [{"food_name": "", "grams": 100}]},
+    {"name": "Tost", "ingredients": [{"food_name": "Simit", "grams": 0}]},
+    {"name": "Tost", "ingredients": [{"food_name": "Simit", "grams": -5}]},
+    {"name": "Tost", "ingredients": [{"food_name": "Simit", "grams": float("nan")}]},
+    {"name": "Tost", "ingredients": [{"food_name": "Simit", "grams": 100}], "cooked_grams": 0},
+    {"name": "Tost", "ingredients": [{"food_name": "Simit", "grams": 1}] * (server.MAX_RECIPE_INGREDIENTS + 1)},
+])
+def test_invalid_recipes_are_rejected(data):
+    with pytest.raises(ValidationError):
+        server.RecipeCreate(**data)
+
+def test_recipe_portion_must_be_positive(db, monkeypatch):
+    monkeypatch.setattr(server, "db", db)
+    server.app.dependency_overrides[server.get_current_user] = lambda: server.User(_id="ayse", email="ayse@example.com", name="Ayşe")
+    try:
+        response = TestClient(server.app).post("/api/food-logs/recipe", params={"recipe_id": "r1", "portion_grams": 0})
+    finally:
+        server.app.dependency_overrides.clear()
+    assert response.status_code == 422
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from live_updates import SEQUENCES_COLLECTION, next_seq
+from log_store import FOOD_FIELDS, BucketedLogs, DocumentLogs
+import sync
+
+def food(db, user_id, log_id, minutes_ago=60, seq=True, store=None):
+    changed_at = datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)
+    log = {"id": log_id, "user_id": user_id, "food_name": "Simit", "calories": 280.0,
+           "logged_at": changed_at, "changed_at": changed_at, "is_deleted": False}
+    if seq:
+        log["change_seq"] = next_seq(db, user_id)
+    (store or DocumentLogs("food_logs")).insert(db, [log])
+    return log
+
+def settle(db, user_id, minutes_ago=60):
+    db[SEQUENCES_COLLECTION].update_one(
+        {"_id": user_id}, {"$set": {"updated_at": datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)}}, upsert=True)
+
+def delete(db, user_id, log_id, store=None):
+    change = {"change_seq": next_seq(db, user_id), "changed_at": datetime.now(timezone.utc)}
+    return (store or DocumentLogs("food_logs")).delete(db, user_id, log_id, change)
+
+def snapshot(db, user_id, limit, **kwargs):
+    """Every page of a full snapshot; returns (change ids in order, last page)"""
+    ids, after = [], None
+    while True:
+        page = sync.changes_since(db, user_id, limit=limit, after=after, **kwargs)
+        assert len(page["changes"]) <= limit
+        ids.extend((change["type"], change["id"]) for change in page["changes"])
+        if not page["has_more"]:
+            return ids, page
+        assert page["after"] and page["cursor"] == 0
+        after = page["after"]
+
+def test_snapshot_pages_cover_every_live_record_once(db):
+    db.users.insert_one({"_id": "ayse", "name": "Ayşe"})
+    legacy = [food(db, "ayse", f"legacy-{index}", seq=False) for index in range(3)]
+    logs = [food(db, "ayse", f"log-{index}") for index in range(5)]
+    delete(db, "ayse", "log-2")
+    db.workout_logs.insert_one({"id": "run", "user_id": "ayse", "exercise_name": "Koşu", "is_deleted": False,
+                                "logged_at": datetime.now(timezone.utc), "change_seq": next_seq(db, "ayse")})
+    db.achievements.insert_one({"id": "first-log", "user_id": "ayse", "earned_at": datetime.now(timezone.utc)})
+    settle(db, "ayse")
+
+    ids, last = snapshot(db, "ayse", limit=2)
+    expected = ([("food_log", log["id"]) for log in legacy + logs if log["id"] != "log-2"]
+                + [("workout_log", "run"), ("achievement", "first-log"), ("profile", "ayse")])
+    assert ids == expected
+    assert last["cursor"] == db[SEQUENCES_COLLECTION].find_one({"_id": "ayse"})["seq"]
+
+def test_single_page_snapshot_matches_paged_one(db):
+    db.users.insert_one({"_id": "ayse", "name": "Ayşe"})
+    for index in range(4):
+        food(db, "ayse", f"log-{index}")
+    settle(db, "ayse")
+    paged, _ = snapshot(db, "ayse", limit=1)
+    whole = sync.changes_since(db, "ayse", limit=100)
+    assert not whole["has_more"] and whole["after"] is None
+    assert paged == [(change["type"], change["id"]) for change in whole["changes"]]
+
+def test_writes_during_a_snapshot_are_replayed_after_its_cursor(db):
+    for index in range(4):
+        food(db, "ayse", f"log-{index}")
+    settle(db, "ayse")
+    first = sync.changes_since(db, "ayse", limit=2)
+    delete(db, "ayse", "log-0")
+    food(db, "ayse", "log-new", minutes_ago=60)
+    settle(db, "ayse")
+    page = sync.changes_since(db, "ayse", limit=100, after=first["after"])
+    assert not page["has_more"]
+
+    delta = sync.changes_since(db, "ayse", since=page["cursor"], settle_seconds=0)
+    assert [(change["op"], change["id"]) for change in delta["changes"]] == [("delete", "log-0"), ("upsert", "log-new")]
+
+def test_snapshot_cursor_holds_back_behind_recent_changes(db):
+    for index in range(3):
+        food(db, "ayse", f"log-{index}")
+    settle(db, "ayse")
+    recent = food(db, "ayse", "log-recent", minutes_ago=0)
+    _, last = snapshot(db, "ayse", limit=2, settle_seconds=60)
+    assert last["cursor"] == recent["change_seq"] - 1
+
+def test_snapshot_of_buckets_pages_in_the_same_order(db):
+    buckets = BucketedLogs("food_log_days", FOOD_FIELDS, "food_log_images")
+    documents = DocumentLogs("food_logs")
+    for index in range(3):
+        log = food(db, "ayse", f"legacy-{index}", seq=False)
+        buckets.insert(db, [{key: value for key, value in log.items() if key != "_id"}])
+    for index in range(4):
+        log = food(db, "ayse", f"log-{index}", minutes_ago=60 * 24 * index)
+        buckets.insert(db, [{key: value for key, value in log.items() if key != "_id"}])
+    delete(db, "ayse", "log-1", store=buckets)
+    delete(db, "ayse", "log-1", store=documents)
+    settle(db, "ayse")
+
+    by_documents, _ = snapshot(db, "ayse", limit=2, sources=[("food_log", documents)])
+    by_buckets, _ = snapshot(db, "ayse", limit=2, sources=[("food_log", buckets)])
+    assert by_buckets == by_documents
+    assert ("food_log", "log-1") not in by_buckets and len(by_buckets) == 6
+
+def test_invalid_snapshot_token_is_rejected(db):
+    with pytest.raises(ValueError):
+        sync.changes_since(db, "ayse", after="not-a-token")
+
+def test_delta_cursor_holds_back_only_on_the_last_page(db):
+    old = [food(db, "ayse", f"log-{index}") for index in range(3)]
+    settle(db, "ayse")
+    recent = [food(db, "ayse", f"recent-{index}", minutes_ago=0) for index in range(2)]
+
+    page = sync.changes_since(db, "ayse", since=old[1]["change_seq"], limit=2, settle_seconds=60)
+    # More to come: the cursor moves to the end of the page even though it holds a recent change
+    assert page["has_more"] and page["cursor"] == recent[0]["change_seq"]
+    page = sync.changes_since(db, "ayse", since=page["cursor"], limit=2, settle_seconds=60)
+    assert not page["has_more"] and [change["id"] for change in page["changes"]] == ["recent-1"]
+    assert page["cursor"] == recent[0]["change_seq"]
+
+def test_delta_cursor_moves_to_the_sequence_once_settled(db):
+    logs = [food(db, "ayse", f"log-{index}") for index in range(2)]
+    # Live events take sequence numbers too, so the sequence can be ahead of every document
+    next_seq(db, "ayse", count=3)
+    settle(db, "ayse")
+    page = sync.changes_since(db, "ayse", since=logs[0]["change_seq"], settle_seconds=60)
+    assert [change["id"] for change in page["changes"]] == ["log-1"]
+    assert page["cursor"] == logs[1]["change_seq"] + 3
+
+def test_delta_cursor_stops_at_returned_changes_while_sequence_is_busy(db):
+    logs = [food(db, "ayse", f"log-{index}") for index in range(2)]
+    # A number was reserved just now but its document is not visible yet
+    next_seq(db, "ayse")
+    page = sync.changes_since(db, "ayse", since=logs[0]["change_seq"], settle_seconds=60)
+    assert page["cursor"] == logs[1]["change_seq"]
+
+def test_cursors_outside_the_sequence_get_a_reset(db):
+    logs = [food(db, "ayse", f"log-{index}") for index in range(3)]
+    db[SEQUENCES_COLLECTION].update_one({"_id": "ayse"}, {"$set": {"compacted_seq": logs[1]["change_seq"]}})
+    assert sync.changes_since(db, "ayse", since=logs[0]["change_seq"])["reset"]
+    assert sync.changes_since(db, "ayse", since=logs[2]["change_seq"] + 1)["reset"]
+    assert not sync.changes_since(db, "ayse", since=logs[1]["change_seq"])["reset"]
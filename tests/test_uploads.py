@@ -0,0 +1,70 @@
+import asyncio
+import base64
+import io
+import os
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.testclient import TestClient
+
+import uploads
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+def upload(data, filename="photo.jpg"):
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    bodies = []
+
+    @app.post("/upload")
+    async def receive_upload(request: Request):
+        try:
+            bodies.append(await request.body())
+        except Exception:
+            # Whatever the app makes of a cut-off body, the client must still get the 413
+            return {"size": None}
+        return {"size": len(bodies[-1])}
+
+    app.add_middleware(uploads.UploadSizeLimitMiddleware, limits={"/upload": 100})
+    client = TestClient(app)
+    client.bodies = bodies
+    return client
+
+def chunks(count, size=30):
+    for _ in range(count):
+        yield b"x" * size
+
+def test_declared_oversized_body_is_rejected_up_front(client):
+    response = client.post("/upload", content=b"x" * 101)
+    assert response.status_code == 413 and client.bodies == []
+
+def test_chunked_oversized_body_gets_a_413_from_the_middleware(client):
+    # A generator body goes out with Transfer-Encoding: chunked and no Content-Length
+    response = client.post("/upload", content=chunks(5))
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Dosya çok büyük"}
+    assert client.bodies == []
+
+def test_chunked_body_within_the_limit_passes(client):
+    response = client.post("/upload", content=chunks(3))
+    assert response.status_code == 200 and response.json() == {"size": 90}
+
+def test_sniff_rejects_a_mislabelled_file():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(uploads.read_image(upload(b"<html>not a photo</html>"), 1024))
+    assert error.value.status_code == 415
+
+@pytest.mark.parametrize("size", [1, 2, 3, uploads.CHUNK_SIZE - 1, uploads.CHUNK_SIZE + 1, 2 * uploads.CHUNK_SIZE + 2])
+def test_piecewise_base64_matches_whole_file_encoding(size):
+    data = PNG + os.urandom(size)
+    image_base64, _, read, mime = asyncio.run(uploads.read_image(upload(data), 10 * uploads.CHUNK_SIZE))
+    assert image_base64 == base64.b64encode(data).decode("ascii")
+    assert (read, mime) == (len(data), "image/png")
+
+def test_oversized_file_is_rejected_while_reading():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(uploads.read_image(upload(PNG + b"x" * 100), 64))
+    assert error.value.status_code == 413